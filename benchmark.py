@@ -0,0 +1,134 @@
+# benchmark.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import sys
+import time
+import threading
+from collections import Counter
+from mongoengine import connect, disconnect
+from pymongo import monitoring
+
+OPERATIONS = Counter()
+
+class OperationListener(monitoring.CommandListener):
+    """Count the commands sent to a Mongo server by name"""
+
+    def started(self, event):
+        OPERATIONS[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def count_mongomock():
+    """Count the collection calls made against mongomock, which publishes no command events"""
+
+    import mongomock
+    names = ['find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many', 'bulk_write', 'aggregate', 'count_documents', 'find_one_and_update']
+    # mongomock implements some calls with others (find_one calls find), so only the outer call is counted
+    local = threading.local()
+    def counted(name, method):
+        def call(self, *args, **kwargs):
+            if getattr(local, 'active', False):
+                return method(self, *args, **kwargs)
+            OPERATIONS[name] += 1
+            local.active = True
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                local.active = False
+        return call
+    for name in names:
+        setattr(mongomock.collection.Collection, name, counted(name, getattr(mongomock.collection.Collection, name)))
+
+def move_before(user_id, history_id):
+    """Move a history position the way the change log hooks did before HistoryTracker: load the User and save it"""
+
+    from models import User
+    from utils import T
+    user = User().get_by_id(user_id)
+    if (user.history_id or None) != (history_id or None):
+        user.history_id = history_id or None
+        user.updated_by = user_id
+        user.updated = T.now()
+        user.save()
+        return True
+    return False
+
+def measure(name, saves, run):
+    """Run a scenario and print the Mongo operations for each save"""
+
+    from utils import LOG_WRITER
+    LOG_WRITER.flush()
+    OPERATIONS.clear()
+    started = time.time()
+    run()
+    LOG_WRITER.flush()
+    elapsed = time.time() - started
+    total = sum(OPERATIONS.values())
+    detail = ', '.join(f'{k} {v}' for k, v in sorted(OPERATIONS.items()))
+    print(f'{name}: {total / saves:.1f} operations per save, {elapsed / saves * 1000:.2f} ms per save ({detail})')
+
+def main(args):
+    """
+    Measure the Mongo operations written for each change log save
+
+    Usage:
+    ```
+        python benchmark.py                  /* run against mongomock */
+        python benchmark.py dreamcraft-bench /* run against a local Mongo database (it is dropped) */
+        python benchmark.py --before         /* move the history position with the old User get and save */
+    ```
+
+    Parameters
+    ----------
+    args : list(str)
+        The database name, or nothing to use mongomock, and --before to measure the old path
+    """
+
+    before = '--before' in args
+    args = [a for a in args if a != '--before']
+    if args:
+        monitoring.register(OperationListener())
+        connection = connect(args[0])
+        connection.drop_database(args[0])
+    else:
+        count_mongomock()
+        connect('benchmark', host='mongomock://localhost')
+    from models import User, Character, HistoryTracker
+    from utils import UnitOfWork, T
+    if before:
+        HistoryTracker.move = staticmethod(move_before)
+    saves = 100
+    user = User().get_or_create('Benchmark User', 'Benchmark Guild')
+    user_id = str(user.id)
+    character = Character(name='Benchmark Character', guild='Benchmark Guild', category='Character', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+    character_id = str(character.id)
+    undo_id = str(character.id)
+
+    def save(history_id):
+        character = Character().get_by_id(character_id)
+        character.description = f'Description {time.time()}'
+        character.updated_by = user_id
+        character.history_id = history_id
+        character.save()
+
+    def command(history_id):
+        # One command: load the user and the character, then save a change
+        with UnitOfWork.begin('benchmark'):
+            User().find('Benchmark User', 'Benchmark Guild')
+            save(history_id)
+
+    print('History position moved with ' + ('a User get and save (before HistoryTracker)' if before else 'HistoryTracker'))
+    measure('Edit', saves, lambda: [command('') for i in range(saves)])
+    measure('Undo', saves, lambda: [command(undo_id) for i in range(saves)])
+    measure('Undo then edit', saves, lambda: [command(undo_id if i % 2 else '') for i in range(saves)])
+    # Saves outside a command (scripts and scheduled jobs) have no identity map holding the user
+    measure('Undo then edit outside a command', saves, lambda: [save(undo_id if i % 2 else '') for i in range(saves)])
+    disconnect()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -12,7 +12,10 @@ from discord.ext.commands.context import Context
 from dotenv import load_dotenv
 
 from config.setup import Setup
-from handlers.dreamcraft import DreamcraftHandler
+from handlers.dispatcher import Dispatcher
+from handlers.scheduler import Scheduler
+from models import check_indexes
+from utils import LOG_WRITER
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
@@ -24,6 +27,10 @@ START = SETUP.start
 HELP = SETUP.help
 
 connect(DATABASE)
+# Build missing indexes and log the hot queries still scanning collections
+check_indexes()
+DISPATCHER = Dispatcher()
+SCHEDULER = Scheduler(DISPATCHER)
 
 
 bot = commands.Bot(command_prefix=PREFIX)
@@ -54,8 +61,12 @@ async def command_handler(ctx: Context, *args) -> None:
         await ctx.send(embed=Embed(title='𝕯𝖗𝖊𝖆𝖒𝖈𝖗𝖆𝖋𝖙 𝕭𝖔𝖙', colour=13400320, description=HELP))
         return
     
-    handler = DreamcraftHandler(ctx, args)
-    title, messages, image = handler.get_messages()
+    if len(args) == 1 and args[0].lower() == 'queue':
+        await ctx.send(embed=Embed(title='𝕯𝖗𝖊𝖆𝖒𝖈𝖗𝖆𝖋𝖙 𝕭𝖔𝖙', colour=13400320, description='\n'.join([SCHEDULER.get_string(), LOG_WRITER.get_string()])))
+        return
+
+    # Queue the command behind the user's earlier commands, then run it in the worker pool
+    title, messages, image = await SCHEDULER.submit(ctx, args)
     if 'COMMAND_SPLIT' in messages:
         messages = messages.split('COMMAND_SPLIT')
     # Concatenate messages and send; handles str and list of str
@@ -141,4 +152,5 @@ async def send_message(ctx: Context, title: str, message: str, image: str='') ->
         embed.set_image(url=image_url)
     await ctx.send(embed=embed)
 
-bot.run(TOKEN)
\ No newline at end of file
+bot.run(TOKEN)
+DISPATCHER.shutdown()
\ No newline at end of file
@@ -10,4 +10,5 @@ from commands.engagement_command import EngagementCommand
 from commands.roll_command import RollCommand
 from commands.undo_command import UndoCommand
 from commands.revision_command import RevisionCommand
-from commands.suggestion_command import SuggestionCommand
\ No newline at end of file
+from commands.suggestion_command import SuggestionCommand
+from commands.cache_command import CacheCommand
\ No newline at end of file
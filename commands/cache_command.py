@@ -0,0 +1,121 @@
+# cache_command.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import traceback
+from config.setup import Setup
+from services import BaseService
+from utils import DOCUMENTS, SHEETS, INVOKABLES, DIALOGS, UNDOS
+
+SETUP = Setup()
+CACHE_HELP = SETUP.cache_help
+
+base_svc = BaseService()
+
+class CacheCommand():
+    """
+    Handle 'cache' commands and subcommands
+
+    Subcommands:
+        help - display a set of instructions on CacheCommand usage
+        clear - empty the caches (Admin only)
+    """
+
+    def __init__(self, parent, ctx, args, guild, user, channel):
+        """
+        Command handler for CacheCommand
+
+        Parameters
+        ----------
+        parent : DreamcraftHandler
+            The handler for Dreamcraft Bot commands and subcommands
+        ctx : object(Context)
+            The Discord.Context object used to retrieve and send information to Discord users
+        args : array(str)
+            The arguments sent to the bot to parse and evaluate
+        guild : Guild
+            The guild object containing information about the server issuing commands
+        user : User
+            The user database object containing information about the user's current setttings, and dialogs
+        channel : Channel
+            The channel from which commands were issued
+
+        Returns
+        -------
+        CacheCommand - object for processing cache commands and subcommands
+        """
+
+        self.parent = parent
+        self.ctx = ctx
+        self.args = args[1:] if args[0] == 'cache' else args
+        self.command = self.args[0].lower() if len(self.args) > 0 else ''
+        self.guild = guild
+        self.user = user
+        self.channel = channel
+        self.can_edit = self.user.role == 'Admin' if self.user else False
+        self.caches = [DOCUMENTS, SHEETS, INVOKABLES, DIALOGS, UNDOS]
+
+    def run(self):
+        """
+        Execute the cache commands by validating and finding their respective methods
+
+        Returns
+        -------
+        list(str) - a list of messages in response the command validation and execution
+        """
+
+        try:
+            # List of subcommands mapped the command methods
+            switcher = {
+                'help': self.help,
+                'clear': self.clear
+            }
+            # Get the function from switcher dictionary
+            func = switcher.get(self.command, self.stats)
+            # Execute the function
+            messages = func()
+            # Send messages
+            return messages
+        except Exception as err:
+            traceback.print_exc()
+            # Log every error
+            base_svc.log(
+                str(self.user.id),
+                self.user.name,
+                str(self.user.id),
+                self.guild.name,
+                'Error',
+                {
+                    'command': self.command,
+                    'args': self.args,
+                    'traceback': traceback.format_exc()
+                }, 'created')
+            return list(err.args)
+
+    def help(self):
+        """Returns the help text for the command"""
+        return [CACHE_HELP]
+
+    def stats(self):
+        """Display the counters for each cache in this worker process
+
+        Returns
+        -------
+        list(str) - the response messages string array
+        """
+
+        return [f'_Process:_ {os.getpid()}'] + [c.get_string() for c in self.caches]
+
+    def clear(self):
+        """Empty each cache in this worker process
+
+        Returns
+        -------
+        list(str) - the response messages string array
+        """
+
+        if not self.can_edit:
+            raise Exception('You do not have permission to clear the caches')
+        [c.clear() for c in self.caches]
+        return ['Cleared the caches'] + self.stats()
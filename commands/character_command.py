@@ -8,9 +8,9 @@ from datetime import timezone
 import copy
 from bson.objectid import ObjectId
 from services import CharacterService, SceneService, ScenarioService
-from models import User, Channel, Scenario, Scene, Character, Log
+from models import User, Channel, Scenario, Scene, Character, Log, GuildRegistry
 from config.setup import Setup
-from utils import TextUtils, Dialog
+from utils import TextUtils, Dialog, Track, Absorption
 import inflect
 p = inflect.engine()
 
@@ -65,6 +65,7 @@ class CharacterCommand():
         counters, counter, count, tickers, ticker, tick - add/edit counter tracks in the character sheet
         stress, st - add/edit stress tracks in the character sheet
         consequence, con - add/edit consequences and conditions in the character sheet
+        absorb - absorb the shifts of a hit with the fewest consequences and stress boxes
         custom - add/edit custom fields in the character sheet
         share - allow other users to view and copy your characters and npcs
         shared - view and copy characters and npcs shared by others
@@ -177,6 +178,7 @@ class CharacterCommand():
                 'st': self.stress,
                 'consequence': self.consequence,
                 'con': self.consequence,
+                'absorb': self.absorb,
                 'custom': self.custom,
                 'share': self.share,
                 'shared': self.shared
@@ -243,7 +245,7 @@ class CharacterCommand():
         list(str) - the response messages string array
         """
 
-        params = {'name__icontains': ' '.join(args[0:]), 'guild': self.guild.name, 'category': 'Character', 'archived': False, 'npc': self.npc}
+        params = {'search': ' '.join(args[0:]), 'guild': self.guild.name, 'category': 'Character', 'archived': False, 'npc': self.npc}
         return char_svc.search(args, Character.filter, params)
 
     def canceler(self, args):
@@ -364,7 +366,7 @@ class CharacterCommand():
         """
 
         search = ' '.join(args[1:]) if len(args) > 1 else self.guild.name
-        guilds = [g['guild'] for g in Character().get_guilds() if g['guild']]
+        guilds = GuildRegistry.get_names()
         guild_list = f'***Guilds:***\n' + '\n'.join([f'    ***{g}***' for g in guilds])
         guild = search
         if not search.lower() == 'all':
@@ -614,7 +616,7 @@ class CharacterCommand():
                 'type_name': 'CHARACTER',
                 'getter': {
                     'method': Character.get_by_page,
-                    'params': {'params': {'name__icontains': char_name, 'guild': self.guild.name, 'category': 'Character', 'archived': False, 'npc': self.npc}}
+                    'params': {'params': {'search': char_name, 'guild': self.guild.name, 'category': 'Character', 'archived': False, 'npc': self.npc}}
                 },
                 'formatter': formatter,
                 'cancel': self.canceler,
@@ -671,7 +673,7 @@ class CharacterCommand():
             'type_name': 'CHARACTER',
             'getter': {
                 'method': Character.get_by_page,
-                'params': {'params': {'name__icontains': char_name, 'guild': self.guild.name, 'npc': self.npc, 'archived': False}}
+                'params': {'params': {'search': char_name, 'guild': self.guild.name, 'npc': self.npc, 'archived': False}}
             },
             'formatter': formatter,
             'cancel': self.canceler,
@@ -739,7 +741,8 @@ class CharacterCommand():
             raise Exception('You do not have permission to copy this character')
         if self.char.category != 'Character':
             raise Exception(f'You may only copy characters. ***{self.char.name}*** is {p.an(self.char.category)}.')
-        guilds = [g['guild'] for g in Character().get_guilds() if g['guild'] and g['guild'].lower() not in self.guild.name.lower()]
+        # The guilds with characters where the user is a member
+        guilds = [g for g in GuildRegistry.get_names(self.user.name, True) if g.lower() not in self.guild.name.lower()]
         if self.can_copy and len(args) == 1:
             if str(self.char.user.id) == str(self.user.id):
                 raise Exception(f'You cannot copy your own character within the same guild')
@@ -768,19 +771,7 @@ class CharacterCommand():
             if existing:
                 raise Exception(f'***{self.char.name}*** is already a character in ***{guild}***')
             messages.append(f'***{self.char.name}*** copied to ***{guild}***\n')
-        children = Character().get_by_parent(self.char)
-        char = copy.deepcopy(self.char)
-        char.id = None
-        char.user = user.id
-        char.guild = guild
-        char_svc.save(char, user)
-        for child in children:
-            new_child = copy.deepcopy(child)
-            new_child.id = None
-            new_child.user = user.id
-            new_child.parent_id = str(char.id)
-            new_child.guild = guild
-            char_svc.save(new_child, user)
+        self.char.copy_to(user, guild)
         return messages
 
     def delete_character(self, args):
@@ -1041,26 +1032,21 @@ class CharacterCommand():
             return ['You don\'t have an active character.\nTry this: ```css\n.d new c "CHARACTER NAME"```']
         elif not self.can_edit:
             raise Exception('You do not have permission to edit this character')
-        elif args[1].lower() == 'none':
-            self.char.refresh = None
-            self.char.fate_points = None
-        elif args[1].lower() in ['refresh', 'r']:
-            if not self.char.refresh:
-                self.char.refresh = 3
-            refresh = int(args[2]) if len(args) == 3 and args[2].isdigit() else self.char.refresh
-            self.char.refresh = refresh
-            self.char.fate_points = self.char.refresh
-        elif args[1] == '+':
-            if not self.char.fate_points:
-                self.char.fate_points = 0
-            points = int(args[2]) if len(args) == 3 and args[2].isdigit() else 1
-            self.char.fate_points += points if self.char.fate_points < 5 else 0
-        elif args[1] == '-':
-            if not self.char.fate_points:
-                self.char.fate_points = 2
-            points = int(args[2]) if len(args) == 3 and args[2].isdigit() else 1
-            self.char.fate_points -= points if self.char.fate_points < 5 else 0
-        char_svc.save(self.char, self.user)
+        points = int(args[2]) if len(args) == 3 and args[2].isdigit() else None
+        def plan(char, mutation):
+            if args[1].lower() == 'none':
+                mutation.unset('refresh').unset('fate_points')
+            elif args[1].lower() in ['refresh', 'r']:
+                refresh = points if points is not None else (char.refresh if char.refresh else 3)
+                mutation.set('refresh', refresh).set('fate_points', refresh)
+            elif args[1] in ['+', '-']:
+                change = (points if points is not None else 1) * (1 if args[1] == '+' else -1)
+                if not char.fate_points:
+                    # Start from 0 to add or 2 to spend
+                    mutation.set('fate_points', (0 if args[1] == '+' else 2) + change)
+                elif char.fate_points < 5:
+                    mutation.inc('fate_points', change)
+        char_svc.mutate(self.char, self.user, plan)
         return [f'Fate Points: {self.char.get_string_fate()}'] if self.char.get_string_fate() else ['Fate points not used by this character']
 
     def custom(self, args):
@@ -1158,7 +1144,7 @@ class CharacterCommand():
         params = {'shared__exists': True, 'archived': False}
         char_name = ' '.join(args[1:])
         if char_name:
-            params['name__icontains'] = char_name
+            params['search'] = char_name
 
         def selector(selection):
             self.char = selection
@@ -1517,7 +1503,7 @@ class CharacterCommand():
         int - the number of available counter ticks
         """
 
-        return sum([1 for c in char.counters[counter_key]['ticks'] if c == O]) if char.counters and counter_key in char.counters else 0
+        return Track.load(char.counters[counter_key]).count_free() if char.counters and counter_key in char.counters else 0
 
     def counter(self, args, check_user=None):
         """Add/edit counters track
@@ -1554,10 +1540,7 @@ class CharacterCommand():
             modified = copy.deepcopy(self.char.counters) if self.char.counters else {}
             name = ' '.join(args[3:])
             key = name.replace(' ','_').replace('__','_').lower()
-            modified[key] = {
-                'name': name.replace('  ',' '),
-                'ticks': [O for i in range(0, int(args[2]))]
-            }
+            modified[key] = dict(Track(['1'] * int(args[2])).to_son(), name=name.replace('  ',' '))
 
         # Handle deleting counters
         elif args[1] in ['delete']:
@@ -1594,10 +1577,21 @@ class CharacterCommand():
             if not available or available < ticks:
                 messages.append(f'Cannot tick for {ticks} {name} ({available} available)')
                 return messages
-            for i in range(0,len(modified[key]['ticks'])):
-                if ticks > 0 and modified[key]['ticks'][i] == O:
-                    ticks -= 1
-                    modified[key]['ticks'][i] = X
+            if not check_user and '.' not in key:
+                # Ticks are written as targeted updates
+                def plan(char, mutation):
+                    track = Track.load(char.counters[key])
+                    track.check(ticks)
+                    if Track.is_stored(char.counters[key]):
+                        mutation.set(f'counters.{key}.checked', track.checked)
+                    else:
+                        mutation.set(f'counters.{key}', dict(track.to_son(), name=char.counters[key]['name']))
+                char_svc.mutate(self.char, self.user, plan)
+                messages.append(f'{self.char.get_string_name(self.user)}{self.char.get_string_counters()}')
+                return messages
+            track = Track.load(modified[key])
+            track.check(ticks)
+            modified[key] = dict(track.to_son(), name=modified[key]['name'])
 
         if check_user:
             return messages
@@ -1620,7 +1614,7 @@ class CharacterCommand():
         int - the number of available stress track marks available
         """
 
-        return sum([1 * (int(s[0]) if s[0].isdigit() else 1) for s in self.char.stress[stress_type] if s[1] == O]) if self.char.stress else 0
+        return Track.load(self.char.stress[stress_type]).get_free_shifts() if self.char.stress else 0
 
     def stress(self, args, check_user=None):
         """Add/edit stress or customize a stress track
@@ -1645,6 +1639,8 @@ class CharacterCommand():
             messages.append(STRESS_HELP)
             return messages
         modified = None
+        plan = None
+        absorbed = 0
         stress_titles = self.char.stress_titles if self.char.stress_titles else STRESS_TITLES
         stress_categories = self.char.stress_categories if self.char.stress_categories else []
         stress_checks = []
@@ -1680,7 +1676,7 @@ class CharacterCommand():
                     messages.append(f'_{title}_ not found in custom stress titles')
                     return messages
                 else:
-                    stress = copy.deepcopy(self.char.stress)
+                    stress = Track.to_sons(self.char.stress)
                     modified = [stress[i] for i in range(0, len(stress)) if title.lower() not in titles[i].lower()]
                     titles = [t for t in titles if title.lower() not in t.lower()]
                     self.char.stress_titles = titles if titles else None
@@ -1695,22 +1691,21 @@ class CharacterCommand():
                     self.char.stress_titles = None
                     messages.append(f'{self.char.get_string()}')
                 elif total.lower() == "fate":
-                    self.char.stress = STRESS
+                    self.char.stress = Track.to_sons(STRESS)
                     self.char.stress_titles = SETUP.stress_titles
                 elif total.lower() == "fae":
-                    self.char.stress = SETUP.stress_FAE
+                    self.char.stress = Track.to_sons(SETUP.stress_FAE)
                     self.char.stress_titles = SETUP.stress_titles_FAE
                 elif total.lower() == "core":
-                    self.char.stress = SETUP.stress_Core
+                    self.char.stress = Track.to_sons(SETUP.stress_Core)
                     self.char.stress_titles = SETUP.stress_titles_Core
                 else:
                     if not total.isdigit():
                         messages.append('Stress shift must be a positive integer')
                         return messages
-                    stress_boxes = []
-                    [stress_boxes.append(['1', O]) for i in range(0, int(total))]
+                    stress_boxes = Track(['1'] * int(total)).to_son()
                     matches = [t for t in titles if title.lower() in t.lower()]
-                    modified = copy.deepcopy(self.char.stress) if self.char.stress_titles and self.char.stress else ([] if self.char.npc or self.char.category != 'Character' else STRESS)
+                    modified = Track.to_sons(self.char.stress) if self.char.stress_titles and self.char.stress else ([] if self.char.npc or self.char.category != 'Character' else Track.to_sons(STRESS))
                     if matches:
                         for i in range(0, len(titles)):
                             if title.lower() in titles[i].lower():
@@ -1723,7 +1718,6 @@ class CharacterCommand():
                     self.char.stress = modified
                 messages.append(f'{self.char.get_string_stress()}')
         elif args[1] in ['refresh', 'r']:
-            modified = copy.deepcopy(self.char.stress)
             if len(args) == 3:
                 if args[2].lower() not in stress_checks:
                     messages.append(f'{args[2].lower()} is not a valid stress type for ***{self.char.name}*** - {stress_check_types}')
@@ -1732,18 +1726,11 @@ class CharacterCommand():
                     stress_type_str = args[2].lower()
                     stress_type = [i for i in range(0, len(stress_titles)) if stress_type_str in [stress_titles[i].lower()[0:2], stress_titles[i].lower()]][0]
                     stress_type_name = stress_titles[stress_type]
-                    for s in range(0, len(self.char.stress[stress_type])):
-                        modified[stress_type][s][1] = O
+                    plan = self.stress_plan([stress_type], O)
                     messages.append(f'Refreshed all of ***{self.char.name}\'s*** _{stress_type_name}_ stress')
-                    self.char.stress = modified
-                    messages.append(f'{self.char.get_string_stress()}')
             else:
-                for i in range(0, len(self.char.stress)):
-                    for s in range(0, len(self.char.stress[i])):
-                        modified[i][s][1] = O
+                plan = self.stress_plan(range(0, len(self.char.stress)), O)
                 messages.append(f'Refreshed all of ***{self.char.name}\'s*** stress')
-                self.char.stress = modified
-                messages.append(f'{self.char.get_string_stress()}')
         elif args[1] in ['delete', 'd']:
             if len(args) == 2:
                 messages.append(f'No stress type provided - {stress_check_types}')
@@ -1762,18 +1749,11 @@ class CharacterCommand():
                 stress_type_str = args[2].lower()
                 stress_type = [i for i in range(0, len(stress_titles)) if stress_type_str in [stress_titles[i].lower()[0:2], stress_titles[i].lower()]][0]
                 stress_type_name = stress_titles[stress_type]
-                available = self.get_available_stress(stress_type)
-                if available == len(self.char.stress[stress_type]):
+                if not Track.load(self.char.stress[stress_type]).count_checked():
                     messages.append(f'***{self.char.name}*** has no _{stress_type_name}_ stress to remove')
                     return messages
-                modified = copy.deepcopy(self.char.stress)
-                for s in range(len(self.char.stress[stress_type])-1,-1,-1):
-                    if shift_int > 0 and self.char.stress[stress_type][s][1] == X:
-                        shift_int -= 1
-                        modified[stress_type][s][1] = O
+                plan = self.stress_plan([stress_type], O, shift_int)
                 messages.append(f'Removed {shift} from ***{self.char.name}\'s*** _{stress_type_name}_ stress')
-                self.char.stress = modified
-                messages.append(f'{self.char.get_string_stress()}')
         else:
             if len(args) == 2:
                 args = args + ('1',)
@@ -1792,22 +1772,55 @@ class CharacterCommand():
             if shift_int > available:
                 messages.append(f'***{self.char.name}*** cannot absorb {shift} {stress_type_name} stress ({available} available)')
                 return messages
-            modified = copy.deepcopy(self.char.stress)
-            for s in range(0,len(self.char.stress[stress_type])):
-                if shift_int > 0 and self.char.stress[stress_type][s][1] == O:
-                    shift_int -= 1
-                    modified[stress_type][s][1] = X
+            plan = self.stress_plan([stress_type], X, shift_int)
             if not check_user:
                 messages.append(f'***{self.char.name}*** absorbed {shift} {stress_type_name} stress')
-                self.char.stress = modified
-                messages.extend(self.absorb_shifts(int(shift)))
-                messages.append(f'{self.char.get_string_stress()}')
+                absorbed = shift_int
         if check_user:
             return messages
+        elif plan:
+            # Box marks are written as targeted updates
+            char_svc.mutate(self.char, self.user, plan)
+            # The attacker's shifts are only absorbed once the stress is written
+            if absorbed:
+                messages.extend(self.absorb_shifts(absorbed))
+            messages.append(f'{self.char.get_string_stress()}')
         else:
             char_svc.save(self.char, self.user)
         return messages
 
+    def stress_plan(self, stress_types, mark, shift_int=None):
+        """Get a plan setting the marks of stress boxes with targeted updates
+
+        Parameters
+        ----------
+        stress_types : list(int)
+            The indexes of the stress tracks to change
+        mark : str
+            The mark to set (X to absorb stress or O to remove it)
+        shift_int : int
+            The number of boxes to change (or None for every box)
+
+        Returns
+        -------
+        function - the plan for the CharacterService mutate method
+        """
+
+        def plan(char, mutation):
+            remaining = shift_int
+            for stress_type in stress_types:
+                track = Track.load(char.stress[stress_type])
+                # Stress is absorbed from the first box and removed from the last
+                changed = track.check(remaining) if mark == X else track.clear(remaining)
+                remaining = remaining - changed if remaining is not None else None
+                if not changed:
+                    continue
+                if Track.is_stored(char.stress[stress_type]):
+                    mutation.set(f'stress.{stress_type}.checked', track.checked)
+                else:
+                    mutation.set(f'stress.{stress_type}', track.to_son())
+        return plan
+
     def consequence(self, args):
         """Add/edit consequences and conditions or customize a consequences or conditions track
         
@@ -1826,7 +1839,8 @@ class CharacterCommand():
             messages.append(CONSEQUENCES_HELP)
             return messages
         modified = None
-        consequences = copy.deepcopy(self.char.consequences) if self.char.consequences else CONSEQUENCES
+        absorbed = 0
+        consequences = Track.load(self.char.consequences if self.char.consequences else CONSEQUENCES)
         consequences_titles = copy.deepcopy(self.char.consequences_titles) if self.char.consequences_titles else CONSEQUENCES_TITLES
         use_consequences = len([c for c in consequences_titles if c in ['Mild', 'Moderate', 'Severe']]) == 3 and len(consequences_titles) == 3
         consequences_shifts = copy.deepcopy(self.char.consequences_shifts) if self.char.consequences_shifts else CONSEQUENCES_SHIFTS
@@ -1857,15 +1871,15 @@ class CharacterCommand():
                     messages.append(f'_{title}_ not found in Condition titles')
                     return messages
                 else:
-                    modified_consequences = []
+                    kept = []
                     modified_titles = []
                     modified_shifts = []
                     for i in range(0, len(consequences_titles)):
                         if title.lower() not in consequences_titles[i].lower():
-                            modified_consequences.append(consequences[i])
+                            kept.append(i)
                             modified_titles.append(consequences_titles[i])
                             modified_shifts.append(consequences_shifts[i])
-                    self.char.consequences = modified_consequences
+                    self.char.consequences = consequences.select(kept).to_son() if kept else []
                     self.char.consequences_titles = modified_titles if modified_titles else None
                     self.char.consequences_shifts = modified_shifts if modified_shifts else None
                     messages.append(f'_{title}_ removed from Conditions titles')
@@ -1878,7 +1892,7 @@ class CharacterCommand():
                     self.char.consequences_shifts = None
                     messages.append(f'{self.char.get_string()}')
                 elif total == "FATE":
-                    self.char.consequences = CONSEQUENCES
+                    self.char.consequences = Track.load(CONSEQUENCES).to_son()
                     self.char.consequences_titles = None
                     self.char.consequences_shifts = None
                 else:
@@ -1886,23 +1900,23 @@ class CharacterCommand():
                         messages.append('Stress shift must be a positive integer')
                         return messages
                     if not self.char.consequences_titles:
-                        consequences = []
+                        consequences = Track([])
                         consequences_titles = []
                         consequences_shifts = []
                     matches = [i for i in range(0, len(consequences_titles)) if title.lower() in consequences_titles[i].lower()]
                     if matches:
                         for i in range(0, len(consequences_titles)):
                             if title.lower() in consequences_titles[i].lower():
-                                consequences[i] = [total, O]
+                                consequences.set_box(i, total)
                                 consequences_titles[i] = title
                                 consequences_shifts[i] = total
                         messages.append(f'Updated the _{title} ({total})_ Conditions title')
                     else:
-                        consequences.append([total, O])
+                        consequences.set_box(len(consequences), total)
                         consequences_titles.append(title)
                         consequences_shifts.append(total)
                         messages.append(f'_{title} ({total})_ added to Conditions titles')
-                    self.char.consequences = consequences
+                    self.char.consequences = consequences.to_son()
                     self.char.consequences_titles = consequences_titles
                     self.char.consequences_shifts = consequences_shifts
         elif args[1] in ['delete', 'd']:
@@ -1916,14 +1930,13 @@ class CharacterCommand():
             severity = [i for i in range(0, len(consequences_titles)) if 1 if severity_str in [consequences_titles[i].lower()[0:2], consequences_titles[i].lower()]][0]
             severity_shift = consequences_shifts[severity]
             severity_name = consequences_titles[severity]
-            if not self.char.consequences or self.char.consequences and self.char.consequences[severity][1] == O:
+            if not self.char.consequences or not Track.load(self.char.consequences).is_checked(severity):
                 messages.append(f'***{self.char.name}*** does not currently have a _{severity_name}_ {consequences_name}')
                 return messages
-            previous = copy.deepcopy(self.char.consequences)
-            modified = copy.deepcopy(self.char.consequences)
-            modified[severity] = [severity_shift, O]
-            self.char.consequences = modified
-            aspect = previous[severity][2] if use_consequences else severity_name
+            modified = Track.load(self.char.consequences)
+            aspect = modified.get_aspect(severity) if use_consequences else severity_name
+            modified.set_box(severity, severity_shift)
+            self.char.consequences = modified.to_son()
             messages.append(f'Removed ***{self.char.name}\'s*** _{severity_name}_ from {consequences_name} ("{aspect}")')
             messages.extend(self.aspect(['a', 'delete', aspect]))
         else:
@@ -1937,33 +1950,119 @@ class CharacterCommand():
             severity = [i for i in range(0, len(consequences_titles)) if 1 if severity_str in [consequences_titles[i].lower()[0:2], consequences_titles[i].lower()]][0]
             severity_shift = consequences_shifts[severity]
             severity_name = consequences_titles[severity]
-            if self.char.consequences[severity][1] == X:
-                messages.append(f'***{self.char.name}*** already has a _{severity_name}_ {consequences_name} ("{self.char.consequences[severity][2]}")')
+            modified = Track.load(self.char.consequences)
+            if modified.is_checked(severity):
+                messages.append(f'***{self.char.name}*** already has a _{severity_name}_ {consequences_name} ("{modified.get_aspect(severity)}")')
                 return messages
             aspect = severity_name if not use_consequences else ' '.join(args[2:])
-            modified = copy.deepcopy(self.char.consequences)
-            if use_consequences:
-                modified[severity] = [severity_shift, X, aspect]
-            else:
-                modified[severity] = [severity_shift, X]
+            modified.set_box(severity, severity_shift, True, aspect if use_consequences else None)
             messages.append(f'***{self.char.name}*** absorbed {severity_shift} shift for a {severity_name} {consequences_name} "{aspect}"')
             messages.extend(self.aspect(['a', aspect]))
-            self.char.consequences = modified
-            # If the character is being targeted, then absorb any available shifts from the attack roll
-            messages.extend(self.absorb_shifts(int(severity_shift)))
+            self.char.consequences = modified.to_son()
             # If the character is being targeted, then the consequence aspect should grant a free invoke
             messages.extend(self.add_free_invokes())
+            absorbed = int(severity_shift)
         messages.append(f'{self.char.get_string_consequences()}')
         char_svc.save(self.char, self.user)
+        # If the character is being targeted, then absorb any available shifts from the attack roll once the consequence is saved
+        if absorbed:
+            messages.extend(self.absorb_shifts(absorbed))
         return messages
 
-    def absorb_shifts(self, shift_int):
+    def absorb(self, args):
+        """Absorb the shifts of a hit with the lowest cost stress boxes and consequences
+        
+        Parameters
+        ----------
+        args : list(str)
+            List of strings with subcommands
+
+        Returns
+        -------
+        list(str) - the response messages string array
+        """
+
+        if not self.char:
+            return ['You don\'t have an active character.\nTry this: ```css\n.d new c "CHARACTER NAME"```']
+        if not self.can_edit:
+            raise Exception('You do not have permission to edit this character')
+        stress_titles = self.char.stress_titles if self.char.stress_titles else STRESS_TITLES
+        consequences_titles = self.char.consequences_titles if self.char.consequences_titles else CONSEQUENCES_TITLES
+        use_consequences = len([c for c in consequences_titles if c in ['Mild', 'Moderate', 'Severe']]) == 3 and len(consequences_titles) == 3
+        # FATE and FAE tracks are titled by their box value, so a hit checks one box of any value
+        by_value = list(stress_titles) in [SETUP.stress_titles, SETUP.stress_titles_FAE]
+        # FATE, FAE and Core hits check at most one box, custom tracks take as many boxes as needed
+        max_boxes = 1 if by_value or list(stress_titles) == SETUP.stress_titles_Core else None
+        args = list(args[1:])
+        stress_types = list(range(0, len(stress_titles)))
+        if not by_value:
+            stress_type = [i for i in stress_types if args and args[0].lower() in [stress_titles[i].lower()[0:2], stress_titles[i].lower()]]
+            stress_check_types = ' or '.join([f'({t[0:2].lower()}){t[2:].lower()}' for t in stress_titles])
+            if stress_type:
+                args = args[1:]
+            elif len(stress_titles) > 1:
+                raise Exception(f'No stress type provided - {stress_check_types}\nTry this: ```css\n.d c absorb {stress_titles[0]} 4```')
+            stress_types = stress_type[0:1] if stress_type else [0]
+        targeted_by = Character.filter(active_target=str(self.char.id)).first()
+        if args and args[0].isdigit():
+            shift_int = int(args[0])
+            args = args[1:]
+        elif targeted_by and targeted_by.last_roll and targeted_by.last_roll.get('shifts_remaining', 0) > 0:
+            shift_int = targeted_by.last_roll['shifts_remaining']
+        else:
+            raise Exception(f'No shifts to absorb.\nTry this: ```css\n.d c absorb {"" if by_value else stress_titles[0] + " "}4 "ASPECT NAME"```')
+        chosen = {}
+        def plan(char, mutation):
+            stress = Track.load_all(char.stress)
+            consequences = Track.load(char.consequences) if char.consequences else None
+            choice = Absorption.solve([stress[t] for t in stress_types if t < len(stress)], consequences, shift_int, max_boxes)
+            if choice is None:
+                raise Exception(f'***{char.name}*** cannot absorb {p.no("shift", shift_int)} and is taken out')
+            # Each consequence needs its own aspect (one name may be given unquoted)
+            names = ([' '.join(args)] if len(choice['consequences']) == 1 and args else args) if use_consequences else []
+            if use_consequences and len(names) != len(choice['consequences']):
+                severities = [consequences_titles[c] for c in choice['consequences']]
+                aspects = ' '.join([f'"{s.upper()} ASPECT"' for s in severities])
+                raise Exception(f'Absorbing {p.no("shift", shift_int)} takes {p.join([f"a _{s}_" for s in severities])} Consequence.\nTry this: ```css\n.d c absorb {"" if by_value else stress_titles[stress_types[0]] + " "}{shift_int} {aspects}```')
+            chosen.update(choice, names=names)
+            tracks = [stress_types[t] for t, b in choice['stress']]
+            for n in range(0, len(tracks)):
+                stress[tracks[n]].checked |= 1 << choice['stress'][n][1]
+            for t in sorted(set(tracks)):
+                if Track.is_stored(char.stress[t]):
+                    mutation.set(f'stress.{t}.checked', stress[t].checked)
+                else:
+                    mutation.set(f'stress.{t}', stress[t].to_son())
+            for n in range(0, len(choice['consequences'])):
+                c = choice['consequences'][n]
+                consequences.set_box(c, consequences.boxes[c], True, names[n] if use_consequences else None)
+            if choice['consequences']:
+                mutation.set('consequences', consequences.to_son())
+        # The chosen boxes and consequences are written together
+        char_svc.mutate(self.char, self.user, plan)
+        stress = Track.load_all(self.char.stress)
+        absorbed_with = [f'{stress[stress_types[t]].boxes[b]} _{stress_titles[stress_types[t]] if stress_types[t] < len(stress_titles) else stress_types[t] + 1}_ stress' for t, b in chosen['stress']]
+        absorbed_with.extend([f'a _{consequences_titles[c]}_ {"Consequence" if use_consequences else "Condition"}' for c in chosen['consequences']])
+        messages = [f'***{self.char.name}*** absorbed {p.no("shift", chosen["absorbed"])} with {p.join(absorbed_with)}']
+        aspects = chosen['names'] if use_consequences else [consequences_titles[c] for c in chosen['consequences']]
+        for aspect in [aspects[i] for i in range(0, len(aspects)) if aspects[i] not in aspects[0:i]]:
+            messages.extend(self.aspect(['a', aspect]))
+            # If the character is being targeted, then the consequence aspect should grant a free invoke
+            messages.extend(self.add_free_invokes(targeted_by))
+        if targeted_by:
+            messages.extend(self.absorb_shifts(chosen['absorbed'], targeted_by))
+        messages.append(f'{self.char.get_string_stress()}{self.char.get_string_consequences()}')
+        return messages
+
+    def absorb_shifts(self, shift_int, targeted_by=None):
         """Absorb shifts from an attack
         
         Parameters
         ----------
         shift_int : int
             Number of shifts to absorb
+        targeted_by : Character
+            The attacking character when it has already been found
 
         Returns
         -------
@@ -1971,27 +2070,32 @@ class CharacterCommand():
         """
 
         messages = []
-        targeted_by = Character.filter(active_target=str(self.char.id)).first()
+        targeted_by = targeted_by if targeted_by else Character.filter(active_target=str(self.char.id)).first()
         if targeted_by and targeted_by.last_roll and targeted_by.last_roll.get('shifts_remaining', 0) > 0:
-            last_roll = copy.deepcopy(targeted_by.last_roll)
-            shifts_remaining = last_roll['shifts_remaining']
-            shifts_remaining = shifts_remaining - shift_int if shifts_remaining >= shift_int else 0
-            last_roll['shifts_remaining'] = shifts_remaining
-            targeted_by.last_roll = last_roll
-            char_svc.save(targeted_by, self.user)
+            def plan(char, mutation):
+                shifts_remaining = char.last_roll.get('shifts_remaining', 0) if char.last_roll else 0
+                if shifts_remaining > 0:
+                    mutation.set('last_roll.shifts_remaining', shifts_remaining - shift_int if shifts_remaining >= shift_int else 0)
+            char_svc.mutate(targeted_by, self.user, plan)
+            shifts_remaining = targeted_by.last_roll.get('shifts_remaining', 0)
             messages.append(f'{targeted_by.active_action} from ***{targeted_by.name}*** has {p.no("shift", shifts_remaining)} left to absorb.')
         return messages
 
-    def add_free_invokes(self):
+    def add_free_invokes(self, targeted_by=None):
         """Add free invokes on consequence aspects from an attack
 
+        Parameters
+        ----------
+        targeted_by : Character
+            The attacking character when it has already been found
+
         Returns
         -------
         list(str) - the response messages string array
         """
 
         messages = []
-        targeted_by = Character.filter(active_target=str(self.char.id)).first()
+        targeted_by = targeted_by if targeted_by else Character.filter(active_target=str(self.char.id)).first()
         if targeted_by and targeted_by.last_roll:
             messages.extend(self.aspect(['a', 'c', 'st', 't', '1', 'Invokes']))
         return messages
\ No newline at end of file
@@ -170,7 +170,7 @@ class EngagementCommand():
         list(str) - the response messages string array
         """
 
-        params = {'name__icontains': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
+        params = {'search': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
         return engagement_svc.search(args, Engagement.filter, params)
 
     def note(self, args):
@@ -403,7 +403,7 @@ class EngagementCommand():
                     'type_name': 'ENGAGEMENT',
                     'getter': {
                         'method': Engagement.get_by_page,
-                        'params': {'params': {'name__icontains': engagement_name, 'scene_id': str(self.sc.id), 'guild': self.guild.name, 'archived': False}}
+                        'params': {'params': {'search': engagement_name, 'scene_id': str(self.sc.id), 'guild': self.guild.name, 'archived': False}}
                     },
                     'formatter': lambda item, item_num, page_num, page_size: f'_ENGAGEMENT #{item_num+1}_\n{item.get_short_string()}',
                     'cancel': canceler,
@@ -467,7 +467,7 @@ class EngagementCommand():
                 'type_name': 'ENGAGEMENT',
                 'getter': {
                     'method': Engagement.get_by_page,
-                    'params': {'params': {'name__icontains': engagement_name, 'scene_id': str(self.sc.id), 'guild': self.guild.name, 'archived': False}}
+                    'params': {'params': {'search': engagement_name, 'scene_id': str(self.sc.id), 'guild': self.guild.name, 'archived': False}}
                 },
                 'formatter': lambda item, item_num, page_num, page_size: f'_ENGAGEMENT #{item_num+1}_\n{item.get_short_string()}',
                 'cancel': canceler,
@@ -10,7 +10,7 @@ from models import Channel, Scenario, Scene, Zone, Engagement, Exchange, User, C
 from commands import CharacterCommand, SceneCommand, ZoneCommand
 from services import EngagementService, ExchangeService, CharacterService, SceneService
 from config.setup import Setup
-from utils import T
+from utils import TextUtils, AspectSearch, Track
 import inflect
 p = inflect.engine()
 
@@ -96,6 +96,7 @@ class RollCommand():
         self.compels = []
         self.errors = []
         self.invokes_cost = 0
+        self.aspect_index = None
 
     def run(self):
         """
@@ -173,9 +174,15 @@ class RollCommand():
         list(str) - the response messages string array
         """
 
-        self.get_available_invokes()
         self.available_invokes = []
-        [self.available_invokes.extend(a['char'].get_available_aspects(a['parent'], self.char)) for a in self.available]
+        if self.args:
+            # List the matches for a search, best match first
+            for match in self.get_aspect_index().search(' '.join(self.args)):
+                owner = match['char'] if match['category'] in ['High Concept', 'Trouble'] else match['parent']
+                self.available_invokes.append(f'***{TextUtils.clean(match["text"])}*** ({match["category"]} of _\'{owner.name}\'_)')
+        else:
+            self.get_available_invokes()
+            [self.available_invokes.extend(a['char'].get_available_aspects(a['parent'], self.char)) for a in self.available]
         if self.available_invokes:
             return ['**Available invokes:**\n        ' + '\n        '.join([a for a in self.available_invokes])]
         else:
@@ -309,16 +316,15 @@ class RollCommand():
             char_name = 'Unspecified Character'
             char = None
             if by_with > 0:
-                char_name = self.args[0:by_with]
-                char = Character.filter(id__in=self.sc.characters, name__icontains=char_name.lower(), guild=self.guild.name, archived=False).first()
+                char_name = ' '.join(self.args[0:by_with])
+                char = Character.filter(id__in=self.sc.characters, search=char_name, guild=self.guild.name, archived=False).first()
             elif self.char and str(self.char.id) in self.sc.characters:
                 char = self.char
                 char_name = char.name
             if not char:
                 raise Exception(f'***{char_name}*** isn\'t a characcter in ***{self.sc.name}***')
             aspect_name = ' '.join(self.args[by_with+1:])
-            self.get_available_invokes()
-            aspects = [a for a in self.available if aspect_name.lower() in a['char'].name.lower()]
+            aspects = [m for m in self.get_aspect_index().search(aspect_name) if m['category'] in ['Aspect', 'Stunt']]
             if not aspects:
                 raise Exception(f'***{aspect_name}*** is not an invokable aspect within the ***{self.sc.name}*** scene')
             char.active_action = 'Compel'
@@ -612,11 +618,9 @@ class RollCommand():
         return self.messages
 
     def save_char(self, char):
-        """Save the Character database object"""
+        """Write the changed fields of the Character database object, checking no other command changed it first"""
 
-        char.updated_by = str(self.user.id)
-        char.updated = T.now()
-        char.save()
+        char_svc.mutate(char, self.user)
 
     # determine skill to validate
     def get_skill(self):
@@ -658,7 +662,7 @@ class RollCommand():
             for invoke in self.invokes:
                 if invoke['stress_titles']:
                     for i in range(0, len(invoke['stress_titles'])):
-                        self.absorb_invoke_stress(invoke['stress_titles'][i], invoke['stress'][i][0][0], invoke['stress_targets'][i])
+                        self.absorb_invoke_stress(invoke['stress_titles'][i], Track.load(invoke['stress'][i]).boxes[0], invoke['stress_targets'][i])
                 # Remove invoked boost aspect
                 if invoke['is_boost']:
                     cmd = CharacterCommand(self.parent, self.ctx, ('c', 'aspect', 'delete', invoke['aspect_name']), self.guild, self.user, self.channel, self.char)
@@ -698,6 +702,9 @@ class RollCommand():
         stress_messages = command.stress(('stress', title, stress))
         if 'cannot absorb' in ''.join(stress_messages):
             raise Exception(*stress_messages)
+        # The stress was written through a copy of the rolling character, so read back its new marks and version
+        if str(target.id) == str(self.char.id):
+            self.char.reload('stress', 'version')
         self.messages.extend(stress_messages)
 
     def get_attack_text(self, char, target):
@@ -875,7 +882,7 @@ class RollCommand():
             for target in targets:
                 stress_target = copy.deepcopy(target['char'])
                 command = CharacterCommand(parent=self.parent, ctx=self.ctx, args=self.args, guild=self.guild, user=self.user, channel=self.channel, char=stress_target)
-                target_errors = command.stress(['st', stress_titles[s], stress[s][0][0]], stress_target)
+                target_errors = command.stress(['st', stress_titles[s], Track.load(stress[s]).boxes[0]], stress_target)
                 if target_errors:
                     for error in target_errors:
                         if 'cannot absorb' in error and aspect_name.lower() not in stress_target.name.lower():
@@ -885,7 +892,7 @@ class RollCommand():
                     stress_targets[s] = stress_target
                     continue
             if stress_targets[s] is None:
-                stress_errors.append(f'Cannot find a target to apply _{stress[s][0][0]} {stress_titles[s]}_ from **{aspect_name}**')
+                stress_errors.append(f'Cannot find a target to apply _{Track.load(stress[s]).boxes[0]} {stress_titles[s]}_ from **{aspect_name}**')
                 if has_stress:
                     [stress_errors.append(has) for has in has_stress]
         return stress_errors, stress_targets        
@@ -966,23 +973,20 @@ class RollCommand():
         """
 
         char = char if char else self.char
-        self.available = char.get_invokable_objects() if char else []
-        scenario_aspects = self.scenario.character.get_invokable_objects() if self.scenario else []
-        self.available.extend(scenario_aspects)
-        sc_aspects = self.sc.character.get_invokable_objects() if self.sc else []
-        self.available.extend(sc_aspects)
-        zone_aspects = self.zone.character.get_invokable_objects() if self.zone else []
-        self.available.extend(zone_aspects)
-        if self.sc and self.sc.characters:
-            for char_id in self.sc.characters:
-                sc_char = Character.get_by_id(char_id)
-                if not char or (char and not char.name == sc_char.name):
-                    self.available.extend(sc_char.get_invokable_objects())
-        if self.zone and self.zone.characters:
-            for char_id in self.zone.characters:
-                z_char = Character.get_by_id(char_id)
-                if not char or (char and not char.name == z_char.name):
-                    self.available.extend(z_char.get_invokable_objects())
+        # The character, scenario, scene and zone trees come from the invokable index in one lookup
+        roots = [str(char.id)] if char else []
+        roots.extend([Character.get_reference_id(item, 'character') for item in [self.scenario, self.sc, self.zone] if item])
+        sc_chars = self.sc.characters if self.sc and self.sc.characters else []
+        zone_chars = self.zone.characters if self.zone and self.zone.characters else []
+        names, invokables, indexes = Character.get_invokables(roots + sc_chars + zone_chars)
+        trees = [id for id in roots if id in invokables]
+        trees.extend([id for id in sc_chars + zone_chars if id in names and (not char or (char and not char.name == names[id]))])
+        self.available = []
+        # The search index of each tree, built once and cached with it
+        self.available_trees = []
+        for id in trees:
+            self.available.extend(invokables[id])
+            self.available_trees.append((indexes[id], invokables[id]))
         return self.available
 
     def find_aspect(self, aspect):
@@ -998,28 +1002,26 @@ class RollCommand():
         list(str) - list of aspects matching the search text
         """
 
-        aspect = aspect.replace('_', ' ')
-        available = self.get_available_invokes()
         aspects = []
         if self.char:
-            for a in available:
-                aspect_list = []
-                if a['char'].category in ['Aspect','Stunt']:
-                    aspect_list.append({'name': a['char'].name.lower(), 'category': a['char'].category})
-                if a['char'].high_concept:
-                    aspect_list.append({'name': a['char'].high_concept.lower(), 'category': 'High Concept'})
-                if a['char'].trouble:
-                    aspect_list.append({'name': a['char'].trouble.lower(), 'category': 'Trouble'})
-                [
-                    aspects.append({'char': a['char'], 'category': asp['category']}) \
-                    for asp in aspect_list \
-                    if aspect.lower() in asp['name'].lower()
-                ]
-                    
-            if aspects:
-                return aspects[0]
+            match = self.get_aspect_index().find(aspect)
+            if match:
+                return {'char': match['char'], 'category': match['category']}
         return aspects
 
+    def get_aspect_index(self):
+        """Get the search over the cached indexes of the available invokable trees
+
+        Returns
+        -------
+        AspectSearch - the search of available aspects, stunts, high concepts and troubles
+        """
+
+        if self.aspect_index is None:
+            self.get_available_invokes()
+            self.aspect_index = AspectSearch(self.available_trees)
+        return self.aspect_index
+
     def roll_next(self, exact_roll=None):
         """Make a fate roll and return the roll information
         
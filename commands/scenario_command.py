@@ -179,7 +179,7 @@ class ScenarioCommand():
         list(str) - the response messages string array
         """
 
-        params = {'name__icontains': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
+        params = {'search': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
         return scenario_svc.search(args, Scenario.filter, params)
 
     def get_parent(self, args):
@@ -402,7 +402,7 @@ class ScenarioCommand():
                     'type_name': 'SCENARIO',
                     'getter': {
                         'method': Scenario.get_by_page,
-                        'params': {'params': {'name__icontains': scenario_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
+                        'params': {'params': {'search': scenario_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
                     },
                     'formatter': lambda item, item_num, page_num, page_size: f'_SCENARIO #{item_num+1}_\n{scenario_svc.get_string(item, self.channel)}',
                     'cancel': canceler,
@@ -465,7 +465,7 @@ class ScenarioCommand():
                 'type_name': 'SCENARIO',
                 'getter': {
                     'method': Scenario.get_by_page,
-                    'params': {'params': {'name__icontains': scenario_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
+                    'params': {'params': {'search': scenario_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
                 },
                 'formatter': lambda item, item_num, page_num, page_size: f'_SCENARIO #{item_num+1}_\n{scenario_svc.get_string(item, self.channel)}',
                 'cancel': canceler,
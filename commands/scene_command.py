@@ -202,7 +202,7 @@ class SceneCommand():
         list(str) - the response messages string array
         """
 
-        params = {'name__icontains': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
+        params = {'search': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
         return scene_svc.search(args, Scene.filter, params)
 
     def note(self, args):
@@ -452,7 +452,7 @@ class SceneCommand():
                     'type_name': 'SCENE',
                     'getter': {
                         'method': Scene.get_by_page,
-                        'params': {'params': {'name__icontains': scene_name, 'scenario_id': str(self.scenario.id), 'guild': self.guild.name, 'archived': False}}
+                        'params': {'params': {'search': scene_name, 'scenario_id': str(self.scenario.id), 'guild': self.guild.name, 'archived': False}}
                     },
                     'formatter': lambda item, item_num, page_num, page_size: f'_SCENE #{item_num+1}_\n{item.get_short_string()}',
                     'cancel': canceler,
@@ -515,7 +515,7 @@ class SceneCommand():
                 'type_name': 'SCENE',
                 'getter': {
                     'method': Scene.get_by_page,
-                    'params': {'params': {'name__icontains': sc_name, 'scenario_id': str(self.scenario.id), 'guild': self.guild.name, 'archived': False}}
+                    'params': {'params': {'search': sc_name, 'scenario_id': str(self.scenario.id), 'guild': self.guild.name, 'archived': False}}
                 },
                 'formatter': lambda item, item_num, page_num, page_size: f'_SCENE #{item_num+1}_\n{item.get_short_string()}',
                 'cancel': canceler,
@@ -167,7 +167,7 @@ class SessionCommand():
         list(str) - the response messages string array
         """
 
-        params = {'name__icontains': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
+        params = {'search': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
         return session_svc.search(args, Session.filter, params)
 
     def note(self, args):
@@ -384,7 +384,7 @@ class SessionCommand():
                     'type_name': 'SESSION',
                     'getter': {
                         'method': Session.get_by_page,
-                        'params': {'params': {'name__icontains': session_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
+                        'params': {'params': {'search': session_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
                     },
                     'formatter': lambda item, item_num, page_num, page_size: f'_SESSION #{item_num+1}_\n{item.get_short_string()}',
                     'cancel': canceler,
@@ -445,7 +445,7 @@ class SessionCommand():
                 'type_name': 'SESSION',
                 'getter': {
                     'method': Session.get_by_page,
-                    'params': {'params': {'name__icontains': session_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
+                    'params': {'params': {'search': session_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
                 },
                 'formatter': lambda item, item_num, page_num, page_size: f'_SESSION #{item_num+1}_\n{item.get_short_string()}',
                 'cancel': canceler,
@@ -5,8 +5,8 @@ __contact__ = 'u/ensosati'
 import traceback
 import math
 from commands import CharacterCommand
-from models import Channel, Scenario, Scene, Zone, Character, User, Log
-from utils import Dialog, TextUtils
+from models import Channel, Scenario, Scene, Zone, Character, User, Log, HistoryTracker
+from utils import Dialog, TextUtils, T, Subtree
 from config.setup import Setup
 from services.character_service import CharacterService
 
@@ -24,8 +24,9 @@ class UndoCommand():
         story - display the undo/redo story
         list, l - display a list of existing changes
         errors, error, err, e - display a list of errors
-        last - undo the last logged change
-        next - redo the next logged change (based on the current history_id)
+        last - undo the last logged change (or the last N changes)
+        since - undo the changes made since a time
+        next - redo the next logged change (based on the current history_id) (or the next N changes)
     """
 
     def __init__(self, parent, ctx, args, guild, user, channel):
@@ -88,6 +89,7 @@ class UndoCommand():
                 'err': self.error_list,
                 'e': self.error_list,
                 'last': self.last,
+                'since': self.since,
                 'next': self.next
             }
             # Get the function from switcher dictionary
@@ -289,14 +291,56 @@ class UndoCommand():
         model = switcher.get(undo.category, None)
         if not model:
             raise Exception(f'Could not find data module for {undo.category}')
-        exclude = ['created', 'updated', 'created_by', 'updated_by']
-        changes = {d: undo.data[d] for d in undo.data if d not in exclude or undo.action == 'created'}
-        undo_changes_str = [f'_{TextUtils.clean(c)}:_ {changes[c]}' for c in changes]
+        changes = self.get_changes(undo)
+        undo_changes_str = [f'_{TextUtils.clean(c)}:_ {changes[c]}' for c in changes if c != Subtree.FIELD]
+        if changes.get(Subtree.FIELD):
+            undo_changes_str.append(f'_descendants:_ {len(changes[Subtree.FIELD])}')
         item = model().get_by_id(undo.parent_id)
         if not item:
             item = model()
         return changes, item, undo_changes_str
 
+    def get_changes(self, undo):
+        """Get the changed values of a change, without the timestamps of an update or the history position
+
+        Parameters
+        ----------
+        undo : Log
+            The change to undo or redo
+
+        Returns
+        -------
+        dict - the changed values
+        """
+
+        exclude = ['created', 'updated', 'created_by', 'updated_by']
+        # The history position belongs to the undo itself
+        return {d: undo.data[d] for d in undo.data if d != 'history_id' and (d not in exclude or undo.action == 'created')}
+
+    def get_count(self, args):
+        """Get the number of changes requested by 'undo last N' or 'redo next N'"""
+
+        return int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
+
+    def get_batch(self, ids, **params):
+        """Get the change logs for a run of undo stack ids
+        
+        Parameters
+        ----------
+        ids : list(str)
+            The change log ids, oldest first
+        params : dict
+            Additional filters for the change logs
+
+        Returns
+        -------
+        list(Log) - the change logs, oldest first
+        """
+
+        positions = {id: i for i, id in enumerate(ids)}
+        logs = Log.filter(id__in=list(positions), **params)
+        return sorted(logs, key=lambda log: positions[str(log.id)])
+
     def last(self, args):
         """Display a dialog to verify the change to undo
         
@@ -311,16 +355,15 @@ class UndoCommand():
         """
 
         messages = []
-        undos = None
-        if self.user.history_id:
-            current_history = Log.get_by_id(self.user.history_id)
-            if current_history:
-                undos = list(Log.filter(updated__lt=current_history.updated, category__ne='Log').order_by('-created').all())
-        if not undos:
-            undos = list(Log.get_by_page({'user_id': str(self.user.id), 'category__ne':'Log'}))
-        if not undos:
+        stack = Log.get_undo_stack(self.user.id, self.user.history_id)
+        # The user's history position is the last change undone, so undo the change before it
+        position = stack['positions'][self.user.history_id] if self.user.history_id else len(stack['ids'])
+        count = self.get_count(args)
+        if count > 1:
+            return self.confirm_batch('undo', args, self.get_batch(stack['ids'][max(position-count, 0):position]))
+        undo = Log.get_by_id(stack['ids'][position-1]) if position > 0 else None
+        if not undo:
             raise Exception('You have no undo history')
-        undo = undos[0]
         changes, item, undo_changes_str = self.get_undo(undo)
         command = 'undo ' + ' '.join(args)
         if undo and changes and item and 'confirm' in ' '.join(args):
@@ -363,41 +406,122 @@ class UndoCommand():
         """
 
         changes, item, undo_changes_str = self.get_undo(undo)
-        undos = list(Log.get_by_page(params={'parent_id': undo.parent_id, 'updated__lt': undo.updated, 'category__ne': 'Log'}, page_num=0))
+        # Move the user's history position to the undone change
+        item.history_id = str(undo.id)
         if undo.action == 'created':
-            item.history_id = str(undo.id)
             item.updated_by = str(self.user.id)
             item.save()
             response = f'{undo.category} {TextUtils.clean(item.name)} has been archived:\n\n{item.get_string()}'
             item.archive(self.user)
             return response
-        elif changes and undos:
-            for c in changes:
-                prop = c.split ('__')
-                match = next(filter(lambda u: c in u.data, undos), None)
-                if match and str(match.id) != str(undo.id):
-                    if len(prop) > 1:
-                        # Get dictionary
-                        attr = getattr(item, prop[0])
-                        # Set key value in dictionary
-                        attr[prop[1]] = match.data[c]
-                        setattr(item, prop[0], attr)
-                    else:
-                        setattr(item, c, match.data[c])
-                else:
-                    if len(prop) > 1:
-                        # Get dictionary
-                        attr = getattr(item, prop[0])
-                        # Remove prop from dictionary
-                        attr = {k: attr[k] for k in attr if k != prop[1]}
-                        setattr(item, prop[0], attr)
-                    else:
-                        setattr(item, c, None)
-            item.history_id = str(undos[0].id)
+        elif changes:
+            previous = self.get_previous(undo, changes)
+            self.set_values(item, {c: previous.get(c) for c in changes}, self.get_absent(undo, changes, previous))
             item.updated_by = str(self.user.id)
             item.save()
+            self.set_subtree(item, changes.get(Subtree.FIELD))
             return f'{undo.category} {TextUtils.clean(item.name)} has been undone:\n\n{item.get_string()}'
 
+    def set_values(self, item, values, absent=None):
+        """Set changed values on a document, removing the absent values
+
+        Parameters
+        ----------
+        item : mongoengine.Document
+            The document to change
+        values : dict
+            The values keyed by field name (or dictionary field and key joined by '__')
+        absent : list(str)
+            The keys to remove (or None to remove the values that are None)
+        """
+
+        for c in values:
+            prop = c.split ('__')
+            if c == Subtree.FIELD:
+                continue
+            elif (c not in absent) if absent is not None else (values[c] is not None):
+                if len(prop) > 1:
+                    # Get dictionary
+                    attr = getattr(item, prop[0])
+                    # Set key value in dictionary
+                    attr[prop[1]] = values[c]
+                    setattr(item, prop[0], attr)
+                else:
+                    setattr(item, c, values[c])
+            else:
+                if len(prop) > 1:
+                    # Get dictionary
+                    attr = getattr(item, prop[0])
+                    # Remove prop from dictionary
+                    attr = {k: attr[k] for k in attr if k != prop[1]}
+                    setattr(item, prop[0], attr)
+                else:
+                    setattr(item, c, None)
+
+    def set_subtree(self, item, ids):
+        """Archive or restore the descendants changed with a document to match the document
+
+        Parameters
+        ----------
+        item : mongoengine.Document
+            The document that was undone or redone
+        ids : list(str)
+            The descendant ids recorded with the change (or None)
+        """
+
+        if ids:
+            Subtree.update(type(item), ids, bool(item.archived), self.user, Subtree.get_ancestors(item))
+
+    def get_absent(self, undo, changes, previous):
+        """Get the keys a change added, which undo removes
+
+        Parameters
+        ----------
+        undo : Log
+            The change to undo
+        changes : dict
+            The changes to undo
+        previous : dict
+            The replaced value of each change
+
+        Returns
+        -------
+        list(str) - the keys that were missing before the change
+        """
+
+        if undo.absent is not None:
+            return [c for c in changes if c in undo.absent]
+        # Older logs do not record the missing keys, so a replaced value of None is removed
+        return [c for c in changes if previous.get(c) is None]
+
+    def get_previous(self, undo, changes):
+        """Get the values a change replaced
+
+        Change logs store the replaced values as their inverse. Older logs without one
+        fall back to the most recent earlier log of the same document with each change.
+
+        Parameters
+        ----------
+        undo : Log
+            The change to undo
+        changes : dict
+            The changes to undo
+
+        Returns
+        -------
+        dict - the replaced value of each change (None when it was unset)
+        """
+
+        if undo.inverse is not None:
+            return undo.inverse
+        undos = list(Log.get_by_page(params={'parent_id': undo.parent_id, 'updated__lt': undo.updated, 'category__ne': 'Log'}, page_num=0))
+        previous = {}
+        for c in changes:
+            match = next(filter(lambda u: c in u.data, undos), None)
+            if match and str(match.id) != str(undo.id):
+                previous[c] = match.data[c]
+        return previous
+
     def next(self, args):
         """Display a dialog for viewing and selecting Changes to redo
         
@@ -415,6 +539,11 @@ class UndoCommand():
         redo = None
         if not self.user.history_id:
             raise Exception('You cannot redo the next undo history. You are up to date.')
+        count = self.get_count(args)
+        if count > 1:
+            stack = Log.get_undo_stack(self.user.id, self.user.history_id)
+            position = stack['positions'][self.user.history_id]
+            return self.confirm_batch('redo', args, self.get_batch(stack['ids'][position:position+count]))
         redo = Log.get_by_id(self.user.history_id)
         if not redo:
             raise Exception('Cannot find next undo history')
@@ -460,8 +589,10 @@ class UndoCommand():
         """
 
         changes, item, undo_changes_str = self.get_undo(redo)
-        history = Log.get_by_page(params={'updated__gt': redo.updated, 'category__ne': 'Log'}, page_num=0).first()
-        item.history_id = str(history.id) if history else None
+        # Move the user's history position to the next undone change (or back to the present)
+        stack = Log.get_undo_stack(self.user.id, str(redo.id))
+        position = stack['positions'][str(redo.id)]
+        item.history_id = stack['ids'][position+1] if position + 1 < len(stack['ids']) else None
         item.updated_by = str(self.user.id)
         if redo.action == 'created':
             response = f'{redo.category} {TextUtils.clean(item.name)} has been restored:\n\n{item.get_string()}'
@@ -474,8 +605,283 @@ class UndoCommand():
                     attr = getattr(item, nest[0])
                     attr[nest[1]] = changes[c]
                     setattr(item, nest[0], attr)
-                else:
+                elif c != Subtree.FIELD:
                     setattr(item, c, changes[c])
             item.save()
+            self.set_subtree(item, changes.get(Subtree.FIELD))
             action = 'restored' if redo.action == 'created' else 'updated'
             return f'{redo.category} {TextUtils.clean(item.name)} has been {action}:\n\n{item.get_string()}'
+
+    def since(self, args):
+        """Display a dialog to verify undoing the changes made since a time
+        
+        Parameters
+        ----------
+        args : list(str)
+            List of strings with subcommands and the time (30m, 2h or 18:30)
+
+        Returns
+        -------
+        list(str) - the response messages string array
+        """
+
+        text = ' '.join([a for a in args[1:] if a.lower() != 'confirm'])
+        since = T.since(text, self.user)
+        if not since:
+            raise Exception(f'***{text}*** is not a time. Try 30m, 2h, 1d or 18:30.')
+        stack = Log.get_undo_stack(self.user.id, self.user.history_id)
+        position = stack['positions'][self.user.history_id] if self.user.history_id else len(stack['ids'])
+        return self.confirm_batch('undo', args, self.get_batch(stack['ids'][:position], created__gte=since))
+
+    def confirm_batch(self, action, args, logs):
+        """Display a dialog to verify a run of changes to undo or redo
+        
+        Parameters
+        ----------
+        action : str
+            undo or redo
+        args : list(str)
+            List of strings with subcommands
+        logs : list(Log)
+            The changes to undo or redo, oldest first
+
+        Returns
+        -------
+        list(str) - the response messages string array
+        """
+
+        messages = []
+        if not logs:
+            raise Exception('You have no undo history' if action == 'undo' else 'You cannot redo the next undo history. You are up to date.')
+        command = f'{action} ' + ' '.join(args)
+        if 'confirm' in ' '.join(args):
+            self.user.answer = 'YES'
+            self.user.command = command
+        changes_str = [f'**{TextUtils.clean(log.name)}** _({log.category})_ ' + ', '.join(self.get_undo(log)[2]) for log in logs]
+        question = ''.join([
+            f'Are you sure you want to {action} these {len(logs)} changes?\n\n',
+            f'***Changes to {action.capitalize()}:***\n' + '\n'.join(changes_str),
+            '```css\n.d YES /* to confirm the command */\n.d NO /* to reject the command */\n.d CANCEL /* to cancel the command */```'
+        ])
+        if self.user.command == command:
+            answer = self.user.answer
+            if answer:
+                if answer.lower() in ['yes', 'y']:
+                    messages.append(self.undo_batch(logs) if action == 'undo' else self.redo_batch(logs))
+                    self.set_dialog()
+                elif answer.lower() in ['no', 'n', 'cancel', 'c']:
+                    messages.append(f'Command ***"{command}"*** canceled')
+                    self.set_dialog()
+                else:
+                    messages.append(f'Please answer the question regarding ***"{command}"***:\n\n{question}')
+            else:
+               messages.append(f'No answer was received for command ***"{command}"***')
+        else:
+            self.set_dialog(command, question)
+            messages.extend([question])
+        return messages
+
+    def undo_batch(self, logs):
+        """Undo a run of changes with one write for each changed document
+
+        The changes are folded newest first, so each field ends with the value it had
+        before the oldest change. Every document is loaded and changed before the first
+        write, and the user's history position only moves once every document is written.
+        
+        Parameters
+        ----------
+        logs : list(Log)
+            The changes to undo, oldest first
+
+        Returns
+        -------
+        str - the response message
+        """
+
+        documents = {}
+        for log in reversed(logs):
+            changes = self.get_changes(log)
+            previous = self.get_previous(log, changes)
+            document = documents.setdefault(log.parent_id, {'log': log, 'created': False, 'values': {}, 'absent': set(), 'subtree': []})
+            document['created'] = document['created'] or log.action == 'created'
+            document['values'].update({c: previous.get(c) for c in changes})
+            absent = self.get_absent(log, changes, previous)
+            document['absent'] = (document['absent'] - set(changes)) | set(absent)
+            document['subtree'].extend(changes.get(Subtree.FIELD, None) or [])
+        for document in documents.values():
+            # Undoing a creation archives the document as it is
+            if document['created']:
+                document['values'] = {}
+        history_id = str(logs[0].id)
+        items = self.get_batch_items(documents, history_id)
+        def write(document, item):
+            log = document['log']
+            if document['created']:
+                item.archive(self.user)
+                return f'{log.category} {TextUtils.clean(item.name)} has been archived'
+            item.save()
+            self.set_subtree(item, document['subtree'])
+            return f'{log.category} {TextUtils.clean(item.name)} has been undone'
+        messages = self.write_batch('undone', items, write)
+        # Move the user's history position to the oldest undone change
+        self.user.history_id = history_id
+        char_svc.save_user(self.user)
+        return f'{len(logs)} changes have been undone:\n\n' + '\n'.join(messages)
+
+    def get_batch_items(self, documents, history_id):
+        """Load and change every document of a batch before any of them is written
+
+        Parameters
+        ----------
+        documents : dict
+            The folded values, absent keys and created flag of each document
+        history_id : str
+            The history position the batch moves to
+
+        Returns
+        -------
+        list(tuple) - the folded document and its changed, validated item
+        """
+
+        items = []
+        for document in documents.values():
+            item = self.get_undo(document['log'])[1]
+            item.history_id = history_id
+            item.updated_by = str(self.user.id)
+            if document['values']:
+                self.set_values(item, document['values'], document.get('absent', None))
+            item.validate()
+            items.append((document, item))
+        return items
+
+    def write_batch(self, action, items, write):
+        """Write every document of a batch, or none of them
+
+        The stored documents are read with one query for each model before the first
+        write. When a write fails, the documents already written (and the failed one) are
+        put back to those stored values and their descendants to the same archived value,
+        so the batch leaves nothing behind. The saves can't join a client session
+        transaction, so the stored values are the batch's inverse.
+
+        Parameters
+        ----------
+        action : str
+            undone or redone
+        items : list(tuple)
+            The folded document and its changed, validated item
+        write : function
+            Writes one document and returns its message
+
+        Returns
+        -------
+        list(str) - the message of each written document
+        """
+
+        stored = {}
+        for document, item in items:
+            if item.id:
+                stored.setdefault(type(item), {})[item.id] = None
+        for model, sons in stored.items():
+            sons.update({son['_id']: son for son in model._get_collection().find({'_id': {'$in': list(sons)}})})
+        messages = []
+        written = []
+        with HistoryTracker.deferred():
+            for document, item in items:
+                written.append((document, item))
+                try:
+                    messages.append(write(document, item))
+                except Exception as err:
+                    self.rollback_batch(stored, written)
+                    raise Exception(self.get_batch_error(action, messages, items, item, err))
+        return messages
+
+    def rollback_batch(self, stored, written):
+        """Put the documents of a failed batch back to their stored values
+
+        Parameters
+        ----------
+        stored : dict
+            The stored document of each id (or None when it was not stored), by model
+        written : list(tuple)
+            The folded document and item of each write that was started
+        """
+
+        for document, item in reversed(written):
+            model = type(item)
+            ancestors = Subtree.get_ancestors(item)
+            descendants = getattr(item, '_subtree', None) or document['subtree']
+            son = stored.get(model, {}).get(item.id, None)
+            if son:
+                model._get_collection().replace_one({'_id': item.id}, son)
+                Subtree.update(model, descendants, bool(son.get('archived', False)), self.user, ancestors)
+            elif item.id:
+                model._get_collection().delete_one({'_id': item.id})
+            Subtree.invalidate(model, [str(item.id)], ancestors)
+
+    def get_batch_error(self, action, messages, items, item, err):
+        """Get the message for a batch stopped by a failed write
+
+        Parameters
+        ----------
+        action : str
+            undone or redone
+        messages : list(str)
+            The messages of the documents already written
+        items : list(tuple)
+            The documents of the batch
+        item : mongoengine.Document
+            The document that failed
+        err : Exception
+            The error of the failed write
+
+        Returns
+        -------
+        str - the error message
+        """
+
+        return ''.join([
+            f'{len(messages)} of {len(items)} documents were {action} before ***{TextUtils.clean(item.name)}*** failed: {err}\n',
+            'The written documents were put back and your history position was not moved, so the same command can be run again.'
+        ])
+
+    def redo_batch(self, logs):
+        """Redo a run of undone changes with one write for each changed document
+
+        Every document is loaded and changed before the first write, and the user's
+        history position only moves once every document is written.
+        
+        Parameters
+        ----------
+        logs : list(Log)
+            The changes to redo, oldest first
+
+        Returns
+        -------
+        str - the response message
+        """
+
+        documents = {}
+        for log in logs:
+            document = documents.setdefault(log.parent_id, {'log': log, 'created': False, 'values': {}, 'subtree': []})
+            if log.action == 'created':
+                document['created'] = True
+            else:
+                document['values'].update(self.get_changes(log))
+                document['subtree'].extend(log.data.get(Subtree.FIELD, None) or [])
+        # Move the user's history position past the newest redone change (or back to the present)
+        stack = Log.get_undo_stack(self.user.id, str(logs[-1].id))
+        position = stack['positions'][str(logs[-1].id)]
+        history_id = stack['ids'][position+1] if position + 1 < len(stack['ids']) else None
+        items = self.get_batch_items(documents, history_id)
+        def write(document, item):
+            log = document['log']
+            if document['created']:
+                item.restore(self.user)
+                return f'{log.category} {TextUtils.clean(item.name)} has been restored'
+            item.save()
+            self.set_subtree(item, document['subtree'])
+            return f'{log.category} {TextUtils.clean(item.name)} has been updated'
+        messages = self.write_batch('redone', items, write)
+        self.user.history_id = history_id
+        char_svc.save_user(self.user)
+        return f'{len(logs)} changes have been redone:\n\n' + '\n'.join(messages)
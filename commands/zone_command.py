@@ -179,7 +179,7 @@ class ZoneCommand():
         list(str) - the response messages string array
         """
 
-        params = {'name__icontains': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
+        params = {'search': ' '.join(args[0:]), 'guild': self.guild.name, 'channel_id': str(self.channel.id), 'archived': False}
         return zone_svc.search(args, Zone.filter, params)
 
     def note(self, args):
@@ -398,7 +398,7 @@ class ZoneCommand():
                     'type_name': 'ZONE',
                     'getter': {
                         'method': Zone.get_by_page,
-                        'params': {'params': {'name__icontains': zone_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
+                        'params': {'params': {'search': zone_name, 'channel_id': str(self.channel.id), 'guild': self.guild.name, 'archived': False}}
                     },
                     'formatter': lambda item, item_num, page_num, page_size: f'_ZONE #{item_num+1}_\n{item.get_short_string()}',
                     'cancel': canceler,
@@ -463,7 +463,7 @@ class ZoneCommand():
                 'type_name': 'ZONE',
                 'getter': {
                     'method': Zone.get_by_page,
-                    'params': {'params': {'name__icontains': zone_name, 'scene_id': str(self.sc.id), 'guild': self.guild.name, 'archived': False}}
+                    'params': {'params': {'search': zone_name, 'scene_id': str(self.sc.id), 'guild': self.guild.name, 'archived': False}}
                 },
                 'formatter': lambda item, item_num, page_num, page_size: f'_ZONE #{item_num+1}_\n{item.get_short_string()}',
                 'cancel': canceler,
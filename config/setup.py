@@ -41,8 +41,9 @@ class Setup():
             \n**Log Story:**```css\n.d log story\n/* Display a list of changes */```\n\
             \n**Log Errors:**```css\n.d log errors\n/* Display a list of errors */```\n\
             \n**Undo List:**```css\n.d undo list\n/* Display a list of changes to undo */```\n\
-            \n**Undo Last:**```css\n.d undo last\n/* Undo the last change */```\n\
-            \n**Redo Next:**```css\n.d redo next\n/* Redo the next change */```'
+            \n**Undo Last:**```css\n.d undo last\n/* Undo the last change */\n.d undo last 5\n/* Undo the last 5 changes */```\n\
+            \n**Undo Since:**```css\n.d undo since 30m\n.d undo since 18:30\n/* Undo the changes made since a time */```\n\
+            \n**Redo Next:**```css\n.d redo next\n/* Redo the next change */\n.d redo next 5\n/* Redo the next 5 changes */```'
 
     roll_help = '\n***Roll Instructions***\n\n\
             Roll fate dice```css\n.d r```\n\
@@ -51,7 +52,7 @@ class Setup():
             Roll fate dice skill/approach with invokes```css\n.d r "APPROACH NAME"|"SKILL NAME" invoke "ASPECT NAME" +2|rerolll [...invoke "ASPECT NAME" +2|reroll]```\n\
             Reroll the character\'s last roll```css\n.d re invoke "ASPECT NAME" +2|rerolll [...invoke "ASPECT NAME" +2|rerolll]```\n\
             Clear the actions from a previous roll```css\n.d clear\n.d erase```\n\
-            Display invocable/compelable aspects```css\n.d available```\n\
+            Display invocable/compelable aspects```css\n.d available\n.d available "SEARCH TEXT" /* best matches first */```\n\
             Propose a compel```css\n.d compel Superman with Cryptonite```\n\
             Accept a compel```css\n.d compel accepted```\n\
             Reject a compel```css\n.d compel rejected```\n\
@@ -79,11 +80,17 @@ class Setup():
             Make a suggestion```css\n.d suggest "SUGGESTION TEXT"```\n\
             Display the list of suggestions```css\n.d suggest list```'
 
+    cache_help = '.d cache help - display cache help\n\
+            \nCache Setup:\n\
+            Display the cache hit, miss and eviction counters```css\n.d cache```\n\
+            Empty the caches (Admin only)```css\n.d cache clear```'
+
     character_help = '.d c help - display these instructions\nCharacter Help:\n\
             Display active character```css\n.d character```\n\
             Display character help```css\n.d c help```\n\
             Display help on stress tracks```css\n.d c stress help```\n\
             Display help on consequences and conditions```css\n.d c consequence help```\n\
+            Absorb an attack with the fewest consequences and stress boxes```css\n.d c absorb [Mental|Physical] /* THE SHIFTS LEFT FROM THE ATTACK */\n.d c absorb Physical 4 "CONSEQUENCE ASPECT"\n.d c absorb Physical 8 "MILD ASPECT" "MODERATE ASPECT"```\n\
             Display/set active character```css\n.d c "NAME"```\n\
             Display list of characters```css\n.d c list```\n\
             Set the description for the active character```css\n.d c description "DESCRIPTION TEXT"```\n\
@@ -430,13 +437,13 @@ class Setup():
     reserved_commands = [
         'help',
         'channel', 'chan', 'list', 'users', 'u',
-        'character', 'c', 'note', 'n', 'say', 'story', 'stats', 'parent', 'p', 'new', 'name', 'n', 'select', 'image', 'list', 'l', 'delete', 'restore', 'copy', 'description', 'desc', 'high', 'hc', 'trouble', 't', 'fate', 'f', 'aspects', 'aspect', 'a', 'boost', 'b', 'approaches', 'approach', 'apps', 'app', 'skills', 'skill', 'sks', 'sk', '', 'stunts', 'stunt', 's', 'stress', 'st', 'consequence', 'con', 'custom', 'share', 'shared',
+        'character', 'c', 'note', 'n', 'say', 'story', 'stats', 'parent', 'p', 'new', 'name', 'n', 'select', 'image', 'list', 'l', 'delete', 'restore', 'copy', 'description', 'desc', 'high', 'hc', 'trouble', 't', 'fate', 'f', 'aspects', 'aspect', 'a', 'boost', 'b', 'approaches', 'approach', 'apps', 'app', 'skills', 'skill', 'sks', 'sk', '', 'stunts', 'stunt', 's', 'stress', 'st', 'consequence', 'con', 'absorb', 'custom', 'share', 'shared',
         'cheat',
         'engagement', 'e', 'players', 'player', 'p', 'opposition', 'opp', 'o', 'start', 'end',
         'roll', 'r', 'reroll', 're', 'create', 'advantage', 'attack', 'att', 'defend', 'def', 'overcome', 'takeout', 'out', 'freeinvoke', 'available', 'avail', 'av',
         'scenario', 'scene', 's', 'session', 'zone', 'connect', 'adjoin', 'ajoin', 'join', 'j', 'enter', 'move', 'exit',
-        'suggest', 'suggestion', 'revision', 'rev',
-        'undo', 'errors', 'error', 'err', 'e', 'last', 'next',
+        'suggest', 'suggestion', 'revision', 'rev', 'cache',
+        'undo', 'errors', 'error', 'err', 'e', 'last', 'since', 'next',
         'user', 'timezone', 'tz', 'url', 'website', 'contact', 'alias'
     ]
     action_caa_image = 'http://drive.google.com/uc?export=view&id=14r8yVHdvbghvmwlZ-LU_GCv_Rss3CuJd'
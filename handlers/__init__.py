@@ -1 +1,3 @@
-from handlers.dreamcraft import DreamcraftHandler
\ No newline at end of file
+from handlers.dreamcraft import DreamcraftHandler
+from handlers.dispatcher import Dispatcher
+from handlers.scheduler import Scheduler
\ No newline at end of file
@@ -0,0 +1,206 @@
+# dispatcher.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import time
+import asyncio
+import functools
+import threading
+from multiprocessing import util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dotenv import load_dotenv
+from mongoengine import connect, disconnect
+
+from handlers.dreamcraft import DreamcraftHandler
+from utils import LOG_WRITER
+
+load_dotenv()
+DATABASE = os.getenv('DISCORD_DATABASE')
+DISPATCH = os.getenv('DISCORD_DISPATCH', 'thread')
+WORKERS = int(os.getenv('DISCORD_WORKERS', '0') or 0)
+
+class Snapshot(object):
+    """
+    Picklable stand-in for the parts of a Discord object read by DreamcraftHandler
+    """
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+def marshal(ctx):
+    """
+    Copy the guild, author and channel information out of a Discord Context
+
+    The Discord Context is bound to the event loop and cannot be pickled, so the worker pool
+    receives a snapshot with the same attribute names DreamcraftHandler reads.
+
+    Parameters
+    ----------
+    ctx : object(Context)
+        The Discord.Context object used to retrieve and send information to Discord users
+
+    Returns
+    -------
+    Snapshot - the guild, author and channel attributes of the Context
+    """
+
+    guild = Snapshot(name=ctx.guild.name) if ctx.guild else None
+    author = Snapshot(name=ctx.author.name, discriminator=ctx.author.discriminator, display_name=ctx.author.display_name)
+    channel = Snapshot(name=getattr(ctx.channel, 'name', None), type=Snapshot(name=ctx.channel.type.name))
+    return Snapshot(guild=guild, author=author, channel=channel)
+
+def handle(ctx, args, queued):
+    """
+    Run a command through the DreamcraftHandler inside a worker
+
+    Parameters
+    ----------
+    ctx : Snapshot
+        The marshalled Discord Context
+    args : tuple(str)
+        The arguments sent to the bot to parse and evaluate
+    queued : float
+        The time the command was submitted to the pool
+
+    Returns
+    -------
+    tuple(float, float, tuple) - the start time, finish time and the handler messages
+    """
+
+    started = time.time()
+    handler = DreamcraftHandler(ctx, args)
+    messages = handler.get_messages()
+    return started, time.time(), messages
+
+def connect_worker():
+    """Open a fresh database connection in a worker process"""
+
+    disconnect()
+    connect(DATABASE)
+    # Pool processes skip atexit handlers, so write the buffered logs from a finalizer
+    util.Finalize(None, LOG_WRITER.flush, exitpriority=10)
+
+class Dispatcher():
+    """
+    Dispatcher class for running DreamcraftHandler work off the Discord event loop
+
+    Modes:
+        inline - run the handler on the event loop (the original behavior)
+        thread - run the handler in a ThreadPoolExecutor
+        process - run the handler in a ProcessPoolExecutor with a database connection per process
+    """
+
+    def __init__(self, mode=DISPATCH, workers=WORKERS):
+        """
+        Constructor for the Dispatcher class
+
+        Parameters
+        ----------
+        mode : str
+            The dispatch mode: inline, thread or process
+        workers : int
+            The number of pool workers (defaults to the number of CPUs)
+
+        Returns
+        -------
+        Dispatcher - object for running commands in a bounded worker pool
+        """
+
+        if mode not in ['inline', 'thread', 'process']:
+            raise Exception(f'Unknown dispatch mode: {mode}')
+        self.mode = mode
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.executor = None
+        if mode == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dreamcraft')
+        elif mode == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=connect_worker)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.dispatched = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    async def dispatch(self, ctx, args):
+        """
+        Run a command in the worker pool and wait for the result
+
+        Parameters
+        ----------
+        ctx : object(Context)
+            The Discord.Context object used to retrieve and send information to Discord users
+        args : array(str)
+            The arguments sent to the bot to parse and evaluate
+
+        Returns
+        -------
+        tuple(title: str, message: str, image: str) - the DreamcraftHandler response
+        """
+
+        queued = time.time()
+        with self.lock:
+            self.in_flight += 1
+            self.dispatched += 1
+        try:
+            if self.executor:
+                loop = asyncio.get_running_loop()
+                work = functools.partial(handle, marshal(ctx), tuple(args), queued)
+                started, finished, messages = await loop.run_in_executor(self.executor, work)
+            else:
+                started, finished, messages = handle(ctx, tuple(args), queued)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        with self.lock:
+            self.completed += 1
+            wait = max(started - queued, 0.0)
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.run_total += finished - started
+        return messages
+
+    def stats(self):
+        """
+        Get the queue depth and timing information for the worker pool
+
+        Returns
+        -------
+        dict - the dispatch metrics
+        """
+
+        with self.lock:
+            completed = self.completed if self.completed else 1
+            return {
+                'mode': self.mode,
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'queue_depth': max(self.in_flight - self.workers, 0) if self.executor else 0,
+                'dispatched': self.dispatched,
+                'completed': self.completed,
+                'avg_wait': self.wait_total / completed,
+                'max_wait': self.wait_max,
+                'avg_run': self.run_total / completed
+            }
+
+    def get_string(self):
+        """Get the dispatch metrics for display"""
+
+        stats = self.stats()
+        return '\n'.join([
+            f'_Dispatch:_ ***{stats["mode"]}*** ({stats["workers"]} workers)',
+            f'_In Flight:_ {stats["in_flight"]}',
+            f'_Queue Depth:_ {stats["queue_depth"]}',
+            f'_Completed:_ {stats["completed"]} of {stats["dispatched"]}',
+            f'_Average Wait:_ {stats["avg_wait"]*1000:.1f} ms (max {stats["max_wait"]*1000:.1f} ms)',
+            f'_Average Run:_ {stats["avg_run"]*1000:.1f} ms'
+        ])
+
+    def shutdown(self):
+        """Stop accepting work, wait for the running commands to finish and write the buffered logs"""
+
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        LOG_WRITER.flush()
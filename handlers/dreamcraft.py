@@ -11,7 +11,7 @@ from models import Channel, User, Character, Log
 from services import BaseService
 from commands import *
 from config.setup import Setup
-from utils import T
+from utils import T, UnitOfWork
 
 load_dotenv()
 PREFIX = os.getenv('DISCORD_PREFIX')
@@ -45,6 +45,8 @@ class DreamcraftHandler():
         DreamcraftHandler - object for processing Context object and args (list of strings in a command)
         """
         self.ctx = ctx
+        # Every document loaded while handling this command is shared through the unit of work
+        self.uow = UnitOfWork.begin(' '.join(args))
         self.setup(ctx, args)
 
     def setup(self, ctx, args):
@@ -76,7 +78,7 @@ class DreamcraftHandler():
             self.channel.users.append(str(self.user.name))
             self.channel.updated_by = str(self.user.id)
             self.channel.updated = T.now()
-            self.channel.save()
+            UnitOfWork.save(self.channel)
         self.char = Character().get_by_id(self.user.active_character) if self.user and self.user.active_character else None
         self.module = self.char.category if self.char else None
         self.command = self.args[0].lower()
@@ -86,6 +88,26 @@ class DreamcraftHandler():
         self.image = ''
 
     def get_messages(self):
+        """
+        Processes Context and args through command string parsing inside the request's unit of work
+
+        Documents marked dirty while processing the command are saved once when it completes.
+
+        Returns
+        -------
+        tuple(title: str, message: str)
+            title : str
+                The title of the response message
+            message : str
+                The string for the response message content
+            image : str
+                The string for the response message image
+        """
+
+        with self.uow:
+            return self.get_command_messages()
+
+    def get_command_messages(self):
         """
         Processes Context and args through command string parsing
 
@@ -125,6 +147,7 @@ class DreamcraftHandler():
                 'rev': RevisionCommand,
                 'suggestion': SuggestionCommand,
                 'suggest': SuggestionCommand,
+                'cache': CacheCommand,
                 'user': UserCommand,
                 'u': UserCommand,
                 'alias': UserCommand,
@@ -171,7 +194,8 @@ class DreamcraftHandler():
                 'stress': CharacterCommand,
                 'st': CharacterCommand,
                 'consequence': CharacterCommand,
-                'con': CharacterCommand
+                'con': CharacterCommand,
+                'absorb': CharacterCommand
                 # 'assist': RollCommand,
                 # 'concede': RollCommand
             }
@@ -214,7 +238,7 @@ class DreamcraftHandler():
                         self.user.module = self.module
                         self.user.updated_by = str(self.user.id)
                         self.user.updated = T.now()
-                        self.user.save()
+                        UnitOfWork.save(self.user)
                 # Get the function from User object
                 if self.func is None and self.user.module in modules:
                     self.module = self.user.module
@@ -308,7 +332,7 @@ class DreamcraftHandler():
             self.user.answer = answer
             self.user.updated_by = str(self.user.id)
             self.user.updated = T.now()
-            self.user.save()
+            UnitOfWork.save(self.user)
 
     def get_image(self):
         """
@@ -0,0 +1,181 @@
+# scheduler.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+USER_QUEUE_LIMIT = int(os.getenv('DISCORD_USER_QUEUE_LIMIT', '5') or 5)
+QUEUE_LIMIT = int(os.getenv('DISCORD_QUEUE_LIMIT', '200') or 200)
+
+class Scheduler():
+    """
+    Scheduler class for ordering commands in front of the Dispatcher
+
+    Each (user, guild) pair gets its own mailbox and a single actor task that drains it,
+    so the dialog state stored in the User document (command, question, answer) is only
+    ever touched by one command at a time. Different users and channels run concurrently
+    up to the size of the Dispatcher's worker pool.
+    """
+
+    def __init__(self, dispatcher, user_limit=USER_QUEUE_LIMIT, limit=QUEUE_LIMIT):
+        """
+        Constructor for the Scheduler class
+
+        Parameters
+        ----------
+        dispatcher : Dispatcher
+            The Dispatcher used to run each command
+        user_limit : int
+            The maximum number of commands waiting for a single user
+        limit : int
+            The maximum number of commands waiting across all users
+
+        Returns
+        -------
+        Scheduler - object for running commands in order per user
+        """
+
+        self.dispatcher = dispatcher
+        self.user_limit = user_limit
+        self.limit = limit
+        self.mailboxes = {}
+        self.pending = 0
+        self.scheduled = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.completed = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def get_key(self, ctx):
+        """
+        Get the mailbox key for the author of a command
+
+        Parameters
+        ----------
+        ctx : object(Context)
+            The Discord.Context object used to retrieve and send information to Discord users
+
+        Returns
+        -------
+        tuple(str, str) - the user name and guild name
+        """
+
+        guild = ctx.guild if ctx.guild else ctx.author
+        return (ctx.author.name, guild.name)
+
+    async def submit(self, ctx, args):
+        """
+        Queue a command behind any earlier commands from the same user and wait for the result
+
+        Parameters
+        ----------
+        ctx : object(Context)
+            The Discord.Context object used to retrieve and send information to Discord users
+        args : array(str)
+            The arguments sent to the bot to parse and evaluate
+
+        Returns
+        -------
+        tuple(title: str, message: str, image: str) - the DreamcraftHandler response
+        """
+
+        key = self.get_key(ctx)
+        mailbox = self.mailboxes.get(key, None)
+        if self.pending >= self.limit:
+            self.rejected += 1
+            return 'Queue', 'The bot is very busy right now. Please try your command again in a moment.', ''
+        if mailbox and mailbox.qsize() >= self.user_limit:
+            self.rejected += 1
+            return 'Queue', f'You already have {mailbox.qsize()} commands waiting. Please wait for them to finish.', ''
+        future = asyncio.get_running_loop().create_future()
+        if mailbox is None:
+            mailbox = asyncio.Queue()
+            self.mailboxes[key] = mailbox
+            asyncio.ensure_future(self.drain(key, mailbox))
+        mailbox.put_nowait((ctx, args, future, time.time()))
+        self.pending += 1
+        self.scheduled += 1
+        return await future
+
+    async def drain(self, key, mailbox):
+        """
+        Run the commands in a mailbox one at a time until it is empty
+
+        Commands whose caller stopped waiting (cancelled or timed out) are skipped, and an
+        error from one command is passed to its caller without stopping the mailbox. The
+        mailbox is always removed when the drain ends, so later commands start a new one.
+
+        Parameters
+        ----------
+        key : tuple(str, str)
+            The mailbox key
+        mailbox : asyncio.Queue
+            The queued commands for the key
+        """
+
+        try:
+            while not mailbox.empty():
+                ctx, args, future, queued = mailbox.get_nowait()
+                self.pending -= 1
+                if future.done():
+                    self.skipped += 1
+                    continue
+                lag = time.time() - queued
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+                try:
+                    result = await self.dispatcher.dispatch(ctx, args)
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as err:
+                    if not future.done():
+                        future.set_exception(err)
+                self.completed += 1
+        finally:
+            # No awaits between the empty check and removal, so no command can be stranded in the mailbox
+            if self.mailboxes.get(key, None) is mailbox:
+                self.mailboxes.pop(key, None)
+            # A drain stopped early (cancelled) fails the commands still waiting
+            while not mailbox.empty():
+                future = mailbox.get_nowait()[2]
+                self.pending -= 1
+                if not future.done():
+                    future.set_exception(Exception('The command was stopped before it could run. Please try again.'))
+
+    def stats(self):
+        """
+        Get the queue lag and backpressure information for the scheduler
+
+        Returns
+        -------
+        dict - the scheduler metrics
+        """
+
+        completed = self.completed if self.completed else 1
+        return {
+            'users': len(self.mailboxes),
+            'pending': self.pending,
+            'scheduled': self.scheduled,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'skipped': self.skipped,
+            'avg_lag': self.lag_total / completed,
+            'max_lag': self.lag_max
+        }
+
+    def get_string(self):
+        """Get the scheduler and dispatch metrics for display"""
+
+        stats = self.stats()
+        return '\n'.join([
+            f'_Active Users:_ {stats["users"]}',
+            f'_Pending:_ {stats["pending"]} (limit {self.limit}, {self.user_limit} per user)',
+            f'_Rejected:_ {stats["rejected"]} _Skipped:_ {stats["skipped"]}',
+            f'_Average Lag:_ {stats["avg_lag"]*1000:.1f} ms (max {stats["max_lag"]*1000:.1f} ms)',
+            self.dispatcher.get_string()
+        ])
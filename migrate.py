@@ -0,0 +1,39 @@
+# migrate.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import sys
+from mongoengine import connect
+from dotenv import load_dotenv
+
+from migrations import MIGRATIONS
+
+load_dotenv()
+DATABASE = os.getenv('DISCORD_DATABASE')
+
+def main(names):
+    """
+    Run data migrations against the bot database
+
+    Usage:
+    ```
+        python migrate.py                      /* run every migration */
+        python migrate.py character_ancestors  /* run one migration */
+    ```
+
+    Parameters
+    ----------
+    names : list(str)
+        The migrations to run (all migrations when empty)
+    """
+
+    unknown = [n for n in names if n not in MIGRATIONS]
+    if unknown:
+        raise Exception(f'Unknown migrations: {", ".join(unknown)}')
+    connect(DATABASE)
+    for name in (names if names else MIGRATIONS.keys()):
+        print(f'{name}: {MIGRATIONS[name]()} documents updated')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,11 @@
+from migrations import character_ancestors, search_names, log_inverses, guild_counters, guild_registry, track_bitsets
+
+# Migrations in the order they should be applied
+MIGRATIONS = {
+    'character_ancestors': character_ancestors.migrate,
+    'search_names': search_names.migrate,
+    'log_inverses': log_inverses.migrate,
+    'guild_counters': guild_counters.migrate,
+    'guild_registry': guild_registry.migrate,
+    'track_bitsets': track_bitsets.migrate
+}
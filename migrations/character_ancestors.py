@@ -0,0 +1,41 @@
+# character_ancestors.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from models import Character
+from utils import DOCUMENTS, SHEETS, INVOKABLES
+
+def migrate():
+    """
+    Backfill the ancestors list on every Character
+
+    Walks down from the root characters one level at a time, setting the ancestors of all
+    children of a parent with a single update.
+
+    Returns
+    -------
+    int - the number of characters updated
+    """
+
+    updated = 0
+    parent_ids = set(Character.objects(parent_id__nin=[None, '']).distinct('parent_id'))
+    character_ids = set(str(i) for i in Character.objects(id__in=list(parent_ids)).distinct('id'))
+    # Parents that are not Characters (Scenarios, Scenes, Zones...) start a chain
+    level = {p: [p] for p in parent_ids if p not in character_ids}
+    level.update({str(c.id): [str(c.id)] for c in Character.objects(parent_id__in=[None, ''], id__in=list(character_ids))})
+    visited = set()
+    while level:
+        next_level = {}
+        for parent_id, ancestors in level.items():
+            visited.add(parent_id)
+            updated += Character.objects(parent_id=parent_id).update(set__ancestors=ancestors)
+            for child_id in Character.objects(parent_id=parent_id).distinct('id'):
+                if str(child_id) in character_ids and str(child_id) not in visited:
+                    next_level[str(child_id)] = ancestors + [str(child_id)]
+        level = next_level
+    # The updates skip the save signals, so the cached characters, sheets and trees are dropped here
+    if updated:
+        DOCUMENTS.clear()
+        SHEETS.clear()
+        INVOKABLES.clear()
+    return updated
@@ -0,0 +1,18 @@
+# guild_counters.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from models import Character, GuildCounter
+
+def migrate():
+    """
+    Rebuild the guild counters from one aggregation of the Character collection
+
+    Run after enabling DISCORD_STATS_COUNTERS (or to correct counters that have drifted).
+
+    Returns
+    -------
+    int - the number of counters written
+    """
+
+    return GuildCounter.rebuild(Character.get_category_totals())
@@ -0,0 +1,44 @@
+# guild_registry.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from pymongo import UpdateOne
+from models import User, Character, GuildRegistry
+from utils import T
+
+def migrate():
+    """
+    Build the guild registry from the User and Character collections
+
+    Returns
+    -------
+    int - the number of guilds written
+    """
+
+    guilds = {}
+    def entry(name):
+        return guilds.setdefault(name, {'members': set(), 'characters': 0, 'last_activity': None})
+    for guild, name in User.objects.scalar('guild', 'name'):
+        if guild:
+            entry(guild)['members'].add(name)
+    for row in Character.objects.aggregate({'$group': {'_id': '$guild', 'last': {'$max': '$updated'}}}):
+        if row['_id']:
+            entry(row['_id'])['last_activity'] = row['last']
+    pipeline = [
+        {'$match': {'category': 'Character', 'archived': False}},
+        {'$group': {'_id': '$guild', 'total': {'$sum': 1}}}
+    ]
+    for row in Character.objects.aggregate(*pipeline):
+        if row['_id']:
+            entry(row['_id'])['characters'] = row['total']
+    now = T.now()
+    requests = [
+        UpdateOne({'name': name}, {
+            '$set': {'members': sorted(g['members']), 'characters': g['characters'], 'last_activity': g['last_activity'], 'updated': now},
+            '$setOnInsert': {'created': now}
+        }, upsert=True)
+        for name, g in guilds.items()
+    ]
+    if requests:
+        GuildRegistry._get_collection().bulk_write(requests, ordered=False)
+    return len(requests)
@@ -0,0 +1,44 @@
+# log_inverses.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from pymongo import UpdateOne
+from models import Log
+
+# Logs updated with each bulk write
+BATCH_SIZE = 1000
+
+def migrate():
+    """
+    Backfill the inverse and absent keys of the change logs written before logs stored them
+
+    The logs of each document are replayed oldest first, so each log's inverse is the
+    value its changes replaced and its absent keys are the changes with no earlier value.
+    Logs with an inverse are left as they are, and the rest are updated with one bulk
+    write per batch.
+
+    Returns
+    -------
+    int - the number of logs updated
+    """
+
+    Log.query()
+    collection = Log._get_collection()
+    updated = 0
+    requests = []
+    states = {}
+    logs = collection.find({'category': {'$ne': 'Log'}}, {'parent_id': 1, 'data': 1, 'inverse': 1}).sort([('parent_id', 1), ('created', 1), ('_id', 1)])
+    for log in logs:
+        state = states.setdefault(log.get('parent_id'), {})
+        data = log.get('data') if isinstance(log.get('data'), dict) else {}
+        if log.get('inverse') is None:
+            inverse = {k: state.get(k, None) for k in data}
+            absent = [k for k in data if k not in state]
+            requests.append(UpdateOne({'_id': log['_id']}, {'$set': {'inverse': inverse, 'absent': absent}}))
+        state.update(data)
+        if len(requests) >= BATCH_SIZE:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += collection.bulk_write(requests, ordered=False).modified_count
+    return updated
@@ -0,0 +1,33 @@
+# search_names.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from pymongo import UpdateOne
+from models import Character, Scenario, Scene, Zone, Session, Engagement, Exchange, Revision
+from utils import NameSearch
+
+def migrate():
+    """
+    Backfill search_name and search_tokens on every named document
+
+    Documents saved since the fields were added already have them; the rest are updated
+    with one bulk write per collection.
+
+    Returns
+    -------
+    int - the number of documents updated
+    """
+
+    updated = 0
+    for model in [Character, Scenario, Scene, Zone, Session, Engagement, Exchange, Revision]:
+        collection = model._get_collection()
+        requests = [
+            UpdateOne({'_id': doc['_id']}, {'$set': {
+                'search_name': NameSearch.normalize(doc.get('name', '')),
+                'search_tokens': NameSearch.tokens(doc.get('name', ''))
+            }})
+            for doc in collection.find({'search_name': {'$exists': False}}, {'name': 1})
+        ]
+        if requests:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+    return updated
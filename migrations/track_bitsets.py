@@ -0,0 +1,68 @@
+# track_bitsets.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from pymongo import UpdateOne
+from models import Character
+from utils import Track, DOCUMENTS, SHEETS
+
+# Characters converted with each bulk write
+BATCH_SIZE = 500
+
+def get_changes(doc):
+    """
+    Get the tracks of a stored character that are still in the legacy format, converted
+
+    Parameters
+    ----------
+    doc : dict
+        The stored character (with its stress, consequences and counters)
+
+    Returns
+    -------
+    dict - the converted value of each field to update
+    """
+
+    changes = {}
+    stress = doc.get('stress', None)
+    if stress and [t for t in stress if not Track.is_stored(t)]:
+        changes['stress'] = Track.to_sons(stress)
+    consequences = doc.get('consequences', None)
+    if consequences and not Track.is_stored(consequences):
+        changes['consequences'] = Track.load(consequences).to_son()
+    counters = doc.get('counters', None)
+    if isinstance(counters, dict) and [c for c in counters.values() if not Track.is_stored(c)]:
+        changes['counters'] = {k: c if Track.is_stored(c) else dict(Track.load(c).to_son(), name=c.get('name', k)) for k, c in counters.items()}
+    return changes
+
+def migrate():
+    """
+    Convert the stress, consequence and counter tracks of every character to box values with a checked bitmask
+
+    Characters saved since the format changed are skipped; the rest are updated with one
+    bulk write per batch.
+
+    Returns
+    -------
+    int - the number of characters updated
+    """
+
+    collection = Character._get_collection()
+    query = {'$or': [{f: {'$nin': [None, [], {}]}} for f in ['stress', 'consequences', 'counters']]}
+    updated = 0
+    requests = []
+    for doc in collection.find(query, {'stress': 1, 'consequences': 1, 'counters': 1}):
+        changes = get_changes(doc)
+        if changes:
+            # Version the change like any other write
+            requests.append(UpdateOne({'_id': doc['_id']}, {'$set': changes, '$inc': {'version': 1}}))
+        if len(requests) >= BATCH_SIZE:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += collection.bulk_write(requests, ordered=False).modified_count
+    # The bulk writes skip the save signals, so the cached characters and sheets are dropped here
+    if updated:
+        DOCUMENTS.clear()
+        SHEETS.clear()
+    return updated
@@ -10,3 +10,18 @@ from models.channel import Channel
 from models.log import Log
 from models.revision import Revision
 from models.suggestion import Suggestion
+from models.guild_counter import GuildCounter
+from models.guild_registry import GuildRegistry
+from models.history_tracker import HistoryTracker
+from models.change_capture import Change, ChangeFeed, ChangeCapture, CHANGES
+from models.mutation import Mutation, MUTATION_RETRIES
+from models.indexes import ensure_indexes, check_indexes
+
+from mongoengine import signals
+from utils import UnitOfWork, NameSearch
+
+# Keep the request identity map in step with documents saved or deleted outside of it
+signals.post_save.connect(UnitOfWork.saved)
+signals.post_delete.connect(UnitOfWork.deleted)
+# Keep the search fields of every named model in step with its name
+signals.pre_save.connect(NameSearch.pre_save)
@@ -0,0 +1,192 @@
+# change_capture.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import logging
+from mongoengine import signals
+from models.log import Log
+from models.history_tracker import HistoryTracker
+from utils import DOCUMENTS, DIALOGS, BeforeImage, Subtree
+
+logger = logging.getLogger(__name__)
+
+class Change(object):
+    """One saved document with its action and logged changes (None for undo and redo saves)"""
+
+    __slots__ = ('document', 'action', 'changes')
+
+    def __init__(self, document, action, changes):
+        self.document = document
+        self.action = action
+        self.changes = changes
+
+class ChangeFeed(object):
+    """
+    Deliver each captured change to the handlers subscribed to it, in order
+
+    Usage:
+    ```
+        @CHANGES.subscribe
+        def audit(change):
+            ...
+    ```
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.handlers = []
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+        return handler
+
+    def unsubscribe(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    def publish(self, change):
+        for handler in self.handlers:
+            handler(change)
+
+CHANGES = ChangeFeed('Changes')
+
+class ChangeCapture(object):
+    """
+    Mixin capturing the changes of each save of a logged model
+
+    The delta is read once in post_save, turned into a Change and published to CHANGES,
+    whose handlers drop the cache entries, write the change log (which pushes the undo
+    stack) and move the user's history position. Documents keep the son they were loaded
+    from, so the values a save replaces are logged without reading them again. Changes are
+    written to the module logger at DEBUG level, and nothing is formatted unless that level
+    is enabled.
+
+    Usage:
+    ```
+        class Scene(ChangeCapture, Document):
+            ...
+
+        ChangeCapture.attach(Scene)
+    ```
+    """
+
+    # Fields left out of the logged changes
+    capture_exclude = ()
+    # Log dotted paths with double underscores (the form undo passes to update queries)
+    capture_query_keys = False
+
+    @classmethod
+    def _from_son(cls, son, *args, **kwargs):
+        document = super()._from_son(son, *args, **kwargs)
+        # The stored values the next version checked save replaces (see BeforeImage); kept
+        # without a copy, so values the document shares with it are read again when they are
+        # changed in place
+        document._loaded = son if BeforeImage.is_versioned(document) else None
+        return document
+
+    def reload(self, *fields, **kwargs):
+        super().reload(*fields, **kwargs)
+        # Reloaded values come from a projected son, so the next save reads the stored values
+        self._loaded = None
+        return self
+
+    def get_log_category(self):
+        """Get the category of the change logs of the document"""
+
+        return type(self).__name__
+
+    def invalidate_caches(self):
+        """Drop the cached entries of the document after it is saved"""
+
+        DOCUMENTS.invalidate_document(self)
+
+    def get_changes(self, sets):
+        """
+        Get the changed fields of the document being saved
+
+        Parameters
+        ----------
+        sets : dict
+            The new value of each changed path, from the document's _delta
+
+        Returns
+        -------
+        dict - the new value of each changed field
+        """
+
+        changes = dict(sets)
+        if not self.capture_exclude and not self.capture_query_keys:
+            return changes
+        return {(k.replace('.', '__') if self.capture_query_keys else k): v for k, v in changes.items() if k not in self.capture_exclude}
+
+    @staticmethod
+    def attach(model):
+        """
+        Capture the changes of a model's saves
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class using the ChangeCapture mixin
+        """
+
+        signals.pre_save_post_validation.connect(BeforeImage.capture, sender=model)
+        signals.post_save.connect(ChangeCapture.saved, sender=model)
+
+    @staticmethod
+    def saved(sender, document, **kwargs):
+        """
+        post_save handler publishing the change of a saved document
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class that was saved
+        document : mongoengine.Document
+            The document that was saved
+        """
+
+        created = kwargs.get('created', False)
+        sets, unsets = document._delta()
+        BeforeImage.saved(document, sets, unsets, created)
+        if document.history_id:
+            CHANGES.publish(Change(document, 'history', None))
+            return
+        changes = document.get_changes(sets)
+        action = 'created' if created else 'updated'
+        if action == 'updated' and 'archived' in changes:
+            action = 'archived' if changes['archived'] else 'restored'
+        changes.update(Subtree.get_changes(document))
+        CHANGES.publish(Change(document, action, changes))
+
+    @staticmethod
+    def invalidate(change):
+        """Feed handler dropping the cache entries of the saved document and the dialog pages listing its model"""
+
+        change.document.invalidate_caches()
+        DIALOGS.invalidate_model(type(change.document).__name__)
+
+    @staticmethod
+    def record(change):
+        """Feed handler writing the change log and moving the user's history position"""
+
+        document = change.document
+        if change.changes is None:
+            HistoryTracker.move(document.updated_by, document.history_id)
+            return
+        inverse = BeforeImage.get_inverse(document, change.changes)
+        absent = BeforeImage.get_absent(document, change.changes)
+        Log().create_new(str(document.id), document.name, document.updated_by, document.guild, document.get_log_category(), change.changes, change.action, inverse, absent)
+        HistoryTracker.move(document.updated_by, None)
+
+    @staticmethod
+    def trace(change):
+        """Feed handler writing the change to the module logger at DEBUG level"""
+
+        if logger.isEnabledFor(logging.DEBUG):
+            document = change.document
+            logger.debug('%s %s %s: %s', type(document).__name__, document.id, change.action, change.changes if change.changes is not None else {'history_id': document.history_id})
+
+CHANGES.subscribe(ChangeCapture.invalidate)
+CHANGES.subscribe(ChangeCapture.record)
+CHANGES.subscribe(ChangeCapture.trace)
@@ -3,7 +3,7 @@ __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
 from bson import ObjectId
-from mongoengine import Document, StringField,  ListField, BooleanField, DateTimeField, signals
+from mongoengine import Document, StringField,  ListField, BooleanField, DateTimeField
 
 from models.scenario import User
 from models.scenario import Character
@@ -12,10 +12,10 @@ from models.scene import Scene
 from models.zone import Zone
 from models.session import Session
 from models.engagement import Engagement
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS
 
-class Channel(Document):
+class Channel(ChangeCapture, Document):
     name = StringField(required=True)
     guild = StringField(required=True)
     active_scenario = StringField()
@@ -31,30 +31,12 @@ class Channel(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Channel', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('name', 'guild')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -75,7 +57,7 @@ class Channel(Document):
         return self
 
     def find(self, name, guild):
-        return Channel.objects(name=name, guild=guild).first()
+        return UnitOfWork.find(Channel, (name, guild), Channel.objects(name=name, guild=guild).first)
 
     def get_or_create(self, name, guild, user):
         channel = self.find(name, guild)
@@ -84,7 +66,7 @@ class Channel(Document):
         return channel
 
     def get_by_id(self, id):
-        channel = Channel.filter(id=id).first()
+        channel = UnitOfWork.load(Channel, id, lambda: Channel.filter(id=id).first(), DOCUMENTS)
         return channel
 
     @classmethod
@@ -186,4 +168,4 @@ class Channel(Document):
         return f'_Channel:_ ***{self.name}***\n_Guild:_ ***{self.guild}***{users}'
 
 
-signals.post_save.connect(Channel.post_save, sender=Channel)
\ No newline at end of file
+ChangeCapture.attach(Channel)
\ No newline at end of file
@@ -2,13 +2,18 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, LazyReferenceField, ListField, BooleanField, DateTimeField, DynamicField, DictField, IntField, signals
+import contextlib
+from mongoengine import Document, StringField, LazyReferenceField, ListField, BooleanField, DateTimeField, DynamicField, DictField, IntField, Q, signals
+from mongoengine.errors import SaveConditionError
 from bson.objectid import ObjectId
 
 from models.user import User
 from config.setup import Setup
 from models.log import Log
-from utils import TextUtils, T
+from models.change_capture import ChangeCapture
+from models.guild_counter import GuildCounter
+from models.guild_registry import GuildRegistry
+from utils import TextUtils, T, UnitOfWork, DOCUMENTS, SHEETS, INVOKABLES, NameSearch, Subtree, Track, AspectIndex
 
 SETUP = Setup()
 X = SETUP.x
@@ -18,12 +23,18 @@ STRESS_TITLES = SETUP.stress_titles
 CONSEQUENCES = SETUP.consequences
 CONSEQUENCES_TITLES = SETUP.consequences_titles
 CONSEQUENCES_SHIFTS = SETUP.consequence_shifts
+# The categories counted by get_stats and their titles
+STATS = {'Scenario': 'Scenarios', 'Scene': 'Scenes', 'Zone': 'Zones', 'Character': 'Characters', 'Aspect': 'Aspects', 'Stunt': 'Stunts'}
 
-class Character(Document):
+class Character(ChangeCapture, Document):
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     user = LazyReferenceField(User)
     parent_id = StringField()
+    # Ids of every parent up to the root, so a whole subtree can be loaded with one query
+    ancestors = ListField(StringField())
     active_character = StringField()
     npc = BooleanField()
     characters = ListField(StringField())
@@ -57,42 +68,62 @@ class Character(Document):
     custom_properties = DynamicField()
     archived = BooleanField(default=False)
     history_id = StringField()
+    # Incremented by every write, so targeted updates can check nothing changed since the document was loaded
+    version = IntField(default=0)
     shared = DynamicField()
     created_by = StringField()
     created = DateTimeField(required=True)
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('parent_id', 'category', 'archived'),
+            'ancestors',
+            ('guild', 'category', 'archived', 'name'),
+            'user',
+            'active_target',
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
+
+    # The ancestors follow the parent_id and the version follows every write, so they are left out of the change logs
+    capture_exclude = ('ancestors', 'version')
+    capture_query_keys = True
+
     @classmethod
     def pre_save(cls, sender, document, **kwargs):
         document.updated = T.now()
-
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = {}
-            for c in document._delta()[0]:
-                changes[c.replace('.', '__')] = document._delta()[0][c]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, document.category, changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+        document.version = (document.version or 0) + 1
+        if document.pk is None or 'parent_id' in document._get_changed_fields() or (document.parent_id and not document.ancestors):
+            document.ancestors = cls.get_ancestors(document.parent_id)
+
+    def save(self, *args, **kwargs):
+        """Save the character only when the stored version is the one it was loaded with
+
+        Every write increments the version, so a save after another command changed the
+        character is refused instead of overwriting that command's changes.
+        """
+
+        if self.pk is not None and not self._created and kwargs.get('save_condition', None) is None:
+            version = self.version or 0
+            # Characters saved before versioning have no version
+            kwargs['save_condition'] = {'version': version} if version else {'version__in': [None, 0]}
+        try:
+            return super().save(*args, **kwargs)
+        except SaveConditionError:
+            raise Exception(f'***{self.name}*** was changed by another command. Please try again.')
+
+    def get_log_category(self):
+        return self.category
+
+    def invalidate_caches(self):
+        DOCUMENTS.invalidate_document(self)
+        # A saved aspect or stunt changes the sheet of every character above it
+        SHEETS.invalidate_sheets([str(self.id)] + list(self.ancestors))
+        INVOKABLES.invalidate_trees(Character, [str(self.id)] + list(self.ancestors))
 
     @staticmethod
     def query():
@@ -100,7 +131,7 @@ class Character(Document):
 
     @staticmethod
     def filter(**params):
-        return Character.objects.filter(**params)
+        return NameSearch.filter(Character.objects, params)
 
     @classmethod
     def find(cls, user, name, guild, parent=None, category='', archived=False, npc=False):
@@ -108,7 +139,7 @@ class Character(Document):
         if user:
             params.update(user=user.id)
         if name:
-            params.update(name__icontains=name)
+            params.update(search=name)
         if guild:
             params.update(guild=guild)
         if parent:
@@ -118,14 +149,145 @@ class Character(Document):
         if category:
             params.update(category=category)
         params.update(archived=archived)
-        character = cls.filter(**params).first()
+        character = UnitOfWork.merge(cls.filter(**params).first())
         return character
 
     @classmethod
     def get_by_id(cls, id):
-        character = cls.filter(id=ObjectId(id)).first()
+        character = UnitOfWork.load(cls, id, lambda: cls.filter(id=ObjectId(id)).first(), DOCUMENTS)
         return character
 
+    @classmethod
+    def get_ancestors(cls, parent_id):
+        if not parent_id:
+            return []
+        parent = cls.get_by_id(parent_id) if ObjectId.is_valid(parent_id) else None
+        # Scenario, Scene, Zone and other containers are not Characters and end the chain
+        ancestors = list(parent.ancestors) if parent and parent.ancestors else []
+        return ancestors + [str(parent_id)]
+
+    @classmethod
+    def get_tree(cls, root, archived=False):
+        """Load every descendant of a character and group them by parent
+
+        Descendants are found with a single query on the materialized ancestors list.
+        Documents saved before the ancestors list existed are found one level at a time.
+
+        Parameters
+        ----------
+        root : Character
+            The character at the top of the tree
+        archived : bool
+            Load archived or active descendants
+
+        Returns
+        -------
+        dict - lists of children keyed by parent id
+        """
+
+        root_id = str(root.id)
+        nodes = list(cls.objects(Q(ancestors=root_id) | Q(parent_id=root_id), archived=archived))
+        if any(not n.ancestors for n in nodes):
+            nodes = []
+            level = [root_id]
+            while level:
+                children = list(cls.filter(parent_id__in=level, archived=archived))
+                nodes.extend(children)
+                level = [str(c.id) for c in children]
+        tree = {}
+        for node in nodes:
+            tree.setdefault(node.parent_id, []).append(node)
+            node._tree = tree
+        return tree
+
+    @classmethod
+    def get_invokable_trees(cls, ids):
+        """Load several characters and their trees with one query and find their invokable objects
+
+        Parameters
+        ----------
+        ids : list(str)
+            The ObjectId string values of the characters
+
+        Returns
+        -------
+        tuple(dict, dict) - the characters and lists of (aspect, parent) pairs keyed by id
+        """
+
+        ids = list(set(ids))
+        documents = list(cls.objects(Q(id__in=[ObjectId(i) for i in ids]) | (Q(archived=False) & (Q(ancestors__in=ids) | Q(parent_id__in=ids)))))
+        roots = {str(d.id): d for d in documents if str(d.id) in ids}
+        nodes = [d for d in documents if not d.archived and d.parent_id and (d.parent_id in ids or set(d.ancestors) & set(ids))]
+        if any(not n.ancestors for n in nodes):
+            nodes = []
+            level = ids
+            while level:
+                children = list(cls.filter(parent_id__in=level, archived=False))
+                nodes.extend(children)
+                level = [str(c.id) for c in children]
+        tree = {}
+        for node in nodes:
+            tree.setdefault(node.parent_id, []).append(node)
+            node._tree = tree
+        pairs = {}
+        for id, root in roots.items():
+            root._tree = tree
+            pairs[id] = [(a['char'], a['parent']) for a in root.get_invokable_objects()]
+            root._tree = None
+        return roots, pairs
+
+    @classmethod
+    def get_invokables(cls, ids):
+        """Get the invokable aspects and stunts for a list of characters from the index
+
+        Characters missing from the index are loaded together with a single query.
+
+        Parameters
+        ----------
+        ids : list(str)
+            The ObjectId string values of the characters
+
+        Returns
+        -------
+        tuple(dict, dict, dict) - the character names, lists of {'char', 'parent'} dictionaries
+            and AspectIndex search indexes keyed by id
+        """
+
+        def indexer(pairs):
+            return AspectIndex([{'char': c, 'parent': p} for c, p in pairs])
+        names, invokables, indexes = INVOKABLES.load(cls, [str(i) for i in ids if i], cls.get_invokable_trees, indexer)
+        available = {}
+        for id, pairs in invokables.items():
+            available[id] = [{'char': UnitOfWork.merge(c), 'parent': UnitOfWork.merge(p)} for c, p in pairs]
+        return names, available, indexes
+
+    @staticmethod
+    def get_reference_id(document, field):
+        """Get the id stored in a ReferenceField without loading the referenced document"""
+
+        value = document._data.get(field, None)
+        return str(getattr(value, 'id', value)) if value else None
+
+    @contextlib.contextmanager
+    def subtree(self):
+        """Hold the loaded descendants of this character while rendering it"""
+
+        if getattr(self, '_tree', None) is not None:
+            yield self._tree
+            return
+        self._tree = Character.get_tree(self)
+        try:
+            yield self._tree
+        finally:
+            # Drop the tree so later renders see children saved after this one
+            self._tree = None
+
+    def get_children(self, category=''):
+        """Get the active children of this character from the loaded tree"""
+
+        with self.subtree() as tree:
+            return [c for c in tree.get(str(self.id), []) if not category or c.category == category]
+
     @classmethod
     def get_by_user(cls, user):
         characters = cls.filter(user=user.id).all()
@@ -147,7 +309,7 @@ class Character(Document):
         if parent:
             params.update(parent_id=str(parent.id))
         if name:
-            params.update(name__icontains=name)
+            params.update(search=name)
         if category:
             params.update(category=category)
         params.update(archived=archived)
@@ -167,9 +329,9 @@ class Character(Document):
         if category == 'Character' and not npc:
             self.refresh = 3
             self.fate_points = 3
-            self.stress = STRESS
+            self.stress = Track.to_sons(STRESS)
             self.stress_titles = STRESS_TITLES
-            self.consequences = CONSEQUENCES
+            self.consequences = Track.load(CONSEQUENCES).to_son()
             self.consequences_titles = CONSEQUENCES_TITLES
         if parent_id:
             self.parent_id = parent_id
@@ -187,34 +349,50 @@ class Character(Document):
         return character
 
     def archive(self, user):
-            self.reverse_archive(self.user)
+            self.reverse_archive(user)
             self.archived = True
             self.updated_by = str(user.id)
             self.updated = T.now()
             self.save()
 
     def reverse_archive(self, user):
-        for c in Character().get_by_parent(self):
-            c.reverse_archive(self.user)
-            c.archived = True
-            c.updated_by = str(user.id)
-            c.updated = T.now()
-            c.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
-            self.reverse_restore(self.user)
+            self.reverse_restore(user)
             self.archived = False
             self.updated_by = str(user.id)
             self.updated = T.now()
             self.save()
 
     def reverse_restore(self, user):
-        for c in Character().get_by_parent(parent=self, archived=True):
-            c.reverse_restore(self.user)
-            c.archived = False
-            c.updated_by = str(user.id)
-            c.updated = T.now()
-            c.save()
+        Subtree.restore(self, user)
+
+    def copy_to(self, user, guild):
+        """
+        Copy the character and its aspects and stunts (at every depth) to a guild
+
+        Parameters
+        ----------
+        user : User
+            The user who owns the copy
+        guild : str
+            The guild of the copy
+
+        Returns
+        -------
+        Character - the copy
+        """
+
+        copies = Subtree.clone(self, user, guild)
+        ids = [str(c['_id']) for c in copies]
+        for category in set(c.get('category') for c in copies):
+            GuildCounter.add(guild, category, len([c for c in copies if c.get('category') == category]))
+        GuildRegistry.touch(guild, 1 if self.category == 'Character' else 0)
+        # One change log for the copy; undoing it archives the whole copied subtree
+        data = {'name': self.name, 'guild': guild, 'source_id': str(self.id), Subtree.FIELD: ids[1:]}
+        Log().create_new(ids[0], self.name, str(user.id), guild, self.category, data, 'created')
+        return Character.get_by_id(ids[0])
 
     def get_string_name(self, user=None, parent=None):
         active = ''
@@ -252,11 +430,11 @@ class Character(Document):
         available = []
         if char.high_concept or char.trouble:
             available.append({'char': char, 'parent': char})
-        children = Character().get_by_parent(char, '', '')
-        for child in children:
-            if child.category in ['Aspect', 'Stunt']:
-                available.append({'char': child, 'parent': char})
-                available.extend(self.get_invokable_objects(child))
+        with char.subtree():
+            for child in char.get_children():
+                if child.category in ['Aspect', 'Stunt']:
+                    available.append({'char': child, 'parent': char})
+                    available.extend(self.get_invokable_objects(child))
         return available
 
     def get_available_stress(self, stress_type_str):
@@ -264,7 +442,7 @@ class Character(Document):
             stress_type = [i for i in range(0, len(self.stress_titles)) if stress_type_str.lower() in [self.stress_titles[i].lower()[0:2], self.stress_titles[i].lower()]]
             stress_int = stress_type[0] if stress_type else None
             if stress_int:
-                return sum([1 for s in self.stress[stress_type] if s[1] == O]) if self.stress else 0
+                return Track.load(self.stress[stress_int]).count_free() if self.stress else 0
         return 0
 
     def get_character_aspects(self, char=None):
@@ -299,7 +477,7 @@ class Character(Document):
         return available
 
     def get_string_aspects(self, user=None, parent=None):
-        aspects = Character().get_by_parent(self, '', 'Aspect')
+        aspects = self.get_children('Aspect')
         aspects_by_type = {}
         for a in aspects:
             aspect_type = a.type_name if a.type_name else 'Aspects'
@@ -310,7 +488,7 @@ class Character(Document):
         return aspects_string
 
     def get_string_stunts(self, user=None, parent=None):
-        stunts = Character().get_by_parent(self, '', 'Stunt')
+        stunts = self.get_children('Stunt')
         stunts_by_type = {}
         for s in stunts:
             stunt_type = s.type_name if s.type_name else 'Stunts'
@@ -324,7 +502,7 @@ class Character(Document):
         counters_string = ''
         if self.counters:
             for key in sorted(self.counters.keys()):
-                counters_string += '**_{name}:_**  {counter}'.format(name=self.counters[key]['name'], counter=' '.join(self.counters[key]['ticks']))
+                counters_string += '**_{name}:_**  {counter}'.format(name=self.counters[key]['name'], counter=' '.join(Track.load(self.counters[key]).get_marks()))
         return f'{self.nl()}{self.nl()}{counters_string}' if counters_string else ''
 
     def get_string_skills(self):
@@ -349,17 +527,17 @@ class Character(Document):
         stress_name = '**_Stress:_** '
         stress_string = ''
         if self.stress:
+            tracks = Track.load_all(self.stress)
             if self.stress_titles and len(self.stress_titles) == 1:
                 stress_name = f'**_{self.stress_titles[0]}_** '
-                stress = '  '.join([self.stress[0][s][1] for s in range(0, len(self.stress[0]))])
+                stress = '  '.join(tracks[0].get_marks())
                 stress_string = f' {stress}'
             else:
                 stress = [f'_{s}:_ ' for s in self.stress_titles] if self.stress_titles else ['_Physical:_ ', '_Mental:_   ']
-                for t in range(0, len(self.stress)):
+                for t in range(0, len(tracks)):
                     # Ensure the number of stress titles match the number of stres tracks
                     if len(stress) > t:
-                        for s in range(0, len(self.stress[t])):
-                            stress[t] += f' {self.stress[t][s][1]}'
+                        stress[t] += ''.join([f' {mark}' for mark in tracks[t].get_marks()])
                 stress_string = self.sep() + self.sep().join(stress)
         return f'{self.nl()}{self.nl()}{stress_name}{stress_string}' if stress_string else ''
 
@@ -370,10 +548,11 @@ class Character(Document):
             consequences_name = '**_Conditions:_** ' if self.consequences_titles else consequences_name
             consequences = [f'_{t}_ ' for t in self.consequences_titles] if self.consequences_titles else ['_Mild:_           ', '_Moderate:_ ', '_Severe:_       ']
             consequences_strings = []
-            for c in range(0, len(self.consequences)):
-                check = ' '+ self.consequences[c][1]
-                description = f' - {self.consequences[c][2]}' if self.consequences[c][1] and len(self.consequences[c]) == 3 else ''
-                consequences_strings.append(f'{check} _{self.consequences[c][0]}_ {consequences[c]}{description}')
+            track = Track.load(self.consequences)
+            for c in range(0, len(track)):
+                check = ' '+ track.get_mark(c)
+                description = f' - {track.get_aspect(c)}' if track.get_aspect(c) else ''
+                consequences_strings.append(f'{check} _{track.boxes[c]}_ {consequences[c]}{description}')
             consequences_string = self.sep().join([c for c in consequences_strings])
         return f'{self.nl()}{self.nl()}{consequences_name}{self.sep()}{consequences_string}' if consequences_string else ''
 
@@ -394,16 +573,30 @@ class Character(Document):
             sharing_string = self.nl().join(sharing)
         return sharing_string
 
+    def get_sharing_key(self):
+        # The creator's name and contact on a shared sheet change without a save of the character
+        if not self.shared or not self.created_by:
+            return None
+        user = User().get_by_id(str(self.created_by))
+        return (user.name, user.url) if user else None
+
     def get_string(self, user=None, parent=None):
-        archived = '```css\nARCHIVED```' if self.archived else ''
         name = self.get_string_name(user, parent)
+        if self.pk is None or self._get_changed_fields():
+            return self.render_string(name, user)
+        return SHEETS.render(self.id, (self.updated, name, self.get_sharing_key()), lambda: self.render_string(name, user))
+
+    def render_string(self, name, user=None):
+        archived = '```css\nARCHIVED```' if self.archived else ''
         fate_points = self.get_string_fate()
         description = f'{self.sep()}**Description:** {self.description}' if self.description else ''
         high_concept = f'{self.sep()}**High Concept:** {self.high_concept}' if self.high_concept else ''
         trouble = f'{self.sep()}**Trouble:** {self.trouble}' if self.trouble else ''
         custom = self.get_string_custom()
-        aspects = self.get_string_aspects(user)
-        stunts = self.get_string_stunts(user)
+        # Aspects and stunts at every level render from one query for the whole tree
+        with self.subtree():
+            aspects = self.get_string_aspects(user)
+            stunts = self.get_string_stunts(user)
         skills = self.get_string_skills()
         counters = self.get_string_counters()
         stress = self.get_string_stress()
@@ -426,88 +619,41 @@ class Character(Document):
         sharing = self.get_sharing_string(user)
         return f'{short_string}{sharing}'
 
-    def get_guilds(self, options={}):
-        pipeline = []
-        match = {}
-        if 'guild' in options and options['guild'] and len(options['guild']) > 0:
-            match.update(guild={"$in":options['guild']})
-        if 'user' in options and options['user'] and len(options['user']) > 0:
-            match.update(user={"$in":options['user']})
-        if match:
-            pipeline.append({"$match": match})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}}})
-        pipeline.append({"$project": {"guild": "$_id.guild"}})
-        pipeline.append({"$sort": {"guild": 1}})
-        guilds = list(Character.objects.aggregate(*pipeline))
-        return guilds
+    @staticmethod
+    def get_category_totals(guild=''):
+        """
+        Count the Character documents by guild and category with one aggregation
 
-    def get_stats(self, guild):
-        guild = '' if guild.lower() == 'all' else guild
+        Parameters
+        ----------
+        guild : str
+            The guild to count (or '' for every guild)
+
+        Returns
+        -------
+        list(tuple) - the (guild, category, total) of each group
+        """
 
         pipeline = []
         if guild:
             pipeline.append({"$match": {"guild": guild}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}}})
-        pipeline.append({"$project": {"guild": "$_id.guild"}})
-        pipeline.append({"$sort": {"guild": 1}})
-        guilds = list(Character.objects.aggregate(*pipeline))
-
-        pipeline = []
-        pipeline.append({"$match": {'category': {"$in":['Scenario']}}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}, "total": {"$sum": 1}}})
-        pipeline.append({"$project": {"guild": "$_id.guild", "total": "$total"}})
-        pipeline.append({"$sort": {"guild": 1, "total": 1}})
-        scenarios_per_guild = list(Character.objects.aggregate(*pipeline))
-
-        pipeline = []
-        pipeline.append({"$match": {'category': {"$in":['Scene']}}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}, "total": {"$sum": 1}}})
-        pipeline.append({"$project": {"guild": "$_id.guild", "total": "$total"}})
-        pipeline.append({"$sort": {"guild": 1, "total": 1}})
-        scenes_per_guild = list(Character.objects.aggregate(*pipeline))
-
-        pipeline = []
-        pipeline.append({"$match": {'category': {"$in":['Zone']}}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}, "total": {"$sum": 1}}})
-        pipeline.append({"$project": {"guild": "$_id.guild", "total": "$total"}})
-        pipeline.append({"$sort": {"guild": 1, "total": 1}})
-        zones_per_guild = list(Character.objects.aggregate(*pipeline))
-
-        pipeline = []
-        pipeline.append({"$match": {'category': {"$in":['Character']}}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}, "total": {"$sum": 1}}})
-        pipeline.append({"$project": {"guild": "$_id.guild", "total": "$total"}})
-        pipeline.append({"$sort": {"guild": 1, "total": 1}})
-        characters_per_guild = list(Character.objects.aggregate(*pipeline))
-
-        pipeline = []
-        pipeline.append({"$match": {'category': {"$in":['Aspect']}}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}, "total": {"$sum": 1}}})
-        pipeline.append({"$project": {"guild": "$_id.guild", "total": "$total"}})
-        pipeline.append({"$sort": {"guild": 1, "total": 1}})
-        aspects_per_guild = list(Character.objects.aggregate(*pipeline))
-
-        pipeline = []
-        pipeline.append({"$match": {'category': {"$in":['Stunt']}}})
-        pipeline.append({ "$group": {"_id": {"guild": "$guild"}, "total": {"$sum": 1}}})
-        pipeline.append({"$project": {"guild": "$_id.guild", "total": "$total"}})
-        pipeline.append({"$sort": {"guild": 1, "total": 1}})
-        stunts_per_guild = list(Character.objects.aggregate(*pipeline))
+        pipeline.append({"$group": {"_id": {"guild": "$guild", "category": "$category"}, "total": {"$sum": 1}}})
+        return [(r['_id'].get('guild'), r['_id'].get('category'), r['total']) for r in Character.objects.aggregate(*pipeline)]
 
+    def get_stats(self, guild):
+        guild = '' if guild.lower() == 'all' else guild
+        rows = GuildCounter.get_totals(guild) if GuildCounter.enabled else self.get_category_totals(guild)
         totals = {}
-        for g in guilds:
-            if g['guild']:
-                guild = g['guild']
-                totals[guild] = {
-                    'Scenarios': next((c['total'] for c in scenarios_per_guild if guild == c['guild']), 0),
-                    'Scenes': next((c['total'] for c in scenes_per_guild if guild == c['guild']), 0),
-                    'Zones': next((c['total'] for c in zones_per_guild if guild == c['guild']), 0),
-                    'Characters': next((c['total'] for c in characters_per_guild if guild == c['guild']), 0),
-                    'Aspects': next((c['total'] for c in aspects_per_guild if guild == c['guild']), 0),
-                    'Stunts': next((c['total'] for c in stunts_per_guild if guild == c['guild']), 0),
-                }
+        for g, category, total in sorted(rows, key=lambda r: (str(r[0]), str(r[1]))):
+            if g:
+                totals.setdefault(g, {title: 0 for title in STATS.values()})
+                if category in STATS:
+                    totals[g][STATS[category]] += total
         return totals
 
 
 signals.pre_save.connect(Character.pre_save, sender=Character)
-signals.post_save.connect(Character.post_save, sender=Character)
\ No newline at end of file
+ChangeCapture.attach(Character)
+signals.post_save.connect(GuildCounter.saved, sender=Character)
+signals.post_delete.connect(GuildCounter.deleted, sender=Character)
+signals.post_save.connect(GuildRegistry.character_saved, sender=Character)
\ No newline at end of file
@@ -2,15 +2,17 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField, DynamicField, signals
+from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField, DynamicField
 from models.character import User
 from models.character import Character
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS, NameSearch, Subtree
 
-class Engagement(Document):
+class Engagement(ChangeCapture, Document):
     parent_id = StringField()
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     description = StringField()
     channel_id = StringField()
@@ -29,30 +31,16 @@ class Engagement(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Engagement', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('scene_id', 'archived', 'name', 'created'),
+            ('channel_id', 'archived', 'name', 'created'),
+            ('guild', 'channel_id', 'scene_id', 'archived'),
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -60,7 +48,7 @@ class Engagement(Document):
 
     @staticmethod
     def filter(**params):
-        return Engagement.objects.filter(**params)
+        return NameSearch.filter(Engagement.objects, params)
 
     def create_new(self, user, guild, channel_id, scene_id, name, archived):
         self.name = name
@@ -76,8 +64,8 @@ class Engagement(Document):
         return self
 
     def find(self, guild, channel_id, scene_id, name, archived=False):
-        filter = Engagement.objects(guild=guild, channel_id=channel_id, scene_id=scene_id, name__icontains=name, archived=archived)
-        engagement = filter.first()
+        filter = Engagement.filter(guild=guild, channel_id=channel_id, scene_id=scene_id, search=name, archived=archived)
+        engagement = UnitOfWork.merge(filter.first())
         return engagement
 
     def get_or_create(self, user, guild, channel, scene, name, archived=False):
@@ -89,7 +77,7 @@ class Engagement(Document):
         return engagement
 
     def get_by_id(self, id):
-        engagement = Engagement.objects(id=id).first()
+        engagement = UnitOfWork.load(Engagement, id, lambda: Engagement.objects(id=id).first(), DOCUMENTS)
         return engagement
 
     @classmethod
@@ -132,12 +120,7 @@ class Engagement(Document):
             self.save()
 
     def reverse_archive(self, user):
-        for z in Engagement().get_by_parent(parent_id=str(self.id)):
-            z.reverse_archive(user)
-            z.archived = True
-            z.updated_by = str(user.id)
-            z.updated = T.now()
-            z.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
             self.reverse_restore(user)
@@ -147,12 +130,7 @@ class Engagement(Document):
             self.save()
 
     def reverse_restore(self, user):
-        for z in Engagement().get_by_parent(parent_id=str(self.id)):
-            z.reverse_restore(user)
-            z.archived = False
-            z.updated_by = str(user.id)
-            z.updated = T.now()
-            z.save()
+        Subtree.restore(self, user)
 
     def get_string_characters(self, channel=None):
         characters = [Character.get_by_id(id) for id in self.characters]
@@ -211,5 +189,5 @@ class Engagement(Document):
         return f'        {name}{active}{description}{characters}{opposition}'
 
 
-signals.post_save.connect(Engagement.post_save, sender=Engagement)
+ChangeCapture.attach(Engagement)
         
\ No newline at end of file
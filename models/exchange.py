@@ -2,15 +2,17 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField, signals
+from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField
 from models.character import User
 from models.character import Character
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS, NameSearch, Subtree
 
-class Exchange(Document):
+class Exchange(ChangeCapture, Document):
     parent_id = StringField()
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     description = StringField()
     channel_id = StringField()
@@ -28,30 +30,16 @@ class Exchange(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Exchange', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('engagement_id', 'archived', 'name', 'created'),
+            ('channel_id', 'archived', 'name', 'created'),
+            ('guild', 'channel_id', 'engagement_id', 'archived'),
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -59,7 +47,7 @@ class Exchange(Document):
 
     @staticmethod
     def filter(**params):
-        return Exchange.objects.filter(**params)
+        return NameSearch.filter(Exchange.objects, params)
 
     def create_new(self, user, guild, channel_id, engagement_id, name, archived):
         self.name = name
@@ -75,8 +63,8 @@ class Exchange(Document):
         return self
 
     def find(self, guild, channel_id, engagement_id, name, archived=False):
-        filter = Exchange.objects(guild=guild, channel_id=channel_id, engagement_id=engagement_id, name__icontains=name, archived=archived)
-        exchange = filter.first()
+        filter = Exchange.filter(guild=guild, channel_id=channel_id, engagement_id=engagement_id, search=name, archived=archived)
+        exchange = UnitOfWork.merge(filter.first())
         return exchange
 
     def get_or_create(self, user, guild, channel, engagement, name, archived=False):
@@ -88,7 +76,7 @@ class Exchange(Document):
         return exchange
 
     def get_by_id(self, id):
-        exchange = Exchange.objects(id=id).first()
+        exchange = UnitOfWork.load(Exchange, id, lambda: Exchange.objects(id=id).first(), DOCUMENTS)
         return exchange
 
     @classmethod
@@ -131,12 +119,7 @@ class Exchange(Document):
             self.save()
 
     def reverse_archive(self, user):
-        for z in Exchange().get_by_parent(parent_id=str(self.id)):
-            z.reverse_archive(user)
-            z.archived = True
-            z.updated_by = str(user.id)
-            z.updated = T.now()
-            z.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
             self.reverse_restore(user)
@@ -146,12 +129,7 @@ class Exchange(Document):
             self.save()
 
     def reverse_restore(self, user):
-        for z in Exchange().get_by_parent(parent_id=str(self.id)):
-            z.reverse_restore(user)
-            z.archived = False
-            z.updated_by = str(user.id)
-            z.updated = T.now()
-            z.save()
+        Subtree.restore(self, user)
 
     def get_string_characters(self, channel=None):
         characters = [Character.get_by_id(id) for id in self.characters]
@@ -210,5 +188,5 @@ class Exchange(Document):
         return f'        {name}{active}{description}{characters}{opposition}'
 
 
-signals.post_save.connect(Exchange.post_save, sender=Exchange)
+ChangeCapture.attach(Exchange)
         
\ No newline at end of file
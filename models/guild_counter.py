@@ -0,0 +1,112 @@
+# guild_counter.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+from mongoengine import Document, StringField, IntField
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+load_dotenv()
+# Keep a running count of characters, aspects and stunts for each guild (rebuild with the guild_counters migration after enabling)
+STATS_COUNTERS = os.getenv('DISCORD_STATS_COUNTERS', '0') == '1'
+
+class GuildCounter(Document):
+    """
+    Running count of the Character documents of each category in each guild
+
+    When DISCORD_STATS_COUNTERS is enabled the counters are updated with an upserted $inc
+    as characters are created, deleted or change category, and stats are read from them
+    instead of aggregating the Character collection.
+    """
+
+    enabled = STATS_COUNTERS
+
+    guild = StringField(required=True)
+    category = StringField(required=True)
+    total = IntField(default=0)
+
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['guild', 'category'], 'unique': True}
+        ]
+    }
+
+    @staticmethod
+    def add(guild, category, count=1):
+        """
+        Add to the count of a category in a guild
+
+        Parameters
+        ----------
+        guild : str
+            The guild name
+        category : str
+            The Character category (Character, Aspect, Stunt...)
+        count : int
+            The number to add (negative to subtract)
+        """
+
+        if GuildCounter.enabled and guild and category and count:
+            GuildCounter.objects(guild=guild, category=category).update_one(inc__total=count, upsert=True)
+
+    @classmethod
+    def saved(cls, sender, document, **kwargs):
+        """
+        post_save handler counting new characters and category changes
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class that was saved
+        document : mongoengine.Document
+            The document that was saved
+        """
+
+        if kwargs.get('created', False):
+            cls.add(document.guild, document.category)
+        elif isinstance(getattr(document, '_before', {}).get('category', None), str):
+            cls.add(document.guild, document._before['category'], -1)
+            cls.add(document.guild, document.category)
+
+    @classmethod
+    def deleted(cls, sender, document, **kwargs):
+        """post_delete handler removing a deleted character from the counts"""
+
+        cls.add(document.guild, document.category, -1)
+
+    @staticmethod
+    def get_totals(guild=''):
+        """
+        Get the counts for one guild or every guild
+
+        Returns
+        -------
+        list(tuple) - the (guild, category, total) of each counter
+        """
+
+        counters = GuildCounter.objects(guild=guild) if guild else GuildCounter.objects
+        return [(c.guild, c.category, c.total) for c in counters]
+
+    @staticmethod
+    def rebuild(rows):
+        """
+        Replace every counter with totals from an aggregation
+
+        Parameters
+        ----------
+        rows : list(tuple)
+            The (guild, category, total) rows to store
+
+        Returns
+        -------
+        int - the number of counters written
+        """
+
+        collection = GuildCounter._get_collection()
+        collection.delete_many({})
+        requests = [UpdateOne({'guild': g, 'category': c}, {'$set': {'total': t}}, upsert=True) for g, c, t in rows if g and c]
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+        return len(requests)
@@ -0,0 +1,110 @@
+# guild_registry.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from mongoengine import Document, StringField, ListField, IntField, DateTimeField
+from utils import T
+
+class GuildRegistry(Document):
+    """
+    One document for each guild with its members, character count and last character activity
+
+    The registry is updated with an upsert as users and characters are created and as
+    characters are archived or restored, so commands listing guilds read a few small
+    documents instead of grouping the Character collection.
+    """
+
+    name = StringField(required=True)
+    # Names of the users with a User document in the guild
+    members = ListField(StringField())
+    # Unarchived documents with the Character category
+    characters = IntField(default=0)
+    # When a character was last created, archived or restored (None until the first character)
+    last_activity = DateTimeField()
+    created = DateTimeField()
+    updated = DateTimeField()
+
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['name'], 'unique': True},
+            ('members', 'name')
+        ]
+    }
+
+    @staticmethod
+    def touch(guild, characters=0, member=None, activity=True):
+        """
+        Record activity in a guild, creating its entry on first use
+
+        Parameters
+        ----------
+        guild : str
+            The guild name
+        characters : int
+            The change in the number of unarchived characters
+        member : str
+            The name of a user to add to the guild members
+        activity : bool
+            Whether a character was created, archived or restored
+        """
+
+        if not guild:
+            return
+        now = T.now()
+        update = {'set__updated': now, 'set_on_insert__created': now}
+        if activity:
+            update['set__last_activity'] = now
+        if characters:
+            update['inc__characters'] = characters
+        if member:
+            update['add_to_set__members'] = member
+        GuildRegistry.objects(name=guild).update_one(upsert=True, **update)
+
+    @classmethod
+    def character_saved(cls, sender, document, **kwargs):
+        """
+        post_save handler counting created, archived and restored characters
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class that was saved
+        document : mongoengine.Document
+            The document that was saved
+        """
+
+        counted = 1 if document.category == 'Character' else 0
+        if kwargs.get('created', False):
+            cls.touch(document.guild, 0 if document.archived else counted)
+        elif 'archived' in document._get_changed_fields():
+            cls.touch(document.guild, -counted if document.archived else counted)
+
+    @classmethod
+    def user_saved(cls, sender, document, **kwargs):
+        """post_save handler adding new users to the members of their guild"""
+
+        if kwargs.get('created', False):
+            cls.touch(document.guild, member=document.name, activity=False)
+
+    @staticmethod
+    def get_names(member=None, active=False):
+        """
+        Get the guild names, optionally only those with a member
+
+        Parameters
+        ----------
+        member : str
+            The user name the guilds must have as a member
+        active : bool
+            Only include guilds where characters have been created
+
+        Returns
+        -------
+        list(str) - the guild names in order
+        """
+
+        guilds = GuildRegistry.objects(members=member) if member else GuildRegistry.objects
+        if active:
+            guilds = guilds.filter(last_activity__ne=None)
+        return list(guilds.order_by('name').scalar('name'))
@@ -0,0 +1,119 @@
+# history_tracker.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import bson
+import threading
+import contextlib
+from bson.objectid import ObjectId
+from models.user import User
+from utils import T, UnitOfWork, DOCUMENTS
+
+# The position moves held back by HistoryTracker.deferred in each thread
+DEFERRED = threading.local()
+
+class HistoryTracker(object):
+    """
+    Keep each user's undo history position (User.history_id) in step with their saves
+
+    An undo or redo save moves the position to its change log and any other change log
+    save clears it. The position is read from the request's identity map or the document
+    cache, so a save that leaves the position unchanged costs no round trip, and a change
+    is written with one atomic $set on the user instead of loading and saving the User.
+
+    Moves made inside a deferred block are held back and written once the block
+    succeeds, so a batch of undo or redo saves only moves the position when every
+    document was written.
+
+    Usage:
+    ```
+        HistoryTracker.move(document.updated_by, document.history_id)
+
+        with HistoryTracker.deferred():
+            ... /* save the undone documents */
+    ```
+    """
+
+    @staticmethod
+    def get_position(user_id):
+        """
+        Get a user's history position without querying Mongo
+
+        Parameters
+        ----------
+        user_id : str
+            The ObjectId string value of the user
+
+        Returns
+        -------
+        tuple(bool, str) - whether the position is known and the position (or None)
+        """
+
+        user = UnitOfWork.get_loaded(User, user_id)
+        if user is not None:
+            return True, user.history_id or None
+        data = DOCUMENTS.get(('User', str(user_id)))
+        if data is not None:
+            return True, bson.decode(data).get('history_id', None) or None
+        return False, None
+
+    @classmethod
+    def move(cls, user_id, history_id):
+        """
+        Set a user's history position when it changes
+
+        Parameters
+        ----------
+        user_id : str
+            The ObjectId string value of the user
+        history_id : str
+            The id of the change log to move to (or None to clear the position)
+
+        Returns
+        -------
+        bool - whether the user was updated
+        """
+
+        if not user_id:
+            return False
+        history_id = history_id or None
+        moves = getattr(DEFERRED, 'moves', None)
+        if moves is not None:
+            moves[str(user_id)] = history_id
+            return False
+        known, position = cls.get_position(user_id)
+        if known and position == history_id:
+            return False
+        query = User.objects(id=ObjectId(user_id))
+        if not known:
+            # Only write when the stored position is different
+            query = query.filter(history_id__ne=history_id)
+        now = T.now()
+        if history_id:
+            updated = query.update_one(set__history_id=history_id, set__updated_by=str(user_id), set__updated=now)
+        else:
+            updated = query.update_one(unset__history_id=True, set__updated_by=str(user_id), set__updated=now)
+        if updated:
+            DOCUMENTS.invalidate(('User', str(user_id)))
+        # Keep the request's user in step without marking it changed
+        user = UnitOfWork.get_loaded(User, user_id)
+        if user is not None:
+            user._data['history_id'] = history_id
+        return bool(updated)
+
+    @classmethod
+    @contextlib.contextmanager
+    def deferred(cls):
+        """Hold back the position moves made inside the block and write them once it succeeds"""
+
+        if getattr(DEFERRED, 'moves', None) is not None:
+            yield
+            return
+        DEFERRED.moves = {}
+        try:
+            yield
+            moves = DEFERRED.moves
+        finally:
+            DEFERRED.moves = None
+        for user_id, history_id in moves.items():
+            cls.move(user_id, history_id)
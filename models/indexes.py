@@ -0,0 +1,153 @@
+# indexes.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import logging
+from models.user import User
+from models.character import Character
+from models.scenario import Scenario
+from models.scene import Scene
+from models.zone import Zone
+from models.session import Session
+from models.engagement import Engagement
+from models.exchange import Exchange
+from models.channel import Channel
+from models.log import Log
+from models.revision import Revision
+from models.suggestion import Suggestion
+from models.guild_counter import GuildCounter
+from models.guild_registry import GuildRegistry
+
+logger = logging.getLogger(__name__)
+
+# The models declare their indexes in meta with auto_create_index off, so the indexes
+# are built here once at startup instead of on the first query in every worker
+MODELS = [User, Channel, Character, Scenario, Scene, Zone, Session, Engagement, Exchange, Log, Revision, Suggestion, GuildCounter, GuildRegistry]
+
+# The queries run for most commands: (name, model, filter, sort)
+HOT_QUERIES = [
+    ('user by name', User, {'name': '', 'guild': ''}, None),
+    ('channel by name', Channel, {'name': '', 'guild': ''}, None),
+    ('guilds by member', GuildRegistry, {'members': ''}, ('name',)),
+    ('character children', Character, {'parent_id': '', 'category': 'Aspect', 'archived': False}, None),
+    ('character subtree', Character, {'ancestors': '', 'archived': False}, None),
+    ('character search', Character, {'guild': '', 'search_name': ''}, None),
+    ('characters by name', Character, {'guild': '', 'category': 'Character', 'archived': False}, ('name', 'created')),
+    ('scenarios by channel', Scenario, {'channel_id': '', 'archived': False}, ('name', 'created')),
+    ('scenes by scenario', Scene, {'scenario_id': '', 'archived': False}, ('name', 'created')),
+    ('zones by scene', Zone, {'scene_id': '', 'archived': False}, ('name', 'created')),
+    ('sessions by channel', Session, {'channel_id': '', 'archived': False}, ('name', 'created')),
+    ('engagements by scene', Engagement, {'scene_id': '', 'archived': False}, ('name', 'created')),
+    ('exchanges by engagement', Exchange, {'engagement_id': '', 'archived': False}, ('name', 'created')),
+    ('undo list', Log, {'user_id': '', 'category__ne': 'Log'}, ('-created',)),
+    ('story log', Log, {'parent_id': ''}, ('-created',)),
+    ('error log', Log, {'category': 'Error'}, ('-created',))
+]
+
+def get_index_names(model):
+    """
+    Get the names Mongo gives the indexes declared in a model's meta
+
+    Parameters
+    ----------
+    model : mongoengine.Document
+        The Document class declaring the indexes
+
+    Returns
+    -------
+    list(str) - the index names
+    """
+
+    return ['_'.join(f'{field}_{direction}' for field, direction in spec['fields']) for spec in model._meta['index_specs']]
+
+def ensure_indexes(models=MODELS):
+    """
+    Build the declared indexes missing from each collection
+
+    Parameters
+    ----------
+    models : list(mongoengine.Document)
+        The Document classes to check
+
+    Returns
+    -------
+    list(str) - the collection and name of each index that was built
+    """
+
+    built = []
+    for model in models:
+        existing = model._get_collection().index_information()
+        missing = [name for name in get_index_names(model) if name not in existing]
+        if missing:
+            model.ensure_indexes()
+            built.extend(f'{model._get_collection_name()}.{name}' for name in missing)
+    return built
+
+def get_stages(plan):
+    """
+    Get every stage name in an explain plan
+
+    Parameters
+    ----------
+    plan : dict
+        The winningPlan of an explain result
+
+    Returns
+    -------
+    list(str) - the stage names from the top of the plan down
+    """
+
+    stages = [plan.get('stage', '')]
+    for child in ([plan['inputStage']] if 'inputStage' in plan else []) + plan.get('inputStages', []):
+        stages.extend(get_stages(child))
+    return stages
+
+def explain_hot_queries(queries=HOT_QUERIES):
+    """
+    Explain each hot query and find the ones still scanning a collection
+
+    Parameters
+    ----------
+    queries : list(tuple)
+        The (name, model, filter, sort) hot queries
+
+    Returns
+    -------
+    list(str) - a report line for each query scanning a collection or sorting in memory
+        with its plan stages
+    """
+
+    report = []
+    for name, model, params, sort in queries:
+        query = model.objects(**params)
+        if sort:
+            query = query.order_by(*sort)
+        try:
+            explain = query.explain()
+        except (AttributeError, NotImplementedError):
+            # mongomock has no query planner
+            return ['Explain is not supported by this database']
+        plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+        # The slot based engine nests the classic plan
+        plan = plan.get('queryPlan', plan)
+        stages = get_stages(plan)
+        if 'COLLSCAN' in stages or 'SORT' in stages:
+            report.append(f'Unindexed plan for {name} ({model.__name__}): {" <- ".join(stages)}')
+    return report
+
+def check_indexes():
+    """
+    Build the missing indexes, then log the hot queries that still scan a collection
+
+    Returns
+    -------
+    list(str) - the messages logged by the check
+    """
+
+    built = [f'Built index {name}' for name in ensure_indexes()]
+    for message in built:
+        logger.info(message)
+    scans = explain_hot_queries()
+    for message in scans:
+        logger.warning(message)
+    return built + scans
@@ -3,9 +3,12 @@ __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
 import datetime
-from mongoengine import Document, StringField, ReferenceField, DynamicField, BooleanField, DateTimeField
+from mongoengine import Document, StringField, ReferenceField, DynamicField, BooleanField, DateTimeField, Q
 from bson.objectid import ObjectId
-from utils import TextUtils, T
+from utils import TextUtils, T, UnitOfWork, LOG_WRITER, NameSearch, UNDOS, DIALOGS
+
+# Change log categories the undo command can apply
+UNDOABLE = ['Character', 'Aspect', 'Stunt', 'Channel', 'Scenario', 'Scene', 'Zone']
 
 class Log(Document):
     parent_id = StringField(required=True)
@@ -14,23 +17,38 @@ class Log(Document):
     name = StringField()
     category = StringField()
     data = DynamicField()
+    inverse = DynamicField()
+    absent = DynamicField()
     action = StringField()
     created_by = StringField()
     created = DateTimeField(required=True)
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('user_id', '-created'),
+            ('parent_id', '-created'),
+            ('category', '-created'),
+            '-updated'
+        ]
+    }
+
     @staticmethod
     def query():
+        # Write the buffered entries so the query sees them
+        LOG_WRITER.flush()
         return Log.objects
 
     @staticmethod
     def filter(**params):
+        LOG_WRITER.flush()
         return Log.objects.filter(**params)
 
     @classmethod
     def get_by_id(cls, id):
-        log = cls.filter(id=ObjectId(id)).first()
+        log = UnitOfWork.load(cls, id, lambda: cls.filter(id=ObjectId(id)).first())
         return log
 
     @classmethod
@@ -42,6 +60,67 @@ class Log(Document):
             logs = cls.filter(**params).order_by(sort).all()
         return logs
 
+    @classmethod
+    def get_undo_stack(cls, user_id, history_id=None):
+        """
+        Get the ids of a user's most recent undoable change logs
+
+        Only the user's newest change log is read unless the cached stack is out of date.
+        A history position older than the cached stack is read with the logs around it, and
+        never defaults to the newest log.
+
+        Parameters
+        ----------
+        user_id : str
+            The ObjectId string value of the user
+        history_id : str
+            The id of a change log the stack must include (the user's history position)
+
+        Returns
+        -------
+        dict - the stack ids, oldest first, and the position of each id
+        """
+
+        params = {'user_id': str(user_id), 'category__in': UNDOABLE}
+        top = cls.filter(**params).order_by('-created', '-id').only('id').first()
+        def loader(limit):
+            return [str(id) for id in cls.filter(**params).order_by('-created', '-id').limit(limit).scalar('id')][::-1]
+        stack = UNDOS.load(user_id, str(top.id) if top else None, loader)
+        position = stack['positions'].get(history_id, None) if history_id else None
+        # Positions missing from the cached stack, or at the start of a full one, may have older logs to undo
+        if history_id and (position is None or (position == 0 and len(stack['ids']) >= UNDOS.limit)):
+            stack = cls.get_undo_window(params, history_id, UNDOS.limit)
+        return stack
+
+    @classmethod
+    def get_undo_window(cls, params, history_id, limit):
+        """
+        Get the ids of a user's undoable change logs before and after a history position
+
+        Parameters
+        ----------
+        params : dict
+            The filters for the user's undoable change logs
+        history_id : str
+            The id of the change log at the history position
+        limit : int
+            The number of change logs read before and after the position
+
+        Returns
+        -------
+        dict - the stack ids, oldest first, and the position of each id
+        """
+
+        anchor = cls.filter(id=ObjectId(history_id), **params).only('id', 'created').first()
+        if not anchor:
+            raise Exception('Cannot find your undo history position')
+        at = Q(created=anchor.created)
+        before = cls.filter(**params).filter(Q(created__lt=anchor.created) | (at & Q(id__lte=anchor.id)))
+        after = cls.filter(**params).filter(Q(created__gt=anchor.created) | (at & Q(id__gt=anchor.id)))
+        ids = [str(id) for id in before.order_by('-created', '-id').limit(limit + 1).scalar('id')][::-1]
+        ids.extend([str(id) for id in after.order_by('created', 'id').limit(limit).scalar('id')])
+        return {'ids': ids, 'positions': {id: i for i, id in enumerate(ids)}}
+
     @classmethod
     def get_by_parent(cls, parent, category=''):
         logs = []
@@ -52,19 +131,31 @@ class Log(Document):
             params.update(category=category)
         return logs
 
-    def create_new(self, parent_id, name, user_id, guild, category, data, action):
+    def create_new(self, parent_id, name, user_id, guild, category, data, action, inverse=None, absent=None):
         self.parent_id = parent_id
         self.user_id = user_id
         self.guild = guild
         self.name = name
         self.category = category
-        self.data = data
+        # The search fields follow the name, so they are left out of the change logs
+        self.data = {k: v for k, v in data.items() if k not in NameSearch.FIELDS} if isinstance(data, dict) else data
+        # The values before the change, so undo does not search the earlier logs
+        if inverse is not None:
+            self.inverse = {k: v for k, v in inverse.items() if k not in NameSearch.FIELDS}
+            # The keys that were missing before the change, so undo removes them instead of setting them to null
+            self.absent = [k for k in absent if k not in NameSearch.FIELDS] if absent else []
         self.action = action
         self.created_by = str(user_id)
         self.created = T.now()
         self.updated_by = str(user_id)
         self.updated = T.now()
-        self.save()
+        # Inserted in a batch by the log writer, and only pushed on the undo stack (and listed
+        # in open dialogs) once it is written
+        def written():
+            if category in UNDOABLE and user_id:
+                UNDOS.push(user_id, str(self.id))
+            DIALOGS.invalidate_model('Log')
+        LOG_WRITER.add(self, written)
         return self
 
     def get_string(self, user=None):
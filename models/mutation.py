@@ -0,0 +1,268 @@
+# mutation.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import copy
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+from models.change_capture import Change, CHANGES
+from utils import T, BeforeImage
+
+load_dotenv()
+# Times a planned mutation is replanned from the stored values after another command changed the document
+MUTATION_RETRIES = int(os.getenv('DISCORD_MUTATION_RETRIES', '3'))
+
+# Marks a value removed by $unset while the new values are built in memory
+MISSING = object()
+
+class Mutation(object):
+    """
+    Targeted $set, $inc and $unset updates on one document with an optimistic version check
+
+    The update is sent with find_one_and_update, matching the version the document was
+    loaded with and incrementing it, so one round trip writes the changed paths and returns
+    their stored values for the change log inverse. When another command has changed the
+    document in between, nothing is written: a planned mutation reloads the fields it
+    touches and plans again, and a document's pending changes are refused rather than
+    overwriting the other command's update.
+
+    Usage:
+    ```
+        def plan(character, mutation):
+            mutation.inc('fate_points', 1)
+
+        Mutation.commit(character, user, plan)
+    ```
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.sets = {}
+        self.incs = {}
+        self.unsets = {}
+
+    def set(self, path, value):
+        """Set the value at a dotted path"""
+
+        self.sets[path] = value
+        return self
+
+    def inc(self, path, amount=1):
+        """Add to the number at a dotted path"""
+
+        self.incs[path] = self.incs.get(path, 0) + amount
+        return self
+
+    def unset(self, path):
+        """Remove the value at a dotted path"""
+
+        self.unsets[path] = 1
+        return self
+
+    def is_empty(self):
+        return not (self.sets or self.incs or self.unsets)
+
+    def get_fields(self):
+        """
+        Get the top level fields changed by the mutation
+
+        Returns
+        -------
+        list(str) - the field names in the order they were first changed
+        """
+
+        fields = []
+        for path in list(self.sets) + list(self.incs) + list(self.unsets):
+            field = path.split('.')[0]
+            if field not in fields:
+                fields.append(field)
+        return fields
+
+    @staticmethod
+    def put(value, keys, change):
+        """
+        Apply a change to the value at a path inside a stored value
+
+        Parameters
+        ----------
+        value : object
+            The stored value (dict, list or scalar)
+        keys : list(str)
+            The remaining path keys (list indexes as digits)
+        change : function
+            Returns the new value from the current one (or MISSING to remove it)
+
+        Returns
+        -------
+        object - the changed value
+        """
+
+        if not keys:
+            return change(value)
+        container = value if isinstance(value, (dict, list)) else {}
+        key = keys[0]
+        if isinstance(container, list):
+            index = int(key)
+            container[index] = Mutation.put(container[index], keys[1:], change)
+        else:
+            changed = Mutation.put(container.get(key, None), keys[1:], change)
+            if changed is MISSING:
+                container.pop(key, None)
+            else:
+                container[key] = changed
+        return container
+
+    def get_values(self, before):
+        """
+        Get the new value of each changed field from its stored value before the update
+
+        Parameters
+        ----------
+        before : dict
+            The stored document before the update (with the changed fields)
+
+        Returns
+        -------
+        dict - the new value of each changed field (MISSING when it was removed)
+        """
+
+        values = {field: copy.deepcopy(before.get(field, None)) for field in self.get_fields()}
+        changes = [(path, lambda v, n=value: n) for path, value in self.sets.items()]
+        changes.extend((path, lambda v, n=amount: (v or 0) + n) for path, amount in self.incs.items())
+        changes.extend((path, lambda v: MISSING) for path in self.unsets)
+        for path, change in changes:
+            keys = path.split('.')
+            values[keys[0]] = self.put(values[keys[0]], keys[1:], change)
+        return values
+
+    def write(self, update, fields):
+        """
+        Send the update when the stored version matches the loaded document
+
+        Parameters
+        ----------
+        update : dict
+            The update operators to send
+        fields : list(str)
+            The top level fields to read back as they were before the update
+
+        Returns
+        -------
+        dict - the stored fields before the update, or None when the version has changed
+        """
+
+        document = self.document
+        version = document.version or 0
+        # Documents saved before versioning have no version
+        query = {'_id': document.pk, 'version': version if version else {'$in': [None, 0]}}
+        update.setdefault('$inc', {})['version'] = 1
+        projection = dict({field: 1 for field in fields}, version=1)
+        return type(document)._get_collection().find_one_and_update(query, update, projection=projection, return_document=ReturnDocument.BEFORE)
+
+    def apply(self, user):
+        """
+        Write the planned changes and update the document in memory
+
+        Parameters
+        ----------
+        user : User
+            The user to save as the updated_by
+
+        Returns
+        -------
+        bool - whether the changes were written (False when the version has changed)
+        """
+
+        document = self.document
+        self.set('updated_by', str(user.id)).set('updated', T.now()).unset('history_id')
+        update = {'$set': self.sets}
+        if self.incs:
+            update['$inc'] = dict(self.incs)
+        update['$unset'] = self.unsets
+        fields = self.get_fields()
+        before = self.write(update, fields)
+        if before is None:
+            return False
+        values = self.get_values(before)
+        for field in fields:
+            setattr(document, field, None if values[field] is MISSING else values[field])
+        document._data['version'] = (before.get('version', None) or 0) + 1
+        document._changed_fields = [f for f in document._changed_fields if f.split('.')[0] not in fields]
+        document._before = {field: before.get(field, BeforeImage.ABSENT) for field in fields}
+        BeforeImage.update(document, {field: values[field] for field in fields if values[field] is not MISSING}, [field for field in fields if values[field] is MISSING])
+        changes = {field: values[field] for field in fields if values[field] is not MISSING and field != 'history_id'}
+        CHANGES.publish(Change(document, 'updated', changes))
+        return True
+
+    def apply_pending(self):
+        """
+        Write the document's pending changes as targeted updates
+
+        Returns
+        -------
+        bool - whether the changes were written (False when the version has changed)
+        """
+
+        document = self.document
+        sets, unsets = document._delta()
+        paths = list(sets) + list(unsets)
+        if not paths:
+            return True
+        changes = document.get_changes(sets)
+        update = {'$set': sets} if sets else {}
+        if unsets:
+            update['$unset'] = unsets
+        before = self.write(update, list({path.split('.')[0]: 1 for path in paths}))
+        if before is None:
+            return False
+        document._data['version'] = (before.get('version', None) or 0) + 1
+        document._clear_changed_fields()
+        document._before = {path: BeforeImage.get_value(before, path, BeforeImage.ABSENT) for path in paths}
+        BeforeImage.update(document, sets, unsets)
+        CHANGES.publish(Change(document, 'updated', changes))
+        return True
+
+    @staticmethod
+    def commit(document, user, plan=None, retries=None):
+        """
+        Write a planned mutation, or the document's pending changes, with a version check
+
+        Pending changes are refused after a version conflict, since they were made from values
+        another command has since changed; changes that must be kept are passed as a plan,
+        which is made again from the reloaded values. New documents and changes to the name
+        or parent (which update the search and ancestor fields) are saved as usual, with the
+        version as the save condition.
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The loaded document (with a version field)
+        user : User
+            The user to save as the updated_by
+        plan : function
+            Adds the changes to a Mutation from the document's current values, called again
+            after the document is reloaded when another command changed it first
+        retries : int
+            Times to plan again after a version conflict (defaults to MUTATION_RETRIES)
+        """
+
+        retries = MUTATION_RETRIES if retries is None else retries
+        if plan is None:
+            document.updated_by = str(user.id)
+            document.updated = T.now()
+            document.history_id = ''
+            changed = [path.split('.')[0] for path in document._get_changed_fields()]
+            if document.pk is None or 'name' in changed or 'parent_id' in changed:
+                document.save()
+                return
+            if not Mutation(document).apply_pending():
+                raise Exception(f'***{document.name}*** was changed by another command. Please try again.')
+            return
+        for attempt in range(retries + 1):
+            mutation = Mutation(document)
+            plan(document, mutation)
+            if mutation.is_empty() or mutation.apply(user):
+                return
+            document.reload(*(mutation.get_fields() + ['version']))
+        raise Exception(f'***{document.name}*** is being changed by other commands. Please try again.')
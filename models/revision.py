@@ -2,13 +2,15 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, BooleanField, DateTimeField
+from mongoengine import Document, StringField, ListField, BooleanField, DateTimeField
 from bson.objectid import ObjectId
-from utils import T
+from utils import T, UnitOfWork, NameSearch
 from models import User
 
 class Revision(Document):
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     number = StringField(required=True)
     text = StringField(required=True)
     archived = BooleanField(default=False)
@@ -17,18 +19,27 @@ class Revision(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('archived', '-created'),
+            'search_name',
+            'search_tokens'
+        ]
+    }
+
     @staticmethod
     def filter(**params):
-        return Revision.objects.filter(**params)
+        return NameSearch.filter(Revision.objects, params)
 
     def find(self, name, archived=False):
-        filter = Revision.objects(name__icontains=name, archived=archived)
-        revision = filter.first()
+        filter = Revision.filter(search=name, archived=archived)
+        revision = UnitOfWork.merge(filter.first())
         return revision
 
     @classmethod
     def get_by_id(cls, id):
-        item = cls.filter(id=ObjectId(id)).first()
+        item = UnitOfWork.load(cls, id, lambda: cls.filter(id=ObjectId(id)).first())
         return item
 
     @classmethod
@@ -2,15 +2,17 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField, signals
+from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField
 from models.character import User
 from models.character import Character
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS, NameSearch, Subtree
 
-class Scenario(Document):
+class Scenario(ChangeCapture, Document):
     parent_id = StringField()
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     description = StringField()
     channel_id = StringField()
@@ -22,30 +24,15 @@ class Scenario(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Scenario', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('channel_id', 'archived', 'name', 'created'),
+            ('guild', 'channel_id', 'archived'),
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -53,7 +40,7 @@ class Scenario(Document):
 
     @staticmethod
     def filter(**params):
-        return Scenario.objects.filter(**params)
+        return NameSearch.filter(Scenario.objects, params)
 
     def create_new(self, user, guild, channel_id, name, archived):
         self.name = name
@@ -67,8 +54,8 @@ class Scenario(Document):
         return self
 
     def find(self, guild, channel_id, name, archived=False):
-        filter = Scenario.objects(guild=guild, channel_id=channel_id, name__icontains=name, archived=archived)
-        user = filter.first()
+        filter = Scenario.filter(guild=guild, channel_id=channel_id, search=name, archived=archived)
+        user = UnitOfWork.merge(filter.first())
         return user
 
     def get_or_create(self, user, guild, channel, name, archived=False):
@@ -82,7 +69,7 @@ class Scenario(Document):
         return scenario
 
     def get_by_id(self, id):
-        scenario = Scenario.objects(id=id).first()
+        scenario = UnitOfWork.load(Scenario, id, lambda: Scenario.objects(id=id).first(), DOCUMENTS)
         return scenario
 
     @classmethod
@@ -116,12 +103,7 @@ class Scenario(Document):
             self.save()
 
     def reverse_archive(self, user):
-        for s in Scenario().get_by_parent(parent_id=str(self.id)):
-            s.reverse_archive(user)
-            s.archived = True
-            s.updated_by = str(user.id)
-            s.updated = T.now()
-            s.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
             self.reverse_restore(user)
@@ -131,12 +113,7 @@ class Scenario(Document):
             self.save()
 
     def reverse_restore(self, user):
-        for s in Scenario().get_by_parent(parent_id=str(self.id)):
-            s.reverse_restore(user)
-            s.archived = False
-            s.updated_by = str(user.id)
-            s.updated = T.now()
-            s.save()
+        Subtree.restore(self, user)
 
     def get_string_characters(self):
         scenes = list(Scene.get_by_scenario(scenario=self, page_num=0))
@@ -170,5 +147,5 @@ class Scenario(Document):
         return f'        {name}{active}'
 
 
-signals.post_save.connect(Scenario.post_save, sender=Scenario)
+ChangeCapture.attach(Scenario)
         
\ No newline at end of file
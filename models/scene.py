@@ -3,17 +3,19 @@ __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
 from bson import ObjectId
-from mongoengine import Document, StringField, ReferenceField, ListField, DynamicField, BooleanField, DateTimeField, signals
+from mongoengine import Document, StringField, ReferenceField, ListField, DynamicField, BooleanField, DateTimeField
 from models.character import User
 from models.character import Character
 from models.zone import Zone
 from models.engagement import Engagement
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS, NameSearch, Subtree
 
-class Scene(Document):
+class Scene(ChangeCapture, Document):
     parent_id = StringField()
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     description = StringField()
     channel_id = StringField()
@@ -30,30 +32,16 @@ class Scene(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Scene', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('scenario_id', 'archived', 'name', 'created'),
+            ('channel_id', 'archived', 'name', 'created'),
+            ('guild', 'channel_id', 'scenario_id', 'archived'),
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -61,7 +49,7 @@ class Scene(Document):
 
     @staticmethod
     def filter(**params):
-        return Scene.objects.filter(**params)
+        return NameSearch.filter(Scene.objects, params)
 
     def create_new(self, user, guild, channel_id, scenario_id, name, archived):
         self.name = name
@@ -76,8 +64,8 @@ class Scene(Document):
         return self
 
     def find(self, guild, channel_id, scenario_id, name, archived=False):
-        filter = Scene.objects(guild=guild, channel_id=channel_id, scenario_id=scenario_id, name__icontains=name, archived=archived)
-        scene = filter.first()
+        filter = Scene.filter(guild=guild, channel_id=channel_id, scenario_id=scenario_id, search=name, archived=archived)
+        scene = UnitOfWork.merge(filter.first())
         return scene
 
     def get_or_create(self, user, guild, channel, scenario, name, archived=False):
@@ -89,7 +77,7 @@ class Scene(Document):
         return scene
 
     def get_by_id(self, id):
-        scene = Scene.objects(id=id).first()
+        scene = UnitOfWork.load(Scene, id, lambda: Scene.objects(id=id).first(), DOCUMENTS)
         return scene
 
     @classmethod
@@ -132,12 +120,7 @@ class Scene(Document):
             self.save()
 
     def reverse_archive(self, user):
-        for s in Scene().get_by_parent(parent_id=str(self.id)):
-            s.reverse_archive(user)
-            s.archived = True
-            s.updated_by = str(user.id)
-            s.updated = T.now()
-            s.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
             self.reverse_restore(user)
@@ -147,12 +130,7 @@ class Scene(Document):
             self.save()
 
     def reverse_restore(self, user):
-        for s in Scene().get_by_parent(parent_id=str(self.id)):
-            s.reverse_restore(user)
-            s.archived = False
-            s.updated_by = str(user.id)
-            s.updated = T.now()
-            s.save()
+        Subtree.restore(self, user)
 
     def get_string_engagements(self, channel):
         engagements = '\n                '.join(f'***{e.name}***' + (f' _(Active {str(e.type_name).title()})_' if str(e.id) == channel.active_engagement else f' _({str(e.type_name).title()})_') for e in Engagement.filter(scene_id=str(self.id), archived=False) if e)
@@ -205,5 +183,5 @@ class Scene(Document):
         return f'        {name}{active}{characters}'
 
 
-signals.post_save.connect(Scene.post_save, sender=Scene)
+ChangeCapture.attach(Scene)
         
\ No newline at end of file
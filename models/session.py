@@ -3,15 +3,17 @@ __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
 from bson import ObjectId
-from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField, signals
+from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField
 from models.character import User
 from models.character import Character
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS, NameSearch, Subtree
 
-class Session(Document):
+class Session(ChangeCapture, Document):
     parent_id = StringField()
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     description = StringField()
     channel_id = StringField()
@@ -26,30 +28,15 @@ class Session(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Session', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('channel_id', 'archived', 'name', 'created'),
+            ('guild', 'channel_id', 'archived'),
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -57,7 +44,7 @@ class Session(Document):
 
     @staticmethod
     def filter(**params):
-        return Session.objects.filter(**params)
+        return NameSearch.filter(Session.objects, params)
 
     def create_new(self, user, guild, channel_id, name, archived):
         self.name = name
@@ -71,8 +58,8 @@ class Session(Document):
         return self
 
     def find(self, guild, channel_id, name, archived=False):
-        filter = Session.objects(guild=guild, channel_id=channel_id, name__icontains=name, archived=archived)
-        session = filter.first()
+        filter = Session.filter(guild=guild, channel_id=channel_id, search=name, archived=archived)
+        session = UnitOfWork.merge(filter.first())
         return session
 
     def get_or_create(self, user, guild, channel, name, archived=False):
@@ -84,7 +71,7 @@ class Session(Document):
         return session
 
     def get_by_id(self, id):
-        session = Session.objects(id=id).first()
+        session = UnitOfWork.load(Session, id, lambda: Session.objects(id=id).first(), DOCUMENTS)
         return session
 
     @classmethod
@@ -111,34 +98,24 @@ class Session(Document):
         return [items] if items else []
 
     def archive(self, user):
-            self.reverse_archive(self.user)
+            self.reverse_archive(user)
             self.archived = True
             self.updated_by = str(user.id)
             self.updated = T.now()
             self.save()
 
     def reverse_archive(self, user):
-        for s in Session().get_by_parent(parent_id=str(self.id)):
-            s.reverse_archive(self.user)
-            s.archived = True
-            s.updated_by = str(user.id)
-            s.updated = T.now()
-            s.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
-            self.reverse_restore(self.user)
+            self.reverse_restore(user)
             self.archived = False
             self.updated_by = str(user.id)
             self.updated = T.now()
             self.save()
 
     def reverse_restore(self, user):
-        for s in Session().get_by_parent(parent_id=str(self.id)):
-            s.reverse_restore(self.user)
-            s.archived = False
-            s.updated_by = str(user.id)
-            s.updated = T.now()
-            s.save()
+        Subtree.restore(self, user)
 
     def get_string_characters(self, user=None):
         characters = '\n                '.join(f'***{c.name}***' + (' _(Active Character)_' if str(c.id) == user.active_character else '') for c in Character.filter(id__in=[ObjectId(id) for id in self.characters]) if c)
@@ -172,5 +149,5 @@ class Session(Document):
         return f'        {name}{active}'
 
 
-signals.post_save.connect(Session.post_save, sender=Session)
+ChangeCapture.attach(Session)
         
\ No newline at end of file
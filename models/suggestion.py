@@ -4,7 +4,7 @@ __contact__ = 'u/ensosati'
 
 from mongoengine import Document, StringField, BooleanField, DateTimeField
 from bson.objectid import ObjectId
-from utils import T
+from utils import T, UnitOfWork
 
 class Suggestion(Document):
     name = StringField(required=True)
@@ -15,18 +15,25 @@ class Suggestion(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('archived', '-created')
+        ]
+    }
+
     @staticmethod
     def filter(**params):
         return Suggestion.objects.filter(**params)
 
     def find(self, text, archived=False):
         filter = Suggestion.objects(text__icontains=text, archived=archived)
-        suggestion = filter.first()
+        suggestion = UnitOfWork.merge(filter.first())
         return suggestion
 
     @classmethod
     def get_by_id(cls, id):
-        item = cls.filter(id=ObjectId(id)).first()
+        item = UnitOfWork.load(cls, id, lambda: cls.filter(id=ObjectId(id)).first())
         return item
 
     @classmethod
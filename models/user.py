@@ -2,9 +2,10 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, BooleanField, DateTimeField, DynamicField
+from mongoengine import Document, StringField, BooleanField, DateTimeField, DynamicField, signals
 from bson.objectid import ObjectId
-from utils import T
+from models.guild_registry import GuildRegistry
+from utils import T, UnitOfWork, DOCUMENTS
 
 class User(Document):
     name = StringField(required=True)
@@ -27,6 +28,17 @@ class User(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('name', 'guild')
+        ]
+    }
+
+    @classmethod
+    def post_save(cls, sender, document, **kwargs):
+        DOCUMENTS.invalidate_document(document)
+
     def create_new(self, name, guild, discriminator=None, display_name=None):
         self.guild = guild
         self.name = name
@@ -45,12 +57,12 @@ class User(Document):
 
     def find(self, name, guild):
         filter = User.objects(name=name, guild=guild)
-        user = filter.first()
+        user = UnitOfWork.find(User, (name, guild), filter.first)
         return user
 
     @classmethod
     def get_by_id(cls, id):
-        character = cls.filter(id=ObjectId(id)).first()
+        character = UnitOfWork.load(cls, id, lambda: cls.filter(id=ObjectId(id)).first(), DOCUMENTS)
         return character
 
     def get_or_create(self, name, guild, discriminator=None, display_name=None):
@@ -80,4 +92,7 @@ class User(Document):
             al = '\n. . .'.join(a for a in aliases)
         alias_str = f'\n***Aliases:***\n. . .{al}' if al else ''
         return f'_Player:_ ***{self.name}***{tz}{url}{alias_str}'
-        
\ No newline at end of file
+
+
+signals.post_save.connect(User.post_save, sender=User)
+signals.post_save.connect(GuildRegistry.user_saved, sender=User)
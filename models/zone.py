@@ -2,15 +2,17 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
-from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField, signals
+from mongoengine import Document, StringField, ReferenceField, ListField, BooleanField, DateTimeField
 from models.character import User
 from models.character import Character
-from models.log import Log
-from utils import T
+from models.change_capture import ChangeCapture
+from utils import T, UnitOfWork, DOCUMENTS, NameSearch, Subtree
 
-class Zone(Document):
+class Zone(ChangeCapture, Document):
     parent_id = StringField()
     name = StringField(required=True)
+    search_name = StringField()
+    search_tokens = ListField(StringField())
     guild = StringField(required=True)
     description = StringField()
     channel_id = StringField()
@@ -24,30 +26,16 @@ class Zone(Document):
     updated_by = StringField()
     updated = DateTimeField(required=True)
 
-    @classmethod
-    def post_save(cls, sender, document, **kwargs):
-        if document.history_id:
-            user = User().get_by_id(document.updated_by)
-            user.history_id = document.history_id
-            user.updated_by = document.updated_by
-            user.updated = document.updated
-            user.save()
-            print({'history_id': document.history_id})
-        else:
-            changes = document._delta()[0]
-            action = 'updated'
-            if 'created' in kwargs:
-                action = 'created' if kwargs['created'] else action
-            if action == 'updated' and 'archived' in changes:
-                action = 'archived' if changes['archived'] else 'restored'
-            Log().create_new(str(document.id), document.name, document.updated_by, document.guild, 'Zone', changes, action)
-            user = User().get_by_id(document.updated_by)
-            if user.history_id:
-                user.history_id = None
-                user.updated_by = document.updated_by
-                user.updated = document.updated
-                user.save()
-            print(changes)
+    meta = {
+        'auto_create_index': False,
+        'indexes': [
+            ('scene_id', 'archived', 'name', 'created'),
+            ('channel_id', 'archived', 'name', 'created'),
+            ('guild', 'channel_id', 'scene_id', 'archived'),
+            ('guild', 'search_name'),
+            ('guild', 'search_tokens')
+        ]
+    }
 
     @staticmethod
     def query():
@@ -55,7 +43,7 @@ class Zone(Document):
 
     @staticmethod
     def filter(**params):
-        return Zone.objects.filter(**params)
+        return NameSearch.filter(Zone.objects, params)
 
     def create_new(self, user, guild, channel_id, scene_id, name, archived):
         self.name = name
@@ -70,8 +58,8 @@ class Zone(Document):
         return self
 
     def find(self, guild, channel_id, scene_id, name, archived=False):
-        filter = Zone.objects(guild=guild, channel_id=channel_id, scene_id=scene_id, name__icontains=name, archived=archived)
-        zone = filter.first()
+        filter = Zone.filter(guild=guild, channel_id=channel_id, scene_id=scene_id, search=name, archived=archived)
+        zone = UnitOfWork.merge(filter.first())
         return zone
 
     def get_or_create(self, user, guild, channel, scene, name, archived=False):
@@ -83,7 +71,7 @@ class Zone(Document):
         return zone
 
     def get_by_id(self, id):
-        zone = Zone.objects(id=id).first()
+        zone = UnitOfWork.load(Zone, id, lambda: Zone.objects(id=id).first(), DOCUMENTS)
         return zone
 
     @classmethod
@@ -126,12 +114,7 @@ class Zone(Document):
             self.save()
 
     def reverse_archive(self, user):
-        for z in Zone().get_by_parent(parent_id=str(self.id)):
-            z.reverse_archive(user)
-            z.archived = True
-            z.updated_by = str(user.id)
-            z.updated = T.now()
-            z.save()
+        Subtree.archive(self, user)
 
     def restore(self, user):
             self.reverse_restore(user)
@@ -141,12 +124,7 @@ class Zone(Document):
             self.save()
 
     def reverse_restore(self, user):
-        for z in Zone().get_by_parent(parent_id=str(self.id)):
-            z.reverse_restore(user)
-            z.archived = False
-            z.updated_by = str(user.id)
-            z.updated = T.now()
-            z.save()
+        Subtree.restore(self, user)
 
     def get_string_characters(self, channel=None):
         characters = [Character.get_by_id(id) for id in self.characters]
@@ -184,5 +162,5 @@ class Zone(Document):
         return f'        {name}{active}{description}{characters}'
 
 
-signals.post_save.connect(Zone.post_save, sender=Zone)
+ChangeCapture.attach(Zone)
         
\ No newline at end of file
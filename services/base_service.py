@@ -5,9 +5,9 @@ __contact__ = 'u/ensosati'
 import traceback
 import copy
 from bson.objectid import ObjectId
-from models import User, Channel, Log
+from models import User, Channel, Log, Mutation
 from config.setup import Setup
-from utils import TextUtils, Dialog, T
+from utils import TextUtils, Dialog, T, UnitOfWork
 
 class BaseService():
     """Servcie class for handling common methods for view, save, and update of database models"""
@@ -78,6 +78,22 @@ class BaseService():
             item.history_id = ''
             item.save()
 
+    def mutate(self, item, user, plan=None):
+        """Write targeted updates to an item, checking no other command changed it first
+
+        Parameters
+        ----------
+        item : mongoengine.Document
+            The item to update (with a version field)
+        user : User
+            The user to save as the updated_by
+        plan : function
+            Adds the changes to a Mutation from the item's current values (or None to write the item's pending changes)
+        """
+
+        if item:
+            Mutation.commit(item, user, plan)
+
     def save_user(self, user):
         """Save a User Document
 
@@ -90,7 +106,7 @@ class BaseService():
         if user:
             user.updated_by = str(user.id)
             user.updated = T.now()
-            user.save()
+            UnitOfWork.save(user)
 
     def get_parent_by_id(self, method, user, parent_id):
         """Set the parent as the active item
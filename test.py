@@ -4,6 +4,7 @@ __contact__ = 'u/ensosati'
 
 import unittest
 from mongoengine import connect, disconnect
+from utils import LOG_WRITER
 import tests
 
 if __name__ == '__main__':
@@ -23,11 +24,35 @@ if __name__ == '__main__':
     suite.addTest(tests.TestDreamcraftBotE2E('test_end_delete_components'))
     suite.addTest(tests.TestDreamcraftBotE2E('test_character_sharing'))
     suite.addTest(tests.TestDreamcraftBotE2E('test_delete_restore_characters'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_dispatch_workers'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_scheduler_user_queues'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_unit_of_work'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_document_cache'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_sheet_cache'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_aspect_index'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_log_writer'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_indexes'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_name_search'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_dialog_paging'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_undo_stack'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_log_inverses'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_undo_batch'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_subtree_archive'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_subtree_clone'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_guild_stats'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_guild_registry'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_history_tracker'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_change_feed'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_mutations'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_track_bitsets'))
+    suite.addTest(tests.TestDreamcraftBotE2E('test_absorption'))
 
     results = unittest.TestResult()
 
     connect('mongoenginetest', host='mongomock://localhost')
     suite.run(results)
+    # Write the buffered logs while the connection is open
+    LOG_WRITER.flush()
     disconnect()
 
     print(results)
@@ -3,9 +3,18 @@ __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
 import unittest
+import asyncio
 import copy
 import traceback
-from handlers import DreamcraftHandler
+import re
+import io
+import contextlib
+from unittest import mock
+from handlers import DreamcraftHandler, Dispatcher, Scheduler
+from utils import UnitOfWork, BulkWriter, LOG_WRITER, T, Dialog, DIALOGS, SHEETS, UNDOS, Subtree, Track, Absorption, AspectIndex, AspectSearch
+from services import BaseService
+from models import Log, User, Character, Scene, GuildCounter, GuildRegistry, HistoryTracker, CHANGES, Mutation, ensure_indexes, check_indexes
+from migrations import MIGRATIONS
 from mocks import CTX
 
 results = {
@@ -32,6 +41,7 @@ ctx1 = CTX('Test Guild 1', 'Test User 1', 'bot_testing', '1111', 'test_user_1')
 ctx2 = CTX('Test Guild 1', 'Test User 2', 'bot_testing', '2222', 'test_user_2')
 ctx3 = CTX('Test Guild 2', 'Test User 1', 'bot_spamming', '1111', 'test_user_1')
 ctx4 = CTX('Test Guild 3', 'Test User 3', 'bot_spamming', '3333', 'test_user_3')
+ctx5 = CTX('Inverse Guild', 'Test User 5', 'bot_testing', '5555', 'test_user_5')
 
 class TestDreamcraftBotE2E(unittest.TestCase):
 
@@ -902,6 +912,12 @@ class TestDreamcraftBotE2E(unittest.TestCase):
                     ['***Test Stunt*** (Stunt of ***Test NPC 1***)', 'should not show \'Test Stunt\' from \'Test NPC 1\'']
                 ]
             },
+            {
+                'args': [('available', 'scene', 'aspect')],
+                'assertions': [
+                    ['**Available invokes:**\n        ***Test Scene Aspect*** (Aspect of _\'Test Zone 1\'_)', 'should rank \'Test Scene Aspect\' first in the search results']
+                ]
+            },
             {
                 'args': [('alias1','NPC')],
                 'assertions': [
@@ -1073,6 +1089,16 @@ class TestDreamcraftBotE2E(unittest.TestCase):
                     ['***Test Character 1*** accepted the compel and received a fate point', 'should accept compel']
                 ]
             },
+            {
+                'args': [
+                    ('compel', 'Test', 'Character', '1', 'with', 'Dislocated Shoulder'),
+                    ('compel', 'prevent')
+                ],
+                'assertions': [
+                    ['***Test Character 1*** is being compelled by ***Test NPC 2\'s*** ***Dislocated Shoulder***', 'should find the compelled character by name'],
+                    ['***Test Character 1*** prevented the compel', 'should prevent the named compel']
+                ]
+            },
             {
                 'ctx': ctx2,
                 'args': [
@@ -1353,3 +1379,734 @@ class TestDreamcraftBotE2E(unittest.TestCase):
                 ]
             }
         ])
+
+    def test_dispatch_workers(self):
+        dispatcher = Dispatcher('thread', 2)
+        commands = [(ctx1, ('user',)), (ctx2, ('user',))]
+        results['commands'] += len(commands)
+        async def dispatch_all():
+            return await asyncio.gather(*[dispatcher.dispatch(ctx, args) for ctx, args in commands])
+        responses = asyncio.run(dispatch_all())
+        dispatcher.shutdown()
+        self.command = 'dispatch user'
+        messages = [r[1] for r in responses]
+        results['assertions'] += 3
+        self.assert_command(messages, '_Player:_ ***Test User 1***', 'should run Test User 1 in the worker pool')
+        self.assert_command(messages, '_Player:_ ***Test User 2***', 'should run Test User 2 in the worker pool')
+        self.assert_command([dispatcher.get_string()], '_Completed:_ 2 of 2', 'should count completed commands')
+
+    def test_scheduler_user_queues(self):
+        scheduler = Scheduler(Dispatcher('thread', 2), user_limit=2)
+        commands = [(ctx1, ('user',)), (ctx1, ('user',)), (ctx1, ('user',)), (ctx2, ('user',))]
+        results['commands'] += len(commands)
+        async def submit_all():
+            return await asyncio.gather(*[scheduler.submit(ctx, args) for ctx, args in commands])
+        responses = asyncio.run(submit_all())
+        scheduler.dispatcher.shutdown()
+        self.command = 'schedule user'
+        messages = [r[1] for r in responses]
+        results['assertions'] += 4
+        self.assert_command(messages[:2], '_Player:_ ***Test User 1***', 'should run queued commands for Test User 1')
+        self.assert_command([messages[2]], 'You already have 2 commands waiting', 'should reject commands beyond the user limit')
+        self.assert_command([messages[3]], '_Player:_ ***Test User 2***', 'should run Test User 2 alongside Test User 1')
+        self.assert_command([scheduler.get_string()], '_Rejected:_ 1', 'should count rejected commands')
+        # Cancelled callers and failing commands do not stop the mailbox
+        class StubDispatcher():
+            async def dispatch(self, ctx, args):
+                await asyncio.sleep(0.01)
+                if args[0] == 'fail':
+                    raise Exception('Dispatch failed')
+                return 'Stub', args[0], ''
+            def get_string(self):
+                return ''
+        scheduler = Scheduler(StubDispatcher(), user_limit=5)
+        async def submit_failures():
+            first = asyncio.ensure_future(scheduler.submit(ctx1, ('first',)))
+            cancelled = asyncio.ensure_future(scheduler.submit(ctx1, ('cancelled',)))
+            failed = asyncio.ensure_future(scheduler.submit(ctx1, ('fail',)))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            done = await asyncio.gather(first, cancelled, failed, return_exceptions=True)
+            after = await asyncio.wait_for(scheduler.submit(ctx1, ('after',)), 1)
+            return [r[1] if isinstance(r, tuple) else type(r).__name__ + ': ' + str(r) for r in done] + [after[1], len(scheduler.mailboxes)]
+        outcomes = asyncio.run(submit_failures())
+        results['assertions'] += 2
+        self.assert_command([str(outcomes)], "['first', 'CancelledError: ', 'Exception: Dispatch failed', 'after', 0]", 'should skip cancelled commands, pass errors to their callers and keep serving the user')
+        self.assert_command([scheduler.get_string()], '_Skipped:_ 1', 'should count skipped commands')
+
+    def test_unit_of_work(self):
+        results['commands'] += 1
+        self.command = 'user'
+        handler = DreamcraftHandler(ctx1, ('user',))
+        messages = list(handler.get_messages())
+        results['assertions'] += 3
+        self.assert_command(messages, '_Player:_ ***Test User 1***', 'should run the command inside a unit of work')
+        self.assert_command([handler.uow.get_string()], 'user: ', 'should report the unit of work counters')
+        self.assert_command([str(handler.uow.hits > 0), str(UnitOfWork.current())], 'TrueNone', 'should reuse loaded documents and close the unit of work')
+
+    def test_document_cache(self):
+        self.send_and_validate_commands(ctx1, [
+            {
+                'args': [('c', 'description', 'Cached once'), ('c',), ('c', 'description', 'Cached twice'), ('c',)],
+                'assertions': [
+                    ['**Description:** \\"Cached once', 'should show the character description before the second save'],
+                    ['**Description:** \\"Cached twice', 'should read the saved character after the cache is invalidated']
+                ]
+            },
+            {
+                'args': [('cache',)],
+                'assertions': [
+                    ['***Documents***', 'should display the document cache counters'],
+                    ['***Sheets***', 'should display the rendered sheet cache counters'],
+                    ['_Invalidations:_ ', 'should display the cache invalidation count']
+                ]
+            },
+            {
+                'args': [('cache', 'clear')],
+                'assertions': [
+                    ['You do not have permission to clear the caches', 'should only let admins clear the caches']
+                ]
+            }
+        ])
+
+    def test_sheet_cache(self):
+        results['commands'] += 1
+        self.command = 'sheet cache'
+        user = User().get_or_create('Sheet Tester', 'Sheet Guild')
+        user_id = str(user.id)
+        def new_character(name, category, parent=None):
+            return Character(name=name, guild='Sheet Guild', category=category, parent_id=str(parent.id) if parent else None, created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        npc = new_character('Sheet NPC', 'Character')
+        aspect = new_character('Sheet Aspect', 'Aspect', npc)
+        new_character('Sheet Stunt', 'Stunt', aspect)
+        cached = Character.get_by_id(str(npc.id)).get_string(user)
+        # Archive the aspect's descendants with the update that skips the save signals
+        Subtree.archive(aspect, user)
+        archived = Character.get_by_id(str(npc.id)).get_string(user)
+        Character._get_collection().update_one({'_id': npc.pk}, {'$set': {'stress': [[['1', 'O'], ['2', 'O']]]}})
+        MIGRATIONS['track_bitsets']()
+        results['assertions'] += 3
+        self.assert_command([cached], 'Sheet Stunt', 'should render the stunt below the aspect of the character')
+        self.assert_command([archived], 'Sheet Stunt', 'should not serve the sheet cached before the descendants were archived')
+        self.assert_command([str(SHEETS.stats()['entries'])], '0', 'should drop the cached sheets after a migration rewrites the characters')
+        shared = Character(name='Sheet Shared', guild='Sheet Guild', category='Character', shared=['anyone'], created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        before = Character.get_by_id(str(shared.id)).get_string(user)
+        user.name = 'Sheet Renamed'
+        user.url = 'sheet.example.com'
+        user.save()
+        after = Character.get_by_id(str(shared.id)).get_string(user)
+        results['assertions'] += 2
+        self.assert_command([before], '**Created by:** ***Sheet Tester***', 'should show the creator of a shared sheet')
+        self.assert_command([after], '**Created by:** ***Sheet Renamed***\n**Contact:** _sheet.example.com_', 'should show the creator\'s new name and contact after the creator is saved')
+
+    def test_aspect_index(self):
+        results['commands'] += 1
+        self.command = 'aspect index'
+        user_id = str(User().get_or_create('Index Tester', 'Index Guild').id)
+        def new_character(name, category, parent=None, high_concept=None):
+            return Character(name=name, guild='Index Guild', category=category, high_concept=high_concept, parent_id=str(parent.id) if parent else None, created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        npc = new_character('Index NPC', 'Character', high_concept='Super Punching Hero')
+        aspect = new_character('Super Strong', 'Aspect', npc)
+        built = []
+        def indexed(ids):
+            with mock.patch.object(AspectIndex, 'add', autospec=True, side_effect=AspectIndex.add) as add:
+                names, available, indexes = Character.get_invokables(ids)
+            built.append(add.call_count)
+            return AspectSearch([(indexes[id], available[id]) for id in ids])
+        first = [(m['text'], m['category']) for m in indexed([str(npc.id)]).search('super')]
+        second = indexed([str(npc.id)]).find('strong')
+        aspect.name = 'Super Stronger'
+        aspect.save()
+        renamed = indexed([str(npc.id)]).find('strong')
+        results['assertions'] += 4
+        self.assert_command([str(first)], str([('Super Strong', 'Aspect'), ('Super Punching Hero', 'High Concept')]), 'should rank the matches of a tree best first')
+        self.assert_command([str(second and (second['char'].name, second['parent'].name))], "('Super Strong', 'Index NPC')", 'should return the aspect and its parent from the loaded tree')
+        self.assert_command([str(built)], '[2, 0, 2]', 'should build the index of a tree once until the tree is saved')
+        self.assert_command([str(renamed and renamed['text'])], 'Super Stronger', 'should search the saved tree after it changes')
+
+    def test_log_writer(self):
+        results['commands'] += 1
+        self.command = 'log writer'
+        added = LOG_WRITER.stats()['added']
+        handler = DreamcraftHandler(ctx1, ('user',))
+        messages = list(handler.get_messages())
+        results['assertions'] += 3
+        self.assert_command([str(LOG_WRITER.stats()['added'] > added)], 'True', 'should buffer the command and change logs')
+        self.assert_command([str(Log.filter(category='Command').count() > 0), str(LOG_WRITER.stats()['buffered'])], 'True0', 'should write the buffered logs before reading them')
+        writer = BulkWriter('Test Writer', batch_size=2, interval=60)
+        first = writer.add(Log(parent_id='test', category='Test', created=T.now(), updated=T.now()))
+        written = [Log.objects(id=first.id).count()]
+        writer.add(Log(parent_id='test', category='Test', created=T.now(), updated=T.now()))
+        written.append(Log.objects(parent_id='test').count())
+        self.assert_command([str(written), str(writer.stats()['batches'])], '[0, 2]1', 'should insert a full buffer with one insert_many')
+        # Failed batches are written one at a time, and failed documents wait for the next flush
+        pushed = []
+        collection = Log._get_collection()
+        writer = BulkWriter('Retry Writer', batch_size=10, interval=60, retries=1)
+        writer.add(Log(parent_id='retry', category='Test', created=T.now(), updated=T.now()), lambda: pushed.append('batch'))
+        with mock.patch.object(collection, 'insert_many', side_effect=Exception('insert_many failed')):
+            writer.flush()
+        single = writer.add(Log(parent_id='retry', category='Test', created=T.now(), updated=T.now()), lambda: pushed.append('single'))
+        with mock.patch.object(collection, 'insert_many', side_effect=Exception('insert_many failed')), mock.patch.object(collection, 'insert_one', side_effect=Exception('insert_one failed')):
+            writer.flush()
+        requeued = (list(pushed), writer.stats()['buffered'], Log.objects(id=single.id).count())
+        writer.flush()
+        results['assertions'] += 2
+        self.assert_command([str(requeued)], "(['batch'], 1, 0)", 'should write a failed batch one document at a time and keep the documents that still fail')
+        self.assert_command([str((pushed, Log.objects(parent_id='retry').count(), writer.stats()['retried']))], "(['batch', 'single'], 2, 1)", 'should retry the failed documents and run their callbacks once written')
+
+    def test_indexes(self):
+        results['commands'] += 1
+        self.command = 'indexes'
+        ensure_indexes()
+        indexes = Character._get_collection().index_information()
+        results['assertions'] += 3
+        self.assert_command([str('parent_id_1_category_1_archived_1' in indexes), str('ancestors_1' in indexes)], 'TrueTrue', 'should build the declared character indexes')
+        self.assert_command([str(ensure_indexes())], '[]', 'should skip the indexes that already exist')
+        self.assert_command(check_indexes(), 'Explain is not supported', 'should report that mongomock cannot explain the hot queries')
+
+    def test_name_search(self):
+        results['commands'] += 1
+        self.command = 'name search'
+        user_id = str(User().get_or_create('Search Tester', 'Search Guild').id)
+        for name in ['Bobby  Tables', 'Big Bob', 'Bob']:
+            Character(name=name, guild='Search Guild', category='Character', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        Character.objects(guild='Search Guild', name='Big Bob').update(unset__search_name=True)
+        results['assertions'] += 5
+        self.assert_command([str(Character.objects(guild='Search Guild', name='Bobby  Tables').first().search_tokens)], "['bobby', 'tables']", 'should maintain the search tokens on save')
+        self.assert_command([str(MIGRATIONS['search_names']())], '1', 'should backfill the documents without search fields')
+        self.assert_command([c.name for c in Character.filter(guild='Search Guild', search='BOB')], 'Bob', 'should prefer the exact match')
+        self.assert_command([', '.join(sorted(c.name for c in Character.filter(guild='Search Guild', search='tab')))], 'Bobby  Tables', 'should match the start of a word')
+        self.assert_command([', '.join(sorted(c.name for c in Character.filter(guild='Search Guild', search='g b')))], 'Big Bob', 'should fall back to a substring match')
+        collection = Character._get_collection()
+        with mock.patch.object(collection, 'find', wraps=collection.find) as find:
+            found = Character.filter(guild='Search Guild', search='tab').first()
+        results['assertions'] += 1
+        self.assert_command([str((found.name, find.call_count))], "('Bobby  Tables', 2)", 'should rank the anchored stages with one query before the lookup')
+        # The window is read in search_name order: 'big bob', 'bob', then 'bobby tables'
+        windows = []
+        for limit in [1, 2]:
+            with mock.patch('utils.name_search.SEARCH_LIMIT', limit):
+                windows.append(Character.filter(guild='Search Guild', search='bob').first().name)
+        results['assertions'] += 1
+        self.assert_command([str(windows)], "['Big Bob', 'Bob']", 'should rank a limited window of anchored matches')
+
+    def test_dialog_paging(self):
+        results['commands'] += 1
+        self.command = 'dialog paging'
+        user = User().get_or_create('Paging Tester', 'Paging Guild')
+        for i in range(12):
+            Log().create_new('paging', f'Page Log {i}', str(user.id), 'Paging Guild', 'Paging', {'note': str(i)}, 'created')
+        expected = [l.name for l in Log.filter(category='Paging').order_by('-created', '+id')]
+        prefetched = DIALOGS.stats()['prefetched']
+        def open_dialog(answer):
+            # A selection closes the dialog, so reopen it for the next selection
+            user.command = 'paging' if answer else ''
+            user.answer = answer
+            return Dialog({
+                'svc': BaseService(),
+                'user': user,
+                'title': 'Paging',
+                'command': 'paging',
+                'type': 'select',
+                'getter': {
+                    'method': Log.get_by_page,
+                    'params': {'params': {'category': 'Paging'}}
+                },
+                'formatter': lambda log, num, page_num, page_size: log.name,
+                'select': lambda log: [log.name]
+            }).open()[0]
+        pages = [re.findall(r'Page Log \d+', open_dialog(answer)) for answer in ['', '>', '>', '<', '>>', '2', '=7', '=1']]
+        open_dialog('')
+        session = DIALOGS.get(DIALOGS.get_key(user, 'paging'))
+        version = DIALOGS.get_version(session)
+        Log().create_new('paging', 'Page Log 12', str(user.id), 'Paging Guild', 'Paging', {'note': '12'}, 'created')
+        LOG_WRITER.flush()
+        # A page read before the save is not added to the session
+        DIALOGS.set_page(session, 3, {'first': [], 'last': []}, [], version)
+        stale = sorted(session['pages'].keys())
+        message = open_dialog('>')
+        open_dialog('=1')
+        results['assertions'] += 6
+        self.assert_command([str(DIALOGS.stats()['prefetched'] > prefetched)], 'True', 'should prefetch the next page while the user reads')
+        self.assert_command([str(pages[0:6])], str([expected[0:5], expected[5:10], expected[10:12], expected[5:10], expected[10:12], expected[5:10]]), 'should page forward, back and to the last page in sort order')
+        self.assert_command([str(pages[6:8])], str([expected[6:7], expected[0:1]]), 'should select the numbered item from the current page or any other page')
+        self.assert_command([str(stale)], '[]', 'should drop the page snapshots of the dialog when a listed document is saved')
+        self.assert_command([message], 'Page 2 of 3 (13 total)', 'should count the items again after a listed document is saved')
+        self.assert_command([str(re.findall(r'Page Log \d+', message))], str(expected[4:9]), 'should read the page again after a listed document is saved')
+
+    def test_undo_stack(self):
+        self.send_and_validate_commands(ctx1, [
+            {
+                'args': [('c', 'description', 'Before undo'), ('c', 'description', 'After undo')],
+                'assertions': [
+                    ['**Description:** \\"After undo', 'should save the change to undo']
+                ]
+            },
+            {
+                'args': [('undo', 'last', 'confirm')],
+                'assertions': [
+                    ['has been undone', 'should undo the last change'],
+                    ['**Description:** \\"Before undo', 'should restore the value before the last change']
+                ]
+            },
+            {
+                'args': [('undo', 'last', 'confirm')],
+                'assertions': [
+                    ['**Description:** \\"Cached twice', 'should undo the change before the last undone change']
+                ]
+            },
+            {
+                'args': [('redo', 'next', 'confirm')],
+                'assertions': [
+                    ['**Description:** \\"Before undo', 'should redo the last undone change']
+                ]
+            },
+            {
+                'args': [('redo', 'next', 'confirm')],
+                'assertions': [
+                    ['**Description:** \\"After undo', 'should redo the next undone change']
+                ]
+            }
+        ])
+        # A history position older than the cached stack is found with the logs around it
+        UNDOS.clear()
+        with mock.patch.object(UNDOS, 'limit', 1):
+            self.send_and_validate_commands(ctx5, [
+                {
+                    'args': [('new', 'c', 'Deep Hero'), ('y',), ('c', 'description', 'Deep one'), ('c', 'description', 'Deep two'), ('c', 'description', 'Deep three')],
+                    'assertions': [
+                        ['**Description:** \\"Deep three', 'should save the changes to undo past the cached stack']
+                    ]
+                },
+                {
+                    'args': [('undo', 'last', 'confirm'), ('undo', 'last', 'confirm')],
+                    'assertions': [
+                        ['**Description:** \\"Deep one', 'should undo the change before a position older than the cached stack']
+                    ]
+                },
+                {
+                    'args': [('redo', 'next', 'confirm')],
+                    'assertions': [
+                        ['**Description:** \\"Deep two', 'should redo the change at a position older than the cached stack']
+                    ]
+                },
+                {
+                    'args': [('redo', 'next', 'confirm')],
+                    'assertions': [
+                        ['**Description:** \\"Deep three', 'should redo the newest undone change']
+                    ]
+                }
+            ])
+
+    def test_log_inverses(self):
+        results['commands'] += 1
+        self.command = 'log inverses'
+        user_id = str(User().get_or_create('Inverse Tester', 'Inverse Guild').id)
+        character = Character(name='Inverse Character', guild='Inverse Guild', category='Character', description='First description', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        character.description = 'Second description'
+        character.high_concept = 'New High Concept'
+        collection = Character._get_collection()
+        # The replaced values come from the loaded document, not another read
+        with mock.patch.object(collection, 'find_one', wraps=collection.find_one) as find_one:
+            character.save()
+        log = Log.filter(parent_id=str(character.id), action='updated').order_by('-created').first()
+        inverse, absent = log.inverse, log.absent
+        Log.objects(id=log.id).update(unset__inverse=True, unset__absent=True)
+        MIGRATIONS['log_inverses']()
+        migrated = Log.get_by_id(str(log.id)).reload()
+        # A scene has no version to check its save against, so the replaced values are read from the stored scene
+        scene = Scene(name='Inverse Scene', guild='Inverse Guild', description='First scene', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        stale = Scene.objects(id=scene.id).first()
+        Scene.objects(id=scene.id).update(set__description='Second scene')
+        stale.description = 'Third scene'
+        stale.save()
+        scene_log = Log.filter(parent_id=str(scene.id), action='updated').order_by('-created').first()
+        results['assertions'] += 5
+        self.assert_command([str((inverse['description'], absent, find_one.call_count))], "('First description', ['high_concept'], 0)", 'should store the value each change replaced and the keys it added without reading them')
+        self.assert_command([str((migrated.inverse['description'], migrated.absent))], "('First description', ['high_concept'])", 'should backfill the inverse and absent keys from the earlier logs')
+        self.assert_command([str(Log.filter(parent_id=str(character.id), action='created').first().inverse.get('description'))], 'None', 'should store an empty inverse for a new document')
+        self.assert_command([str(scene_log.inverse['description'])], 'Second scene', 'should store the stored value replaced by a save without a version check')
+        self.send_and_validate_commands(ctx5, [
+            {
+                'args': [('new', 'c', 'Inverse Hero'), ('y',), ('hc', 'Brave', 'Knight')],
+                'assertions': [
+                    ['**High Concept:** Brave Knight', 'should add the high concept']
+                ]
+            },
+            {
+                'args': [('undo', 'last', 'confirm')],
+                'assertions': [
+                    ['has been undone', 'should undo the added high concept'],
+                    ['**High Concept:** Brave Knight', 'should not keep the added high concept']
+                ]
+            }
+        ])
+        stored = collection.find_one({'name': 'Inverse Hero'})
+        self.assert_command([str('high_concept' in stored)], 'False', 'should remove the keys a change added')
+
+    def test_undo_batch(self):
+        self.send_and_validate_commands(ctx1, [
+            {
+                'args': [('c', 'description', 'Batch one'), ('c', 'description', 'Batch two'), ('c', 'description', 'Batch three')],
+                'assertions': [
+                    ['**Description:** \\"Batch three', 'should save the changes to undo']
+                ]
+            },
+            {
+                'args': [('undo', 'last', '3', 'confirm')],
+                'assertions': [
+                    ['3 changes have been undone', 'should undo the last 3 changes']
+                ]
+            },
+            {
+                'args': [('c',)],
+                'assertions': [
+                    ['**Description:** \\"After undo', 'should restore the value before the oldest undone change']
+                ]
+            },
+            {
+                'args': [('redo', 'next', '2', 'confirm')],
+                'assertions': [
+                    ['2 changes have been redone', 'should redo the next 2 changes']
+                ]
+            },
+            {
+                'args': [('c',)],
+                'assertions': [
+                    ['**Description:** \\"Batch two', 'should apply the newest redone change']
+                ]
+            },
+            {
+                'args': [('undo', 'since', 'yesterday')],
+                'assertions': [
+                    ['is not a time', 'should reject a time it cannot read']
+                ]
+            }
+        ])
+        self.send_and_validate_commands(ctx5, [
+            {
+                'args': [('new', 'c', 'Batch Hero'), ('y',), ('c', 'description', 'Batch zero'), ('c', 'description', 'Batch one'), ('c', 'description', 'Batch two')],
+                'assertions': [
+                    ['**Description:** \\"Batch two', 'should save the changes to undo']
+                ]
+            }
+        ])
+        user = User.objects(name='Test User 5').first()
+        # A failed write stops the batch before the history position moves
+        with mock.patch.object(Character, 'save', side_effect=Exception('Save failed')):
+            handler = DreamcraftHandler(ctx5, ('undo', 'last', '2', 'confirm'))
+            messages = list(handler.get_messages())
+        results['commands'] += 1
+        results['assertions'] += 2
+        self.assert_command(messages, '0 of 1 documents were undone before ***Batch Hero*** failed: Save failed', 'should report the failed write')
+        self.assert_command([str(User.objects(id=user.id).first().history_id)], 'None', 'should leave the history position when a write fails')
+        self.send_and_validate_commands(ctx5, [
+            {
+                'args': [('undo', 'last', '2', 'confirm'), ('c',)],
+                'assertions': [
+                    ['2 changes have been undone', 'should run the same undo again'],
+                    ['**Description:** \\"Batch zero', 'should restore the value before the oldest undone change']
+                ]
+            }
+        ])
+        self.send_and_validate_commands(ctx5, [
+            {
+                'args': [('new', 'c', 'Rollback Hero'), ('y',), ('c', 'description', 'Rollback one'), ('c', 'n', 'Batch Hero'), ('c', 'description', 'Rollback two')],
+                'assertions': [
+                    ['**Description:** \\"Rollback two', 'should save the changes to undo']
+                ]
+            }
+        ])
+        # A write failing after another document was written puts that document back
+        save = Character.save
+        def fail_second(character, *args, **kwargs):
+            if character.name == 'Rollback Hero':
+                raise Exception('Save failed')
+            return save(character, *args, **kwargs)
+        with mock.patch.object(Character, 'save', autospec=True, side_effect=fail_second):
+            handler = DreamcraftHandler(ctx5, ('undo', 'last', '2', 'confirm'))
+            messages = list(handler.get_messages())
+        stored = Character.objects(name__in=['Batch Hero', 'Rollback Hero']).order_by('name')
+        results['commands'] += 1
+        results['assertions'] += 3
+        self.assert_command(messages, '1 of 2 documents were undone before ***Rollback Hero*** failed: Save failed', 'should report the failed write')
+        self.assert_command([str([c.description.strip('\\"') for c in stored])], "['Rollback two', 'Rollback one']", 'should put back the document written before the failed write')
+        self.assert_command([str(User.objects(id=user.id).first().history_id)], 'None', 'should leave the history position when a write fails')
+
+    def test_subtree_archive(self):
+        results['commands'] += 1
+        self.command = 'subtree archive'
+        user = User().get_or_create('Subtree Tester', 'Subtree Guild')
+        user_id = str(user.id)
+        def new_character(name, category, parent=None):
+            return Character(name=name, guild='Subtree Guild', category=category, parent_id=str(parent.id) if parent else None, created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        npc = new_character('Subtree NPC', 'Character')
+        aspect = new_character('Subtree Aspect', 'Aspect', npc)
+        stunt = new_character('Subtree Stunt', 'Stunt', aspect)
+        npc.archive(user)
+        archived = [str(c.name) for c in Character.objects(guild='Subtree Guild', archived=True).order_by('name')]
+        log = Log.filter(parent_id=str(npc.id), action='archived').first()
+        child_logs = Log.filter(parent_id__in=[str(aspect.id), str(stunt.id)], action='archived').count()
+        npc.restore(user)
+        restored = Character.objects(guild='Subtree Guild', archived=False).count()
+        scene = Scene(name='Subtree Scene', guild='Subtree Guild', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        Scene(name='Subtree Child Scene', guild='Subtree Guild', parent_id=str(scene.id), created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        scene.archive(user)
+        results['assertions'] += 5
+        self.assert_command([str(archived)], str(['Subtree Aspect', 'Subtree NPC', 'Subtree Stunt']), 'should archive every descendant of the character')
+        self.assert_command([str(sorted(log.data['descendant_ids']))], str(sorted([str(aspect.id), str(stunt.id)])), 'should record the descendants in the change log of the character')
+        self.assert_command([str(child_logs)], '0', 'should write one change log for the subtree')
+        self.assert_command([str(restored)], '3', 'should restore every archived descendant')
+        self.assert_command([str(Scene.objects(guild='Subtree Guild', archived=True).count())], '2', 'should archive the child scenes with one update')
+
+    def test_subtree_clone(self):
+        results['commands'] += 1
+        self.command = 'subtree clone'
+        user = User().get_or_create('Clone Tester', 'Clone Guild')
+        user_id = str(user.id)
+        def new_character(name, category, parent=None, archived=False):
+            return Character(name=name, guild='Clone Guild', category=category, parent_id=str(parent.id) if parent else None, archived=archived, created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        npc = new_character('Clone NPC', 'Character')
+        aspect = new_character('Clone Aspect', 'Aspect', npc)
+        new_character('Clone Stunt', 'Stunt', aspect)
+        new_character('Clone Archived Aspect', 'Aspect', npc, True)
+        copy = npc.copy_to(user, 'Cloned Guild')
+        copies = {c.name: c for c in Character.objects(guild='Cloned Guild')}
+        results['assertions'] += 4
+        self.assert_command([str(sorted(copies))], str(['Clone Aspect', 'Clone NPC', 'Clone Stunt']), 'should copy the unarchived subtree at every depth')
+        self.assert_command([str(copies['Clone Stunt'].parent_id)], str(copies['Clone Aspect'].id), 'should point the copies at their copied parents')
+        self.assert_command([str(copies['Clone Stunt'].ancestors)], str([str(copy.id), str(copies['Clone Aspect'].id)]), 'should point the ancestors at the copies')
+        self.assert_command([str(Log.filter(guild='Cloned Guild').count())], '1', 'should write one change log for the copy')
+
+    def test_guild_stats(self):
+        results['commands'] += 1
+        self.command = 'guild stats'
+        user_id = str(User().get_or_create('Stats Tester', 'Stats Guild').id)
+        def new_character(name, category, parent=None, archived=False):
+            return Character(name=name, guild='Stats Guild', category=category, parent_id=str(parent.id) if parent else None, archived=archived, created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        npc = new_character('Stats NPC', 'Character')
+        aspect = new_character('Stats Aspect', 'Aspect', npc)
+        stunt = new_character('Stats Stunt', 'Stunt', aspect)
+        new_character('Stats Archived Aspect', 'Aspect', npc, True)
+        aggregated = Character().get_stats('all')
+        GuildCounter.enabled = True
+        try:
+            MIGRATIONS['guild_counters']()
+            rebuilt = Character().get_stats('all')
+            new_character('Counted Aspect', 'Aspect')
+            stunt.category = 'Aspect'
+            stunt.save()
+            counted = Character().get_stats('Stats Guild')
+        finally:
+            GuildCounter.enabled = False
+        results['assertions'] += 3
+        self.assert_command([str(aggregated['Stats Guild'])], str({'Scenarios': 0, 'Scenes': 0, 'Zones': 0, 'Characters': 1, 'Aspects': 2, 'Stunts': 1}), 'should count each category of a guild in one aggregation')
+        self.assert_command([str(rebuilt)], str(aggregated), 'should rebuild the counters to match the aggregation')
+        self.assert_command([str(counted['Stats Guild'])], str({'Scenarios': 0, 'Scenes': 0, 'Zones': 0, 'Characters': 1, 'Aspects': 4, 'Stunts': 0}), 'should count new characters and category changes as they are saved')
+
+    def test_guild_registry(self):
+        results['commands'] += 1
+        self.command = 'guild registry'
+        user = User().get_or_create('Registry Tester', 'Registry Guild')
+        user_id = str(user.id)
+        npc = Character(name='Registry NPC', guild='Registry Guild', category='Character', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        Character(name='Registry Aspect', guild='Registry Guild', category='Aspect', parent_id=str(npc.id), created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        npc.copy_to(user, 'Registry Copy Guild')
+        cloned = GuildRegistry.objects(name='Registry Copy Guild').first()
+        before = GuildRegistry.objects(name='Registry Guild').first().characters
+        npc.archive(user)
+        after = GuildRegistry.objects(name='Registry Guild').first().characters
+        npc.restore(user)
+        guilds = ['Registry Guild', 'Registry Copy Guild']
+        maintained = {g.name: (g.characters, sorted(g.members), g.last_activity is None) for g in GuildRegistry.objects(name__in=guilds)}
+        MIGRATIONS['guild_registry']()
+        rebuilt = {g.name: (g.characters, sorted(g.members), g.last_activity is None) for g in GuildRegistry.objects(name__in=guilds)}
+        results['assertions'] += 4
+        self.assert_command([str(cloned.characters)], '1', 'should register the guild of a copied character')
+        self.assert_command([str((before, after))], '(1, 0)', 'should count archived characters out of the guild')
+        self.assert_command([str(GuildRegistry.get_names('Registry Tester'))], str(['Registry Guild']), 'should list the guilds of a member')
+        self.assert_command([str(maintained)], str(rebuilt), 'should keep the registry in step with a rebuild')
+
+    def test_history_tracker(self):
+        results['commands'] += 1
+        self.command = 'history tracker'
+        user = User().get_or_create('History Tester', 'History Guild')
+        user_id = str(user.id)
+        log = Log().create_new('history', 'History Log', user_id, 'History Guild', 'History', {'note': 'moved'}, 'created')
+        LOG_WRITER.flush()
+        moved = HistoryTracker.move(user_id, str(log.id))
+        position = User.objects(id=user.id).first().history_id
+        repeated = HistoryTracker.move(user_id, str(log.id))
+        cleared = HistoryTracker.move(user_id, None)
+        results['assertions'] += 4
+        self.assert_command([str(moved)], 'True', 'should update the user when the position changes')
+        self.assert_command([str(position)], str(log.id), 'should store the new position')
+        self.assert_command([str(repeated)], 'False', 'should skip the update when the position is unchanged')
+        self.assert_command([str((cleared, User.objects(id=user.id).first().history_id))], '(True, None)', 'should clear the position')
+
+    def test_change_feed(self):
+        results['commands'] += 1
+        self.command = 'change feed'
+        user = User().get_or_create('Feed Tester', 'Feed Guild')
+        user_id = str(user.id)
+        npc = Character(name='Feed NPC', guild='Feed Guild', category='Character', created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        character = Character(name='Feed Aspect', guild='Feed Guild', category='Aspect', parent_id=str(npc.id), created_by=user_id, created=T.now(), updated_by=user_id, updated=T.now()).save()
+        captured = []
+        CHANGES.subscribe(captured.append)
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output), mock.patch.object(Character, '_delta', autospec=True, side_effect=Character._delta) as delta:
+                character.description = 'Captured once'
+                character.updated_by = user_id
+                character.save()
+        finally:
+            CHANGES.unsubscribe(captured.append)
+        change = captured[0] if captured else None
+        # A track changed in place shares its list with the loaded son, so the stored values are logged
+        loaded = Character.objects(id=npc.id).first()
+        loaded.stress = [{'boxes': ['1'], 'checked': 0}]
+        loaded.save()
+        loaded = Character.objects(id=npc.id).first()
+        loaded.stress[0]['checked'] = 1
+        loaded._mark_as_changed('stress')
+        loaded.save()
+        LOG_WRITER.flush()
+        log = Log.filter(parent_id=str(npc.id)).order_by('-created').first()
+        results['assertions'] += 6
+        self.assert_command([str(delta.call_count)], '2', 'should compute the delta of a save once besides the save itself')
+        self.assert_command([str(log.inverse['stress'])], str([{'boxes': ['1'], 'checked': 0}]), 'should log the stored values of a field changed in place')
+        self.assert_command([str(len(captured))], '1', 'should publish one change for each save')
+        self.assert_command([str(change and change.action)], 'updated', 'should publish the action of the save')
+        self.assert_command([str(change and sorted(change.changes))], str(['description', 'updated']), 'should leave excluded fields out of the changes')
+        self.assert_command([repr(output.getvalue())], "''", 'should keep the changes off stdout')
+
+    def test_mutations(self):
+        results['commands'] += 1
+        self.command = 'mutations'
+        user = User().get_or_create('Mutation Tester', 'Mutation Guild')
+        character = Character().create_new(user, 'Mutation Tester', 'Mutation Guild', None, 'Character', False)
+        first = Character.objects(id=character.id).first()
+        second = Character.objects(id=character.id).first()
+        stale = Character.objects(id=character.id).first()
+        saved = Character.objects(id=character.id).first()
+        Mutation.commit(first, user, lambda char, mutation: mutation.inc('fate_points', 1))
+        # The second copy was loaded before the first write, so it is replanned from the stored value
+        Mutation.commit(second, user, lambda char, mutation: mutation.inc('fate_points', 1))
+        stored = Character.objects(id=character.id).first()
+        LOG_WRITER.flush()
+        log = Log.objects(parent_id=str(character.id)).order_by('-created').first()
+        # Pending changes made from values loaded before the writes are refused
+        stale.fate_points = 10
+        try:
+            Mutation.commit(stale, user)
+            conflict = ''
+        except Exception as err:
+            conflict = str(err)
+        # A plain save is refused once the version has moved on
+        saved.description = 'Saved change'
+        try:
+            saved.save()
+            refused = ''
+        except Exception as err:
+            refused = str(err)
+        retried = Character.objects(id=character.id).first()
+        results['assertions'] += 7
+        self.assert_command([str(stored.fate_points)], '5', 'should keep both increments')
+        self.assert_command([str(second.fate_points)], '5', 'should update the document in memory')
+        self.assert_command([str(stored.version)], '3', 'should increment the version with each write')
+        self.assert_command([str(log.inverse.get('fate_points'))], '4', 'should log the value before the update')
+        self.assert_command([conflict], '***Mutation Tester*** was changed by another command. Please try again.', 'should refuse pending changes made before another command changed the document')
+        self.assert_command([str((retried.fate_points, retried.description, retried.version))], "(5, None, 3)", 'should keep the stored values when pending changes are refused')
+        self.assert_command([refused], '***Mutation Tester*** was changed by another command. Please try again.', 'should refuse a save of a document changed since it was loaded')
+
+    def test_track_bitsets(self):
+        results['commands'] += 1
+        self.command = 'track bitsets'
+        x, o = '[X]', '[   ]'
+        track = Track.load([['1', o], ['1', x], ['2', o]])
+        loaded = (track.checked, track.first_free(), track.count_free(), track.get_free_shifts())
+        track.check(2)
+        checked = track.checked
+        track.clear(1)
+        user = User().get_or_create('Track Tester', 'Track Guild')
+        character = Character().create_new(user, 'Track Tester Character', 'Track Guild', None, 'Character', False)
+        stress = Track.load_all(character.stress)
+        stress[0].check(2)
+        consequences = Track.load(character.consequences)
+        consequences.set_box(0, consequences.boxes[0], True, 'Sprained Ankle')
+        character.stress = [t.to_son() for t in stress]
+        character.consequences = consequences.to_son()
+        character.save()
+        character = Character.objects(id=character.id).first()
+        before = character.get_string_stress() + character.get_string_consequences()
+        # Store the tracks in the legacy format
+        legacy_stress = [[[b, x if t.is_checked(i) else o] for i, b in enumerate(t.boxes)] for t in Track.load_all(character.stress)]
+        consequences = Track.load(character.consequences)
+        legacy_consequences = [[b, consequences.get_mark(i)] + ([consequences.get_aspect(i)] if consequences.get_aspect(i) else []) for i, b in enumerate(consequences.boxes)]
+        Character._get_collection().update_one({'_id': character.pk}, {'$set': {'stress': legacy_stress, 'consequences': legacy_consequences}})
+        legacy = Character.objects(id=character.id).first()
+        read = legacy.get_string_stress() + legacy.get_string_consequences()
+        MIGRATIONS['track_bitsets']()
+        stored = Character._get_collection().find_one({'_id': character.pk})
+        migrated = Character.objects(id=character.id).first()
+        results['assertions'] += 5
+        self.assert_command([str(loaded)], '(2, 0, 2, 3)', 'should read the checked boxes of a legacy track into a bitmask')
+        self.assert_command([str((checked, track.checked))], '(7, 3)', 'should check from the first free box and clear from the last checked box')
+        self.assert_command([read], before, 'should display legacy tracks the same way')
+        self.assert_command([str((stored['stress'], stored['consequences']))], str((character.stress, character.consequences)), 'should convert legacy tracks to bitmasks')
+        self.assert_command([migrated.get_string_stress() + migrated.get_string_consequences()], before, 'should display migrated tracks the same way')
+
+    def test_absorption(self):
+        results['commands'] += 1
+        self.command = 'absorption'
+        core = [Track(['1', '1', '1'])]
+        fate = [Track(['1']), Track(['2']), Track(['3'])]
+        consequences = Track(['2', '4', '6'])
+        results['assertions'] += 4
+        self.assert_command([str(Absorption.solve(core, consequences, 3, 1))], "{'stress': [(0, 0)], 'consequences': [0], 'absorbed': 3}", 'should check one Core box and take the mildest consequence')
+        self.assert_command([str(Absorption.solve(core, consequences, 3))], "{'stress': [(0, 0), (0, 1), (0, 2)], 'consequences': [], 'absorbed': 3}", 'should check as many boxes of a custom track as the hit needs')
+        self.assert_command([str(Absorption.solve(fate, consequences, 2, 1))], "{'stress': [(1, 0)], 'consequences': [], 'absorbed': 2}", 'should check the one FATE box that absorbs the hit')
+        self.assert_command([str(Absorption.solve(fate, consequences, 16, 1))], 'None', 'should take the character out when the hit is too big')
+        self.send_and_validate_commands(ctx1, [
+            {
+                'args': [('new', 'c', 'Absorb Tester'), ('y',), ('st', 't', 'CORE'), ('c', 'absorb', '1')],
+                'assertions': [
+                    ['No stress type provided - (ph)ysical or (me)ntal', 'should ask for the stress type of the hit']
+                ]
+            },
+            {
+                'args': [('c', 'absorb', 'ph', '1')],
+                'assertions': [
+                    ['***Absorb Tester*** absorbed 1 shift with 1 _Physical_ stress', 'should absorb the hit with one stress box'],
+                    ['_Physical:_  [X] [   ] [   ]', 'should check one box of the physical track'],
+                    ['_Mental:_  [   ] [   ] [   ]', 'should leave the mental track']
+                ]
+            },
+            {
+                'args': [('c', 'absorb', 'ph', '3')],
+                'assertions': [
+                    ['Absorbing 3 shifts takes a _Mild_ Consequence', 'should ask for the consequence aspect']
+                ]
+            },
+            {
+                'args': [('c', 'absorb', 'ph', '8', 'Bruised Ribs')],
+                'assertions': [
+                    ['Absorbing 8 shifts takes a _Mild_ and a _Severe_ Consequence', 'should ask for an aspect for each consequence']
+                ]
+            },
+            {
+                'args': [('c', 'absorb', 'ph', '8', 'Bruised Ribs', 'Broken Arm')],
+                'assertions': [
+                    ['absorbed 8 shifts with a _Mild_ Consequence and a _Severe_ Consequence', 'should absorb the hit with two consequences'],
+                    ['Bruised Ribs', 'should add the mild consequence aspect'],
+                    ['Broken Arm', 'should add the severe consequence aspect']
+                ]
+            },
+            {
+                'args': [('c', 'absorb', 'ph', '20')],
+                'assertions': [
+                    ['cannot absorb 20 shifts and is taken out', 'should take the character out']
+                ]
+            }
+        ])
@@ -1,4 +1,14 @@
 from utils.roll import Roll
 from utils.text_utils import TextUtils
 from utils.dialog import Dialog
-from utils.time import T
\ No newline at end of file
+from utils.time import T
+from utils.unit_of_work import UnitOfWork
+from utils.aspect_index import AspectIndex, AspectSearch
+from utils.cache import Cache, DocumentCache, SheetCache, InvokableIndex, DialogSessions, UndoStacks, DOCUMENTS, SHEETS, INVOKABLES, DIALOGS, UNDOS
+from utils.bulk_writer import BulkWriter, LOG_WRITER
+from utils.name_search import NameSearch
+
+from utils.before_image import BeforeImage
+from utils.subtree import Subtree
+from utils.track import Track
+from utils.absorption import Absorption
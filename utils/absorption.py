@@ -0,0 +1,111 @@
+# absorption.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+class Absorption(object):
+    """
+    Choose the stress boxes and consequences that absorb the shifts of a hit at the lowest cost
+
+    Each unchecked stress box absorbs its value and each open consequence absorbs its
+    shifts. Only the stress tracks the hit can reach are passed in (the track of the hit's
+    stress type, or every track when the tracks are box values), and the stress system can
+    cap the boxes checked for one hit. The options are ranked by the shifts of the
+    consequences taken (so stress is used before any consequence and milder consequences
+    before severe ones), then the number of consequences, then the shifts absorbed beyond
+    the hit, then the number of stress boxes checked. The search is a 0/1 knapsack over the
+    total shifts absorbed and boxes checked: no box or consequence can be dropped from the
+    best option, so it absorbs less than the hit plus the largest value and the table stays
+    small.
+
+    Usage:
+    ```
+        choice = Absorption.solve([Track.load(char.stress[0])], Track.load(char.consequences), 4, 1)
+        if choice is None:
+            ... /* the hit takes the character out */
+    ```
+    """
+
+    @staticmethod
+    def get_value(box):
+        """Get the shifts a box absorbs (boxes without a number absorb 1)"""
+
+        return int(box) if str(box).isdigit() else 1
+
+    @classmethod
+    def get_options(cls, stress, consequences):
+        """
+        Get the open stress boxes and consequences with their values and costs
+
+        Parameters
+        ----------
+        stress : list(Track)
+            The stress tracks that can absorb the hit
+        consequences : Track
+            The consequences track (or None)
+
+        Returns
+        -------
+        list(tuple) - (kind, index, value, cost) for each open box, with cost as (consequence shifts, consequences, stress boxes)
+        """
+
+        options = []
+        for t in range(0, len(stress)):
+            for b in range(0, len(stress[t])):
+                if not stress[t].is_checked(b):
+                    options.append(('stress', (t, b), cls.get_value(stress[t].boxes[b]), (0, 0, 1)))
+        if consequences:
+            for c in range(0, len(consequences)):
+                if not consequences.is_checked(c):
+                    value = cls.get_value(consequences.boxes[c])
+                    options.append(('consequence', c, value, (value, 1, 0)))
+        return options
+
+    @classmethod
+    def solve(cls, stress, consequences, shifts, max_boxes=None):
+        """
+        Find the lowest cost combination of stress boxes and consequences absorbing a hit
+
+        Parameters
+        ----------
+        stress : list(Track)
+            The stress tracks that can absorb the hit
+        consequences : Track
+            The consequences track (or None)
+        shifts : int
+            The shifts to absorb
+        max_boxes : int
+            The most stress boxes one hit can check (or None for any number)
+
+        Returns
+        -------
+        dict - the chosen 'stress' (track, box) pairs, 'consequences' indexes and shifts 'absorbed', or None when the hit cannot be absorbed
+        """
+
+        if shifts <= 0:
+            return {'stress': [], 'consequences': [], 'absorbed': 0}
+        options = cls.get_options(stress, consequences)
+        if not options:
+            return None
+        limit = shifts + max([o[2] for o in options])
+        # Lowest cost and chosen options for each total absorbed and number of boxes checked
+        best = {(0, 0): ((0, 0, 0), ())}
+        for n in range(0, len(options)):
+            value, cost = options[n][2], options[n][3]
+            for (total, boxes), (total_cost, chosen) in list(best.items()):
+                key = (total + value, boxes + cost[2])
+                if key[0] >= limit or (max_boxes is not None and key[1] > max_boxes):
+                    continue
+                new_cost = tuple(total_cost[i] + cost[i] for i in range(0, 3))
+                if key not in best or new_cost < best[key][0]:
+                    best[key] = (new_cost, chosen + (n,))
+        keys = [k for k in best if k[0] >= shifts]
+        if not keys:
+            return None
+        # Waste ranks after the consequences and before the stress boxes
+        key = min(keys, key=lambda k: (best[k][0][0], best[k][0][1], k[0] - shifts, best[k][0][2]))
+        chosen = [options[n] for n in best[key][1]]
+        return {
+            'stress': [o[1] for o in chosen if o[0] == 'stress'],
+            'consequences': [o[1] for o in chosen if o[0] == 'consequence'],
+            'absorbed': key[0]
+        }
@@ -0,0 +1,191 @@
+# aspect_index.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import re
+
+# Rank of each kind of match, best first
+EXACT = 0
+PREFIX = 1
+WORD_PREFIX = 2
+SUBSTRING = 3
+CATEGORIES = ['Aspect', 'Stunt', 'High Concept', 'Trouble']
+
+class AspectIndex(object):
+    """
+    Trigram index over the aspects, stunts, high concepts and troubles available to invoke
+
+    Searches rank exact matches first, then matches at the start of the text, then matches
+    at the start of a word, then any other substring. Ties are broken by the shorter text,
+    the category and the order the aspects were added, so the best match is always the same.
+    Entries hold the position of their {'char', 'parent'} dictionary instead of the documents,
+    so an index is built once for each invokable tree and cached with it (see InvokableIndex)
+    and searched together with the other trees by AspectSearch.
+
+    Usage:
+    ```
+        index = AspectIndex(available)
+        matches = AspectSearch([(index, available)]).search('super punch')
+    ```
+    """
+
+    def __init__(self, available=[]):
+        """
+        Constructor for the AspectIndex class
+
+        Parameters
+        ----------
+        available : list(dict)
+            The {'char', 'parent'} dictionaries returned by get_available_invokes
+
+        Returns
+        -------
+        AspectIndex - object for searching invokable aspects
+        """
+
+        self.entries = []
+        self.grams = {}
+        for item, a in enumerate(available):
+            if a['char'].category in ['Aspect', 'Stunt']:
+                self.add(a['char'].name, a['char'].category, item)
+            if a['char'].high_concept:
+                self.add(a['char'].high_concept, 'High Concept', item)
+            if a['char'].trouble:
+                self.add(a['char'].trouble, 'Trouble', item)
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(text.replace('_', ' ').lower().split())
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i:i+3] for i in range(0, len(text) - 2)}
+
+    def add(self, text, category, item):
+        """
+        Add a searchable text to the index
+
+        Parameters
+        ----------
+        text : str
+            The aspect name, high concept or trouble
+        category : str
+            Aspect, Stunt, High Concept or Trouble
+        item : int
+            The position of the {'char', 'parent'} dictionary the text belongs to
+        """
+
+        name = self.normalize(text)
+        position = len(self.entries)
+        self.entries.append({'name': name, 'text': text, 'category': category, 'item': item})
+        for gram in self.trigrams(name):
+            self.grams.setdefault(gram, set()).add(position)
+
+    def get_size(self):
+        """Get the approximate number of bytes used by the index"""
+
+        return sum([200 + 2 * len(e['text']) for e in self.entries]) + 100 * len(self.grams)
+
+    def rank(self, name, search):
+        if name == search:
+            return EXACT
+        if name.startswith(search):
+            return PREFIX
+        if re.search(r'\b' + re.escape(search), name):
+            return WORD_PREFIX
+        return SUBSTRING
+
+    def get_matches(self, search):
+        """
+        Find the entries containing a normalized search text
+
+        Parameters
+        ----------
+        search : str
+            The normalized search text
+
+        Returns
+        -------
+        list(tuple) - the (rank, length, category order, position) key and entry of each match
+        """
+
+        if len(search) >= 3:
+            # Only entries containing every trigram of the search can contain the search
+            grams = sorted([self.grams.get(g, set()) for g in self.trigrams(search)], key=len)
+            candidates = set.intersection(*grams) if grams else set()
+        else:
+            candidates = range(0, len(self.entries))
+        matches = []
+        for position in candidates:
+            entry = self.entries[position]
+            if search in entry['name']:
+                order = CATEGORIES.index(entry['category']) if entry['category'] in CATEGORIES else len(CATEGORIES)
+                matches.append(((self.rank(entry['name'], search), len(entry['name']), order, position), entry))
+        return matches
+
+
+class AspectSearch(object):
+    """
+    Search the aspect indexes of several invokable trees as one list
+
+    Matches are ranked as in AspectIndex, with ties between trees broken by the order of
+    the trees.
+    """
+
+    def __init__(self, trees=[]):
+        """
+        Constructor for the AspectSearch class
+
+        Parameters
+        ----------
+        trees : list(tuple)
+            The (AspectIndex, list(dict)) index and {'char', 'parent'} dictionaries of each tree
+
+        Returns
+        -------
+        AspectSearch - object for searching invokable aspects
+        """
+
+        self.trees = trees
+
+    def search(self, text):
+        """
+        Find the entries containing the search text, best match first
+
+        Parameters
+        ----------
+        text : str
+            The search text
+
+        Returns
+        -------
+        list(dict) - the matching entries with name, text, category, char and parent
+        """
+
+        search = AspectIndex.normalize(text)
+        if not search:
+            return []
+        matches = []
+        for tree, (index, available) in enumerate(self.trees):
+            for key, entry in index.get_matches(search):
+                item = available[entry['item']]
+                match = {'name': entry['name'], 'text': entry['text'], 'category': entry['category'], 'char': item['char'], 'parent': item['parent']}
+                matches.append((key[0:3] + (tree, key[3]), match))
+        return [m[1] for m in sorted(matches, key=lambda m: m[0])]
+
+    def find(self, text):
+        """
+        Find the best entry matching the search text
+
+        Parameters
+        ----------
+        text : str
+            The search text
+
+        Returns
+        -------
+        dict - the best matching entry or None
+        """
+
+        matches = self.search(text)
+        return matches[0] if matches else None
@@ -0,0 +1,230 @@
+# before_image.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import copy
+
+class BeforeImage(object):
+    """
+    Capture the stored values of the fields a save is about to change
+
+    Logged documents with a version keep the son they were loaded from, updated after each
+    write, so the values a save replaces are read from memory just before the document is
+    written; the save matches the version, so it fails instead of being logged when the son
+    is out of date. Documents without a version (which may have been loaded before another
+    command's write) and documents without a loaded son (copies and documents that were
+    reloaded) are read with one projected lookup by id. The values are stored with the change log as its inverse,
+    and the paths that were missing as its absent keys, so undo restores the previous
+    values (removing the absent ones) without searching the document's earlier change logs.
+
+    Usage:
+    ```
+        signals.pre_save_post_validation.connect(BeforeImage.capture, sender=Scene)
+        ...
+        # in the post_save handler
+        sets, unsets = document._delta()
+        BeforeImage.saved(document, sets, unsets, kwargs.get('created', False))
+        Log().create_new(..., changes, action, BeforeImage.get_inverse(document, changes), BeforeImage.get_absent(document, changes))
+    ```
+    """
+
+    # Marks a path that was missing from the stored document
+    ABSENT = object()
+
+    @staticmethod
+    def get_value(son, path, default=None):
+        """
+        Get the value at a dotted path in a stored document
+
+        Parameters
+        ----------
+        son : dict
+            The stored document
+        path : str
+            The dotted path of the field (for example skills.Fight)
+        default : object
+            The value returned when the path is missing
+
+        Returns
+        -------
+        object - the stored value or the default when it is missing
+        """
+
+        value = son
+        for key in path.split('.'):
+            if isinstance(value, dict) and key in value:
+                value = value[key]
+            elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                value = value[int(key)]
+            else:
+                return default
+        return value
+
+    @classmethod
+    def put(cls, son, path, value):
+        """
+        Set (or remove, for ABSENT) the value at a dotted path in a stored document
+
+        Returns
+        -------
+        bool - whether the path could be set (False when a list index is missing)
+        """
+
+        keys = path.split('.')
+        container = son
+        for key in keys[:-1]:
+            if isinstance(container, list):
+                if not key.isdigit() or int(key) >= len(container):
+                    return False
+                container = container[int(key)]
+            elif isinstance(container, dict):
+                if not isinstance(container.get(key, None), (dict, list)):
+                    container[key] = {}
+                container = container[key]
+            else:
+                return False
+        key = keys[-1]
+        if isinstance(container, list):
+            if not key.isdigit() or int(key) >= len(container):
+                return False
+            container[int(key)] = None if value is cls.ABSENT else value
+        elif value is cls.ABSENT:
+            container.pop(key, None)
+        else:
+            container[key] = value
+        return True
+
+    @classmethod
+    def update(cls, document, sets, unsets=()):
+        """
+        Apply a write to the son a document was loaded from
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document that was written
+        sets : dict
+            The new stored value of each written path
+        unsets : list(str)
+            The removed paths
+        """
+
+        son = getattr(document, '_loaded', None)
+        if son is None:
+            return
+        changes = [(path, copy.deepcopy(value)) for path, value in sets.items()] + [(path, cls.ABSENT) for path in unsets]
+        for path, value in changes:
+            if not cls.put(son, path, value):
+                # The next save reads the stored values instead
+                document._loaded = None
+                return
+
+    @classmethod
+    def capture(cls, sender, document, **kwargs):
+        """
+        pre_save_post_validation handler getting the stored values of the changed fields
+
+        Saves made by undo and redo (with a history_id) are not logged, so they are skipped.
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class being saved
+        document : mongoengine.Document
+            The document being saved
+        """
+
+        document._before = {}
+        if document.pk is None or kwargs.get('created', False) or getattr(document, 'history_id', None):
+            return
+        paths = document._get_changed_fields()
+        if not paths:
+            return
+        son = getattr(document, '_loaded', None) if cls.is_versioned(document) else None
+        if son is not None and cls.is_shared(document, son, paths):
+            son = None
+        if son is None:
+            projection = {path.split('.')[0]: 1 for path in paths}
+            son = type(document)._get_collection().find_one({'_id': document.pk}, projection) or {}
+        # Copied so later writes to the loaded son leave the before values as they were
+        document._before = {path: copy.deepcopy(cls.get_value(son, path, cls.ABSENT), {id(cls.ABSENT): cls.ABSENT}) for path in paths}
+
+    @staticmethod
+    def is_versioned(document):
+        """Get whether the saves of a document are checked against the version it was loaded with"""
+
+        return 'version' in document._fields
+
+    @staticmethod
+    def is_shared(document, son, paths):
+        """
+        Get whether a changed field still holds the list or dictionary of the son it was loaded from
+
+        Such a field was changed in place, so the son holds the new values as well.
+
+        Returns
+        -------
+        bool - whether the before values must be read from the stored document
+        """
+
+        for key in set([path.split('.')[0] for path in paths]):
+            value = son.get(key, None)
+            if isinstance(value, (list, dict)) and document._data.get(document._reverse_db_field_map.get(key, key), None) is value:
+                return True
+        return False
+
+    @classmethod
+    def saved(cls, document, sets, unsets, created=False):
+        """
+        Apply a save to the son the document was loaded from, called by the post_save handler
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document that was saved
+        sets : dict
+            The new stored value of each written path
+        unsets : dict
+            The removed paths
+        created : bool
+            Whether the document was inserted
+        """
+
+        if created:
+            document._loaded = document.to_mongo().to_dict() if cls.is_versioned(document) else None
+            return
+        cls.update(document, sets, unsets)
+
+    @classmethod
+    def get_inverse(cls, document, changes):
+        """
+        Get the values to restore to undo a change
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document that was saved
+        changes : dict
+            The logged changes, keyed by dotted or double underscore paths
+
+        Returns
+        -------
+        dict - the stored value before the save for each changed key (None when it was missing)
+        """
+
+        before = getattr(document, '_before', {})
+        inverse = {key: before.get(key.replace('__', '.'), None) for key in changes}
+        return {key: None if value is cls.ABSENT else value for key, value in inverse.items()}
+
+    @classmethod
+    def get_absent(cls, document, changes):
+        """
+        Get the changed keys that were missing before the save, so undo removes them
+
+        Returns
+        -------
+        list(str) - the keys missing from the stored document
+        """
+
+        before = getattr(document, '_before', {})
+        return [key for key in changes if before.get(key.replace('__', '.'), None) is cls.ABSENT]
@@ -0,0 +1,237 @@
+# bulk_writer.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import time
+import atexit
+import logging
+import threading
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+load_dotenv()
+LOG_BATCH_SIZE = int(os.getenv('DISCORD_LOG_BATCH_SIZE', '50') or 50)
+LOG_FLUSH_SECONDS = float(os.getenv('DISCORD_LOG_FLUSH_SECONDS', '2') or 2)
+# Times a document that failed to insert is written again before it is dropped
+LOG_RETRIES = int(os.getenv('DISCORD_LOG_RETRIES', '3') or 3)
+
+logger = logging.getLogger(__name__)
+
+class BulkWriter(object):
+    """
+    Write-behind buffer inserting new documents with insert_many
+
+    Documents are validated and given their id when they are added, so the caller can
+    reference them right away. The buffer is written once it holds batch_size documents
+    or once its oldest document has waited interval seconds, and readers of the buffered
+    collection call flush before querying so they always see their own writes. With the
+    process dispatch mode each worker has its own buffer, so other workers see its
+    documents after the interval.
+
+    When a batch fails, its documents are written one at a time, and the ones that still
+    fail go back to the front of the buffer for the next flush, up to retries times. The
+    callback given with a document only runs once the document is written.
+
+    Usage:
+    ```
+        LOG_WRITER.add(Log(...), lambda: UNDOS.push(user_id, log_id))
+        LOG_WRITER.flush()
+    ```
+    """
+
+    def __init__(self, name, batch_size=LOG_BATCH_SIZE, interval=LOG_FLUSH_SECONDS, retries=LOG_RETRIES):
+        """
+        Constructor for the BulkWriter class
+
+        Parameters
+        ----------
+        name : str
+            The name displayed with the writer counters
+        batch_size : int
+            The number of buffered documents that triggers a write
+        interval : float
+            The number of seconds a document may wait in the buffer (0 writes immediately)
+        retries : int
+            The number of times a document that failed to insert is written again
+
+        Returns
+        -------
+        BulkWriter - object for batching document inserts
+        """
+
+        self.name = name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        # Guards the buffer; flushing keeps batches in the order they were added
+        self.lock = threading.Lock()
+        self.flushing = threading.RLock()
+        self.buffer = []
+        self.timer = None
+        self.added = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.retried = 0
+        self.write_time = 0.0
+
+    def add(self, document, written=None):
+        """
+        Buffer a new document to be inserted
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The new document to insert
+        written : function
+            Called once the document has been inserted (or None)
+
+        Returns
+        -------
+        mongoengine.Document - the document with its id assigned
+        """
+
+        document.validate()
+        if document.pk is None:
+            document.pk = ObjectId()
+        son = document.to_mongo()
+        with self.lock:
+            self.buffer.append((type(document), son, written, 0))
+            self.added += 1
+            full = len(self.buffer) >= self.batch_size or self.interval <= 0
+            if not full:
+                self.schedule()
+        if full:
+            self.flush()
+        return document
+
+    def schedule(self):
+        """Start the timer writing the buffer after the interval (called with the lock held)"""
+
+        if self.timer is None and self.interval > 0:
+            self.timer = threading.Timer(self.interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def write(self, model, entries):
+        """
+        Insert the documents of one batch, one at a time when the batch insert fails
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class of the batch
+        entries : list(tuple)
+            The (model, son, written, attempts) entries of the batch
+
+        Returns
+        -------
+        list(tuple) - the entries that were not written
+        """
+
+        try:
+            model._get_collection().insert_many([e[1] for e in entries], ordered=True)
+            self.batches += 1
+            return []
+        except Exception:
+            logger.warning(f'{self.name}: failed to write {len(entries)} {model.__name__} documents in a batch, writing them one at a time', exc_info=True)
+        unwritten = []
+        for entry in entries:
+            try:
+                model._get_collection().insert_one(entry[1])
+            except DuplicateKeyError:
+                # Written before the batch failed
+                pass
+            except Exception:
+                unwritten.append(entry)
+        return unwritten
+
+    def flush(self):
+        """
+        Insert every buffered document
+
+        Consecutive documents for the same collection are written with one insert_many.
+        Documents that fail are put back at the front of the buffer until they run out of
+        retries.
+
+        Returns
+        -------
+        int - the number of documents written
+        """
+
+        with self.flushing:
+            with self.lock:
+                buffer = self.buffer
+                self.buffer = []
+                if self.timer:
+                    self.timer.cancel()
+                    self.timer = None
+            if not buffer:
+                return 0
+            batches = []
+            for entry in buffer:
+                if batches and batches[-1][0] is entry[0]:
+                    batches[-1][1].append(entry)
+                else:
+                    batches.append((entry[0], [entry]))
+            written = []
+            retry = []
+            started = time.time()
+            for model, entries in batches:
+                unwritten = self.write(model, entries)
+                failed = set([id(e) for e in unwritten])
+                written.extend([e for e in entries if id(e) not in failed])
+                for entry in unwritten:
+                    if entry[3] < self.retries:
+                        retry.append(entry[0:3] + (entry[3] + 1,))
+                    else:
+                        logger.error(f'{self.name}: dropped {model.__name__} {entry[1].get("_id")} after {entry[3] + 1} failed writes')
+                        self.failed += 1
+            self.written += len(written)
+            self.write_time += time.time() - started
+            if retry:
+                with self.lock:
+                    self.buffer = retry + self.buffer
+                    self.retried += len(retry)
+                    self.schedule()
+            for entry in written:
+                if entry[2]:
+                    entry[2]()
+            return len(written)
+
+    def stats(self):
+        """
+        Get the counters for the writer
+
+        Returns
+        -------
+        dict - the writer metrics
+        """
+
+        with self.lock:
+            return {
+                'buffered': len(self.buffer),
+                'added': self.added,
+                'written': self.written,
+                'batches': self.batches,
+                'failed': self.failed,
+                'retried': self.retried,
+                'avg_batch': self.written / self.batches if self.batches else 0.0,
+                'avg_write': self.write_time / self.batches if self.batches else 0.0
+            }
+
+    def get_string(self):
+        """Get the writer counters for display"""
+
+        stats = self.stats()
+        return '\n'.join([
+            f'***{self.name}***',
+            f'_Buffered:_ {stats["buffered"]} _Written:_ {stats["written"]} of {stats["added"]} _Retried:_ {stats["retried"]} _Failed:_ {stats["failed"]}',
+            f'_Batches:_ {stats["batches"]} (average {stats["avg_batch"]:.1f} documents, {stats["avg_write"]*1000:.1f} ms)'
+        ])
+
+
+LOG_WRITER = BulkWriter('Log Writer')
+atexit.register(LOG_WRITER.flush)
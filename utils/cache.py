@@ -0,0 +1,721 @@
+# cache.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import bson
+from dotenv import load_dotenv
+
+load_dotenv()
+CACHE_BYTES = int(os.getenv('DISCORD_CACHE_BYTES', '33554432') or 33554432)
+CACHE_TTL = int(os.getenv('DISCORD_CACHE_TTL', '300') or 300)
+SHEET_CACHE_BYTES = int(os.getenv('DISCORD_SHEET_CACHE_BYTES', '16777216') or 16777216)
+DIALOG_CACHE_BYTES = int(os.getenv('DISCORD_DIALOG_CACHE_BYTES', '8388608') or 8388608)
+DIALOG_TTL = int(os.getenv('DISCORD_DIALOG_TTL', '600') or 600)
+UNDO_LIMIT = int(os.getenv('DISCORD_UNDO_LIMIT', '200') or 200)
+
+class Cache(object):
+    """
+    Thread-safe LRU cache with a time-to-live and a memory budget
+
+    Entries are evicted least recently used first once the total size of the cached
+    values exceeds the budget, and expire once they are older than the time-to-live.
+    """
+
+    def __init__(self, name, max_bytes=CACHE_BYTES, ttl=CACHE_TTL):
+        """
+        Constructor for the Cache class
+
+        Parameters
+        ----------
+        name : str
+            The name displayed with the cache counters
+        max_bytes : int
+            The memory budget for the cached values
+        ttl : int
+            The number of seconds an entry may be served before it is reloaded
+
+        Returns
+        -------
+        Cache - object for caching values in memory
+        """
+
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Recently invalidated keys mapped to the invalidation count, so a load that raced
+        # a save is not cached
+        self.generation = 0
+        self.invalidated = OrderedDict()
+        self.forgotten = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Get a value from the cache
+
+        Parameters
+        ----------
+        key : tuple
+            The key of the cached value
+
+        Returns
+        -------
+        object - the cached value or None when it is missing or expired
+        """
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry and entry[0] < time.time():
+                self.remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def begin_load(self):
+        """Get the invalidation count to pass to put after loading a value"""
+
+        with self.lock:
+            return self.generation
+
+    def put(self, key, value, size, generation=None):
+        """
+        Add a value to the cache, evicting the least recently used values over budget
+
+        Parameters
+        ----------
+        key : tuple
+            The key of the cached value
+        value : object
+            The value to cache
+        size : int
+            The number of bytes used by the value
+        generation : int, optional
+            The value of begin_load read before the value was loaded; the value is discarded
+            when the key was invalidated while it was loading
+        """
+
+        with self.lock:
+            if generation is not None and (self.invalidated.get(key, 0) > generation or self.forgotten > generation):
+                return
+            if size > self.max_bytes:
+                return
+            self.remove(key)
+            self.entries[key] = (time.time() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.size -= entry[1]
+
+    def invalidate(self, key):
+        """
+        Remove a value from the cache and stop in-flight loads from caching an older copy
+
+        Parameters
+        ----------
+        key : tuple
+            The key of the cached value
+        """
+
+        with self.lock:
+            self.generation += 1
+            self.invalidated.pop(key, None)
+            self.invalidated[key] = self.generation
+            if len(self.invalidated) > 1024:
+                self.forgotten = self.invalidated.popitem(last=False)[1]
+            if key in self.entries:
+                self.remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """Remove every value from the cache"""
+
+        with self.lock:
+            self.generation += 1
+            self.forgotten = self.generation
+            self.invalidated.clear()
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Get the counters for the cache
+
+        Returns
+        -------
+        dict - the cache metrics
+        """
+
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+    def get_string(self):
+        """Get the cache counters for display"""
+
+        stats = self.stats()
+        return '\n'.join([
+            f'***{self.name}***',
+            f'_Entries:_ {stats["entries"]} ({stats["bytes"]/1024:.1f} of {stats["max_bytes"]/1024:.0f} KB, {stats["ttl"]}s TTL)',
+            f'_Hits:_ {stats["hits"]} _Misses:_ {stats["misses"]} ({stats["hit_rate"]*100:.1f}% hit rate)',
+            f'_Evictions:_ {stats["evictions"]} _Expirations:_ {stats["expirations"]} _Invalidations:_ {stats["invalidations"]}'
+        ])
+
+
+class DocumentCache(Cache):
+    """
+    Read-through cache for get_by_id lookups
+
+    Documents are stored as encoded BSON so every reader builds its own instance and the
+    cached copy can never be changed by a command. Each model's post_save hook calls
+    invalidate so the next lookup reads the saved document. With the process dispatch
+    mode each worker has its own cache, so saves in another worker are only seen once the
+    time-to-live expires.
+    """
+
+    def load(self, model, id, loader):
+        """
+        Get a document by id from the cache, reading it from Mongo on a miss
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class being loaded
+        id : str
+            The ObjectId string value of the document
+        loader : function
+            Callable that fetches the document from Mongo
+
+        Returns
+        -------
+        mongoengine.Document - a new instance of the document (or None)
+        """
+
+        key = (model.__name__, str(id))
+        data = self.get(key)
+        if data is not None:
+            return model._from_son(bson.decode(data))
+        generation = self.begin_load()
+        document = loader()
+        if document is not None:
+            data = bson.encode(document.to_mongo())
+            self.put(key, data, len(data), generation)
+        return document
+
+    def invalidate_document(self, document):
+        """
+        Remove a saved document from the cache
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document that was saved
+        """
+
+        if document.pk is not None:
+            self.invalidate((type(document).__name__, str(document.pk)))
+
+
+class SheetCache(Cache):
+    """
+    Cache of rendered character sheets
+
+    A sheet is cached for each variant of its viewer-dependent parts (for example the
+    (Active) marker), and every variant of a sheet is invalidated when the character or
+    anything in its subtree is saved. Writes that skip the save signals (the subtree
+    updates and copies, and the migrations) invalidate the sheets they change themselves.
+    """
+
+    def __init__(self, name, max_bytes=SHEET_CACHE_BYTES, ttl=CACHE_TTL):
+        super().__init__(name, max_bytes, ttl)
+        self.variants = {}
+
+    def render(self, id, variant, renderer):
+        """
+        Get a rendered sheet from the cache, rendering it on a miss
+
+        Parameters
+        ----------
+        id : str
+            The ObjectId string value of the character
+        variant : tuple
+            The values the rendered text depends on besides the saved subtree
+        renderer : function
+            Callable that renders the sheet text
+
+        Returns
+        -------
+        str - the rendered sheet
+        """
+
+        key = (str(id),) + tuple(variant)
+        text = self.get(key)
+        if text is not None:
+            return text
+        # Register the variant before rendering so a save during the render discards it
+        with self.lock:
+            self.variants.setdefault(str(id), set()).add(key)
+        generation = self.begin_load()
+        text = renderer()
+        self.put(key, text, len(text.encode('utf-8')), generation)
+        return text
+
+    def clear(self):
+        super().clear()
+        with self.lock:
+            self.variants.clear()
+
+    def invalidate_sheets(self, ids):
+        """
+        Remove every variant of the rendered sheets for a list of characters
+
+        Parameters
+        ----------
+        ids : list(str)
+            The ObjectId string values of the characters
+        """
+
+        for id in ids:
+            with self.lock:
+                keys = self.variants.pop(str(id), set())
+            for key in keys:
+                self.invalidate(key)
+
+
+class InvokableIndex(Cache):
+    """
+    Index of the invokable aspects and stunts below each character
+
+    Each entry holds the encoded documents of one character tree and the (aspect, parent)
+    pairs that can be invoked from it, and beside it the search index built from those pairs
+    (see AspectIndex). Character.invalidate_caches drops the entries for the saved character
+    and each of its ancestors, so the index follows aspect, stunt, high concept and trouble
+    changes. Scene and zone indexes are composed from these entries
+    using the current list of characters in the scene, so membership changes are always
+    seen.
+    """
+
+    def load(self, model, ids, loader, indexer):
+        """
+        Get the invokable pairs and search indexes for a list of root documents, loading every missing tree with one call
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class of the trees
+        ids : list(str)
+            The ObjectId string values of the root documents
+        loader : function
+            Callable taking the missing ids and returning a dict of the root documents
+            and a dict of the invokable pairs for each root id
+        indexer : function
+            Callable taking the invokable pairs of a tree and returning its search index
+            (with a get_size method); called only when the index is not cached
+
+        Returns
+        -------
+        tuple(dict, dict, dict) - the root names, the invokable documents and pairs, and the
+            search indexes keyed by root id
+        """
+
+        names = {}
+        entries = {}
+        missing = []
+        # Read before the entries, so an index built from pairs invalidated meanwhile is not cached
+        generation = self.begin_load()
+        for id in ids:
+            data = self.get((model.__name__, str(id)))
+            if data is None:
+                missing.append(str(id))
+            else:
+                entries[str(id)] = bson.decode(data)
+        if missing:
+            roots, pairs = loader(missing)
+            for id in missing:
+                if id not in roots:
+                    continue
+                docs = {}
+                for pair in pairs.get(id, []):
+                    for document in pair:
+                        docs[str(document.id)] = document.to_mongo()
+                entry = {
+                    'name': roots[id].name,
+                    'docs': list(docs.values()),
+                    'pairs': [[str(c.id), str(p.id)] for c, p in pairs.get(id, [])]
+                }
+                data = bson.encode(entry)
+                self.put((model.__name__, id), data, len(data), generation)
+                entries[id] = bson.decode(data)
+        results = {}
+        indexes = {}
+        for id, entry in entries.items():
+            names[id] = entry['name']
+            docs = {str(son['_id']): model._from_son(son) for son in entry['docs']}
+            results[id] = [(docs[c], docs[p]) for c, p in entry['pairs']]
+            key = (model.__name__, id, 'search')
+            indexes[id] = self.get(key)
+            if indexes[id] is None:
+                indexes[id] = indexer(results[id])
+                self.put(key, indexes[id], indexes[id].get_size(), generation)
+        return names, results, indexes
+
+    def invalidate_trees(self, model, ids):
+        """
+        Remove the entries for a list of root documents
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class of the trees
+        ids : list(str)
+            The ObjectId string values of the root documents
+        """
+
+        for id in ids:
+            self.invalidate((model.__name__, str(id)))
+            self.invalidate((model.__name__, str(id), 'search'))
+
+
+class DialogSessions(Cache):
+    """
+    Paging state for the open dialog of each user
+
+    A session holds a description of the dialog's query, the item count, and for each page
+    read or prefetched the keyset cursor of its first and last items and a snapshot of
+    its documents. Navigation replies are served from the snapshot, and the page after
+    the one displayed is read in the background while the user reads. Sessions expire
+    after DISCORD_DIALOG_TTL seconds. Saves of the listed model call invalidate_model, which
+    drops the count, cursors and snapshots of its sessions so the next reply reads them
+    again. With the process dispatch mode each worker has its own sessions, so a reply
+    handled by another worker reads its page from the database.
+    """
+
+    def __init__(self, name, max_bytes=DIALOG_CACHE_BYTES, ttl=DIALOG_TTL):
+        super().__init__(name, max_bytes, ttl)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.prefetching = {}
+        self.prefetched = 0
+
+    @staticmethod
+    def get_key(user, command):
+        return ('Dialog', str(user.id), command)
+
+    def open_session(self, user, command, query, model):
+        """
+        Get the session for a user's dialog, or start a new one
+
+        Parameters
+        ----------
+        user : User
+            The user answering the dialog
+        command : str
+            The command that started the dialog
+        query : str
+            The description of the dialog's query; a session for another query is discarded
+        model : str
+            The name of the Document class listed by the dialog
+
+        Returns
+        -------
+        tuple(dict, bool) - the session with its query, model, version, count, page, cursors
+            and pages, and whether it was stored by an earlier reply
+        """
+
+        session = self.get(self.get_key(user, command))
+        if session is None or session['query'] != query:
+            return {'query': query, 'model': model, 'version': 0, 'count': None, 'page': 1, 'cursors': {}, 'pages': {}}, False
+        return session, True
+
+    def save_session(self, user, command, session):
+        """
+        Store the session for a user's dialog
+
+        Parameters
+        ----------
+        user : User
+            The user answering the dialog
+        command : str
+            The command that started the dialog
+        session : dict
+            The session to store
+        """
+
+        with self.lock:
+            data = bson.encode({'cursors': session['cursors'], 'pages': session['pages']})
+        self.put(self.get_key(user, command), session, len(data) + len(session['query']))
+
+    def end_session(self, user, command):
+        """
+        Remove the session for a user's dialog
+
+        Parameters
+        ----------
+        user : User
+            The user answering the dialog
+        command : str
+            The command that started the dialog
+        """
+
+        self.invalidate(self.get_key(user, command))
+
+    def invalidate_model(self, model):
+        """
+        Drop the count, cursors and snapshots of the sessions listing a model
+
+        Pages being read when the model is saved are discarded by set_page.
+
+        Parameters
+        ----------
+        model : str
+            The name of the Document class that was saved
+        """
+
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                session = entry[2]
+                if key[0] != 'Dialog' or session['model'] != model:
+                    continue
+                session['version'] += 1
+                session['count'] = None
+                session['cursors'] = {}
+                session['pages'] = {}
+                size = len(session['query'])
+                self.size -= entry[1] - size
+                self.entries[key] = (entry[0], size, session)
+                self.invalidations += 1
+
+    def get_version(self, session):
+        """Get the version of a session to pass to set_page before reading a page"""
+
+        with self.lock:
+            return session['version']
+
+    def get_cursor(self, session, page_num, end):
+        """
+        Get the sort key values of the first or last item on a page of a session
+
+        Parameters
+        ----------
+        session : dict
+            The session of the dialog
+        page_num : int
+            The number of the page
+        end : str
+            The end of the page ('first' or 'last')
+
+        Returns
+        -------
+        list - the sort key values (or None when the page was not read)
+        """
+
+        with self.lock:
+            return session['cursors'].get(str(page_num), {}).get(end, None)
+
+    def set_page(self, session, page_num, cursor, documents, version):
+        """
+        Add a page read from the database to a session
+
+        Parameters
+        ----------
+        session : dict
+            The session of the dialog
+        page_num : int
+            The number of the page
+        cursor : dict
+            The sort key values of the first and last items on the page
+        documents : list(mongoengine.Document)
+            The documents on the page
+        version : int
+            The value of get_version read before the page was read; the page is discarded
+            when the listed model was saved while it was reading
+        """
+
+        sons = [d.to_mongo() for d in documents]
+        with self.lock:
+            if session['version'] != version:
+                return
+            session['cursors'][str(page_num)] = cursor
+            session['pages'][str(page_num)] = sons
+
+    def get_page(self, session, page_num):
+        """
+        Get the snapshot of a page, waiting for it if it is being prefetched
+
+        Parameters
+        ----------
+        session : dict
+            The session of the dialog
+        page_num : int
+            The number of the page
+
+        Returns
+        -------
+        list(dict) - the documents on the page as read from the database (or None)
+        """
+
+        with self.lock:
+            future = self.prefetching.pop((id(session), page_num), None)
+        if future:
+            future.exception()
+        with self.lock:
+            return session['pages'].get(str(page_num), None)
+
+    def prefetch(self, user, command, session, page_num, reader):
+        """
+        Read a page of a session in the background
+
+        Parameters
+        ----------
+        user : User
+            The user answering the dialog
+        command : str
+            The command that started the dialog
+        session : dict
+            The session of the dialog
+        page_num : int
+            The number of the page
+        reader : function
+            Callable that reads the page and adds it to the session with set_page
+        """
+
+        key = self.get_key(user, command)
+
+        def run():
+            reader()
+            with self.lock:
+                self.prefetched += 1
+                self.prefetching.pop((id(session), page_num), None)
+                entry = self.entries.get(key, None)
+            # Store the session again so its size includes the new page
+            if entry and entry[2] is session:
+                self.save_session(user, command, session)
+
+        with self.lock:
+            if str(page_num) in session['pages'] or (id(session), page_num) in self.prefetching:
+                return
+            self.prefetching[(id(session), page_num)] = self.executor.submit(run)
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats.update(prefetched=self.prefetched, prefetching=len(self.prefetching))
+        return stats
+
+
+class UndoStacks(Cache):
+    """
+    Stacks of the most recent undoable change log ids for each user
+
+    Each entry holds a user's change log ids oldest first and the position of each id, so
+    undo last and redo next find the entry before or after the user's history position
+    without querying the Log collection. Logs created in this process are pushed onto the
+    cached stack; a stack whose newest id no longer matches the user's newest change log
+    (for example one written by another worker) is reloaded.
+    """
+
+    def __init__(self, name, max_bytes=CACHE_BYTES, ttl=CACHE_TTL, limit=UNDO_LIMIT):
+        super().__init__(name, max_bytes, ttl)
+        self.limit = limit
+
+    @staticmethod
+    def get_key(user_id):
+        return ('Undo', str(user_id))
+
+    @staticmethod
+    def get_size(stack):
+        return 64 + 48 * len(stack['ids'])
+
+    def load(self, user_id, top_id, loader):
+        """
+        Get a user's undo stack, loading it when it is missing or out of date
+
+        Parameters
+        ----------
+        user_id : str
+            The ObjectId string value of the user
+        top_id : str
+            The id of the user's newest undoable change log (or None)
+        loader : function
+            Callable taking the stack limit and returning the user's newest change log ids,
+            oldest first
+
+        Returns
+        -------
+        dict - the stack ids and the position of each id
+        """
+
+        key = self.get_key(user_id)
+        stack = self.get(key)
+        if stack is not None:
+            with self.lock:
+                if (stack['ids'][-1] if stack['ids'] else None) == top_id:
+                    return stack
+        generation = self.begin_load()
+        ids = loader(self.limit)
+        stack = {'ids': ids, 'positions': {id: i for i, id in enumerate(ids)}}
+        self.put(key, stack, self.get_size(stack), generation)
+        return stack
+
+    def push(self, user_id, id):
+        """
+        Add a new change log to a cached undo stack
+
+        Parameters
+        ----------
+        user_id : str
+            The ObjectId string value of the user
+        id : str
+            The ObjectId string value of the change log
+        """
+
+        with self.lock:
+            entry = self.entries.get(self.get_key(user_id), None)
+            if entry is None:
+                return
+            stack = entry[2]
+            stack['ids'].append(id)
+            stack['positions'][id] = len(stack['ids']) - 1
+            # Trim back to the limit once the stack doubles so positions are rebuilt rarely
+            if len(stack['ids']) > 2 * self.limit:
+                stack['ids'] = stack['ids'][-self.limit:]
+                stack['positions'] = {id: i for i, id in enumerate(stack['ids'])}
+
+
+DOCUMENTS = DocumentCache('Documents')
+SHEETS = SheetCache('Sheets')
+INVOKABLES = InvokableIndex('Invokables')
+DIALOGS = DialogSessions('Dialogs')
+UNDOS = UndoStacks('Undo Stacks')
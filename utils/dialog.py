@@ -5,6 +5,8 @@ __contact__ = 'u/ensosati'
 import math
 import copy
 import inflect
+from mongoengine import QuerySet, Q
+from utils.cache import DIALOGS
 p = inflect.engine()
 
 class Dialog(object):
@@ -109,6 +111,8 @@ class Dialog(object):
         question = ''
         paging_question = ''
         self.items = None
+        self.session = None
+        self.restored = False
         self.page_num = 1
         self.page_count = self.get_page_count()
         select_question = self.get_select_str()
@@ -119,8 +123,11 @@ class Dialog(object):
 
             # Handle navigation responses
             if self.page_count > 0 and answer and (answer in ['<<','<','>','>>'] or answer.isdigit()):
-                page_num_str = paging_question[paging_question.find('Page ')+5:paging_question.find(' of ')]
-                self.page_num = int(page_num_str)
+                if self.restored:
+                    self.page_num = self.session['page']
+                else:
+                    page_num_str = paging_question[paging_question.find('Page ')+5:paging_question.find(' of ')]
+                    self.page_num = int(page_num_str)
                 if answer.isdigit():
                     new_page_num = int(answer)
                     if new_page_num > self.page_count or new_page_num < 1:
@@ -141,11 +148,11 @@ class Dialog(object):
                 if not selection.isdigit():
                     raise Exception('Your selection is invalid')
                 item_num = int(selection)
-                self.items = list(self.get_entire_list())
-                if item_num < 1 or item_num > len(self.items):
+                if item_num < 1 or item_num > self.item_count:
                     raise Exception('Your selection is invalid')
+                item = self.get_item(item_num)
                 self.set_dialog()
-                return self.select(self.items[item_num-1])
+                return self.select(item)
 
             # Handle confirmation response
             elif answer.lower() in ['yes','y']:
@@ -182,21 +189,33 @@ class Dialog(object):
         self.user.command = command
         self.user.question = question
         self.user.answer = answer
+        if self.session is not None:
+            if command:
+                DIALOGS.save_session(self.user, self.command, self.session)
+            else:
+                DIALOGS.end_session(self.user, self.command)
         self.svc.save_user(self.user)
 
     def get_page_count(self):
-        """Get the total number of pages for the items to be displayed"""
+        """Get the total number of pages for the items to be displayed
 
-        method = self.getter.get('method', None)
-        if not method:
-            raise Exception('No data getter method supplied')
-        params = self.getter.get('params', None)
-        if not params:
-            raise Exception('No data getter params supplied')
-        self.items = method(**params, page_num=0)
-        if not isinstance(self.items, list):
-            self.items = list(self.items)
-        self.item_count = len(self.items)
+        Getters returning a QuerySet are counted by the database once per dialog session and
+        paged by get_page; other getters return the entire list.
+        """
+
+        self.query = self.get_entire_list()
+        if isinstance(self.query, QuerySet) and self.type != 'confirm':
+            self.items = None
+            if self.user.command != self.command:
+                DIALOGS.end_session(self.user, self.command)
+            self.session, self.restored = DIALOGS.open_session(self.user, self.command, repr((self.query._query, self.query._ordering)), self.query._document.__name__)
+            if self.session['count'] is None:
+                self.session['count'] = self.query.count()
+            self.item_count = self.session['count']
+        else:
+            self.items = self.query if isinstance(self.query, list) else list(self.query)
+            self.query = None
+            self.item_count = len(self.items)
         return math.ceil(self.item_count/self.page_size) if self.item_count else 0
 
     def get_page_str(self):
@@ -240,6 +259,8 @@ class Dialog(object):
         return select_str
 
     def get_list(self):
+        if self.query is not None:
+            return self.get_page()
         method = self.getter.get('method', None)
         if not method:
             raise Exception('No data getter method supplied')
@@ -259,6 +280,141 @@ class Dialog(object):
         self.items = method(**params, page_num=0)
         return self.items
 
+    def get_sort_keys(self):
+        """Get the (field, direction) sort keys of the query, ending with the unique id"""
+
+        keys = [(f, d) for f, d in (self.query._ordering or []) if f != '_id']
+        return keys + [('id', 1)]
+
+    @staticmethod
+    def get_order(keys, reverse=False):
+        return [('-' if (d < 0) != reverse else '+') + f for f, d in keys]
+
+    @staticmethod
+    def get_key_values(item, keys):
+        return [item.pk if f == 'id' else item[f] for f, d in keys]
+
+    @staticmethod
+    def get_after(keys, values, reverse=False):
+        """
+        Get the condition for the items sorted after a keyset position
+
+        Parameters
+        ----------
+        keys : list(tuple)
+            The (field, direction) sort keys
+        values : list
+            The sort key values of the item at the position
+        reverse : bool
+            Get the items sorted before the position instead
+
+        Returns
+        -------
+        Q - the query condition
+        """
+
+        condition = None
+        for i, (field, direction) in enumerate(keys):
+            op = 'gt' if (direction > 0) != reverse else 'lt'
+            q = Q(**{f'{field}__{op}': values[i]})
+            for (prior, d), value in zip(keys[:i], values[:i]):
+                q &= Q(**{prior: value})
+            condition = q if condition is None else condition | q
+        return condition
+
+    def get_page(self):
+        """
+        Get the current page from the dialog session, reading it when it is not in the snapshot
+
+        The page after the current page is then prefetched while the user reads.
+
+        Returns
+        -------
+        list(mongoengine.Document) - the items on the page
+        """
+
+        keys = self.get_sort_keys()
+        snapshot = DIALOGS.get_page(self.session, self.page_num)
+        if snapshot is None:
+            items = self.read_page(self.page_num, keys)
+        else:
+            items = [self.query._document._from_son(son) for son in snapshot]
+        self.session['page'] = self.page_num
+        if self.page_num < self.page_count:
+            next_num = self.page_num + 1
+            DIALOGS.prefetch(self.user, self.command, self.session, next_num, lambda: self.read_page(next_num, keys))
+        return items
+
+    def read_page(self, page_num, keys):
+        """
+        Read a page from the query and add it to the dialog session
+
+        Pages next to a page already read are read with keyset conditions on the sort keys
+        of its first or last item, and the last page by reading the query in reverse, so
+        paging costs the same at any depth. Jumps to other page numbers fall back to skip.
+
+        Parameters
+        ----------
+        page_num : int
+            The number of the page
+        keys : list(tuple)
+            The (field, direction) sort keys of the query
+
+        Returns
+        -------
+        list(mongoengine.Document) - the items on the page
+        """
+
+        version = DIALOGS.get_version(self.session)
+        previous = DIALOGS.get_cursor(self.session, page_num - 1, 'last')
+        following = DIALOGS.get_cursor(self.session, page_num + 1, 'first')
+        last_size = self.item_count - (self.page_count - 1) * self.page_size
+        if page_num == 1:
+            items = list(self.query.order_by(*self.get_order(keys)).limit(self.page_size))
+        elif page_num == self.page_count:
+            items = list(self.query.order_by(*self.get_order(keys, True)).limit(last_size))[::-1]
+        elif previous and None not in previous:
+            query = self.query.filter(self.get_after(keys, previous))
+            items = list(query.order_by(*self.get_order(keys)).limit(self.page_size))
+        elif following and None not in following:
+            query = self.query.filter(self.get_after(keys, following, reverse=True))
+            items = list(query.order_by(*self.get_order(keys, True)).limit(self.page_size))[::-1]
+        else:
+            items = list(self.query.order_by(*self.get_order(keys)).skip((page_num - 1) * self.page_size).limit(self.page_size))
+        if items:
+            cursor = {'first': self.get_key_values(items[0], keys), 'last': self.get_key_values(items[-1], keys)}
+            DIALOGS.set_page(self.session, page_num, cursor, items, version)
+        return items
+
+    def get_item(self, item_num):
+        """
+        Get the selected item
+
+        The id of an item on a page in the dialog session is taken from the snapshot, so
+        only the selected document is fetched (and only if it still matches the query).
+
+        Parameters
+        ----------
+        item_num : int
+            The number of the item in the entire list
+
+        Returns
+        -------
+        mongoengine.Document - the selected item
+        """
+
+        if self.query is None:
+            return self.items[item_num-1]
+        page_num = math.ceil(item_num/self.page_size)
+        offset = (item_num - 1) % self.page_size
+        snapshot = DIALOGS.get_page(self.session, page_num)
+        if snapshot and offset < len(snapshot):
+            item = self.query.filter(id=snapshot[offset]['_id']).first()
+            if item:
+                return item
+        keys = self.get_sort_keys()
+        return self.query.order_by(*self.get_order(keys)).skip(item_num - 1).first()
+
     def get_content(self, items):
         content = ''
         if items:
@@ -0,0 +1,163 @@
+# name_search.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import os
+import re
+from mongoengine.queryset.visitor import Q
+from dotenv import load_dotenv
+
+load_dotenv()
+# The most anchored matches read to rank a search
+SEARCH_LIMIT = int(os.getenv('DISCORD_SEARCH_LIMIT', '100') or 100)
+
+class NameSearch(object):
+    """
+    Indexed case-insensitive name lookups
+
+    Searchable models declare search_name (the lowercased name with single spaces) and
+    search_tokens (its words) and index them after guild. A search uses the best of the
+    stages below that has a match:
+
+        exact - search_name equals the search
+        prefix - search_name starts with the search
+        word prefix - every word of the search starts a word of the name
+        substring - search_name contains the search (the old icontains behavior)
+
+    The exact, prefix and word prefix stages are read with one projected query over the
+    prefix and word prefix index ranges and ranked in memory, and the search is answered
+    by the ids of the best stage. The read is ordered by search_name and stops at
+    DISCORD_SEARCH_LIMIT matches. An exact match sorts before the longer names it prefixes,
+    so it is only left out when that many word prefix matches sort before it. Only a search
+    without an anchored match falls back to the unanchored substring regex.
+
+    Usage:
+    ```
+        Scene.filter(guild=guild, search='dark forest', archived=False).first()
+    ```
+    """
+
+    # Fields maintained from the name of each searchable document
+    FIELDS = ['search_name', 'search_tokens']
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(str(name).lower().split())
+
+    @staticmethod
+    def tokens(name):
+        return re.findall(r'\w+', NameSearch.normalize(name))
+
+    @classmethod
+    def pre_save(cls, sender, document, **kwargs):
+        """
+        pre_save handler maintaining the search fields of searchable documents
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class being saved
+        document : mongoengine.Document
+            The document being saved
+        """
+
+        if 'search_name' not in document._fields:
+            return
+        name = document.name if document.name else ''
+        document.search_name = cls.normalize(name)
+        document.search_tokens = cls.tokens(name)
+
+    @classmethod
+    def get_stages(cls, search):
+        """
+        Get the queries for each search stage, best match first
+
+        Parameters
+        ----------
+        search : str
+            The search text
+
+        Returns
+        -------
+        list(Q) - the exact, prefix, word prefix and substring queries
+        """
+
+        key = cls.normalize(search)
+        words = cls.tokens(search)
+        stages = [
+            Q(search_name=key),
+            Q(search_name=re.compile('^' + re.escape(key)))
+        ]
+        if words:
+            word_prefix = Q(search_tokens=re.compile('^' + re.escape(words[-1])))
+            if len(words) > 1:
+                word_prefix &= Q(search_tokens__all=words[:-1])
+            stages.append(word_prefix)
+        stages.append(Q(search_name=re.compile(re.escape(key))))
+        return stages
+
+    @classmethod
+    def get_rank(cls, son, key, words):
+        """
+        Get the best anchored stage a stored document matches
+
+        Parameters
+        ----------
+        son : dict
+            The stored search fields of the document
+        key : str
+            The normalized search
+        words : list(str)
+            The words of the search
+
+        Returns
+        -------
+        int - 0 for exact, 1 for prefix, 2 for word prefix (or None when none match)
+        """
+
+        name = son.get('search_name', None) or ''
+        tokens = son.get('search_tokens', None) or []
+        if name == key:
+            return 0
+        if name.startswith(key):
+            return 1
+        if words and [t for t in tokens if t.startswith(words[-1])] and not [w for w in words[:-1] if w not in tokens]:
+            return 2
+        return None
+
+    @classmethod
+    def filter(cls, queryset, params):
+        """
+        Filter a queryset, replacing a 'search' param with the best search stage that matches
+
+        Parameters
+        ----------
+        queryset : mongoengine.QuerySet
+            The queryset of the searchable model
+        params : dict
+            The filter params, with the name to look for in 'search'
+
+        Returns
+        -------
+        mongoengine.QuerySet - the filtered queryset
+        """
+
+        params = dict(params)
+        search = params.pop('search', None)
+        queryset = queryset.filter(**params)
+        if not search:
+            return queryset
+        stages = cls.get_stages(search)
+        key = cls.normalize(search)
+        words = cls.tokens(search)
+        # The prefix stage includes the exact stage, so one query reads every anchored match
+        anchored = stages[1] | stages[2] if words else stages[1]
+        ranked = {}
+        sons = queryset.filter(anchored).order_by('search_name').limit(SEARCH_LIMIT)
+        for son in sons.only('id', 'search_name', 'search_tokens').as_pymongo():
+            rank = cls.get_rank(son, key, words)
+            if rank is not None:
+                ranked.setdefault(rank, []).append(son['_id'])
+        if ranked:
+            return queryset.filter(id__in=ranked[min(ranked)])
+        return queryset.filter(stages[-1])
@@ -0,0 +1,231 @@
+# subtree.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from bson.objectid import ObjectId
+from utils.time import T
+from utils.unit_of_work import UnitOfWork
+from utils.cache import DOCUMENTS, SHEETS, INVOKABLES, DIALOGS
+
+class Subtree(object):
+    """
+    Archive, restore and copy every document below a document with one write
+
+    Characters find their descendants through the ancestors index; the other models follow
+    parent_id one level per query. The descendants are updated with a single update_many,
+    which skips their signals, so their cache entries are dropped here and their ids are
+    added to the change log of the document being archived or restored. Undo and redo read
+    the ids back from that log to archive or restore the same descendants.
+
+    Usage:
+    ```
+        def reverse_archive(self, user):
+            Subtree.archive(self, user)
+    ```
+    """
+
+    # Key of the descendant ids in the change log
+    FIELD = 'descendant_ids'
+
+    @staticmethod
+    def get_ids(document, archived):
+        """
+        Get the ids of the descendants of a document with the given archived value
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document at the top of the subtree
+        archived : bool
+            The archived value of the descendants to find
+
+        Returns
+        -------
+        list(str) - the descendant ids
+        """
+
+        model = type(document)
+        if 'ancestors' in model._fields:
+            return [str(id) for id in model.objects(ancestors=str(document.id), archived=archived).scalar('id')]
+        ids = []
+        level = [str(document.id)]
+        while level:
+            children = list(model.objects(parent_id__in=level).scalar('id', 'archived'))
+            ids.extend(str(id) for id, a in children if bool(a) == archived)
+            level = [str(id) for id, a in children]
+        return ids
+
+    @staticmethod
+    def update(model, ids, archived, user, ancestors=None):
+        """
+        Set the archived value of a list of documents with one update
+
+        The update skips the save signals, so the sheets of the documents and of the
+        documents above them are invalidated here.
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class of the documents
+        ids : list(str)
+            The ObjectId string values of the documents
+        archived : bool
+            The archived value to set
+        user : User
+            The user to save as the updated_by
+        ancestors : list(str), optional
+            The ObjectId string values of the document the documents are below and its ancestors
+        """
+
+        if not ids:
+            return
+        update = {'set__archived': archived, 'set__updated_by': str(user.id), 'set__updated': T.now()}
+        if 'version' in model._fields:
+            update['inc__version'] = 1
+        model.objects(id__in=[ObjectId(id) for id in ids]).update(**update)
+        Subtree.invalidate(model, ids, ancestors)
+
+    @staticmethod
+    def invalidate(model, ids, ancestors=None):
+        """
+        Drop the cache entries of documents written without their save signals
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class of the documents
+        ids : list(str)
+            The ObjectId string values of the documents
+        ancestors : list(str), optional
+            The ObjectId string values of the document the documents are below and its ancestors
+        """
+
+        UnitOfWork.evict(model, ids)
+        for id in ids:
+            DOCUMENTS.invalidate((model.__name__, str(id)))
+        DIALOGS.invalidate_model(model.__name__)
+        if 'ancestors' in model._fields:
+            SHEETS.invalidate_sheets(list(ids) + list(ancestors or []))
+            INVOKABLES.invalidate_trees(model, list(ids) + list(ancestors or []))
+
+    @staticmethod
+    def get_ancestors(document):
+        """Get the ids of a document and its ancestors, whose sheets list its descendants"""
+
+        return [str(document.id)] + list(getattr(document, 'ancestors', None) or [])
+
+    @classmethod
+    def archive(cls, document, user):
+        """
+        Archive the descendants of a document before the document is archived
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document being archived
+        user : User
+            The user archiving the document
+        """
+
+        ids = cls.get_ids(document, False)
+        cls.update(type(document), ids, True, user, cls.get_ancestors(document))
+        document._subtree = ids
+
+    @classmethod
+    def restore(cls, document, user):
+        """
+        Restore the archived descendants of a document before the document is restored
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document being restored
+        user : User
+            The user restoring the document
+        """
+
+        ids = cls.get_ids(document, True)
+        cls.update(type(document), ids, False, user, cls.get_ancestors(document))
+        document._subtree = ids
+
+    @staticmethod
+    def clone(document, user, guild):
+        """
+        Copy a character and its unarchived descendants to a guild with one insert
+
+        The subtree is read with one query, every id is replaced in memory (including the
+        parent_id, ancestors and any other field holding an id from the subtree), and the
+        copies are written with one insert_many, which skips their signals.
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The character at the top of the subtree
+        user : User
+            The user who owns the copies
+        guild : str
+            The guild of the copies
+
+        Returns
+        -------
+        list(dict) - the inserted copies, the copy of the document first
+        """
+
+        model = type(document)
+        collection = model._get_collection()
+        root = str(document.id)
+        sons = list(collection.find({'$or': [{'_id': document.pk}, {'ancestors': root}]}))
+        # Parents come before their children, and an archived document is left out with everything below it
+        sons.sort(key=lambda son: (str(son['_id']) != root, len(son.get('ancestors', []))))
+        skipped = set()
+        ids = {}
+        copies = []
+        for son in sons:
+            id = str(son['_id'])
+            if id != root and (son.get('archived', False) or skipped.intersection(son.get('ancestors', []))):
+                skipped.add(id)
+                continue
+            ids[id] = str(ObjectId())
+            copies.append(son)
+        now = T.now()
+        def remap(value):
+            if isinstance(value, str):
+                return ids.get(value, value)
+            if isinstance(value, list):
+                return [remap(v) for v in value]
+            return value
+        for son in copies:
+            for key in son:
+                son[key] = remap(son[key])
+            son['_id'] = ObjectId(ids[str(son['_id'])])
+            son['user'] = user.id
+            son['guild'] = guild
+            son['created_by'] = son['updated_by'] = str(user.id)
+            son['created'] = son['updated'] = now
+            son.pop('history_id', None)
+        collection.insert_many(copies, ordered=True)
+        DIALOGS.invalidate_model(model.__name__)
+        if copies and 'ancestors' in model._fields:
+            # The copy keeps the parent of the document, whose sheet lists it
+            SHEETS.invalidate_sheets(copies[0].get('ancestors', []))
+            INVOKABLES.invalidate_trees(model, copies[0].get('ancestors', []))
+        return copies
+
+    @classmethod
+    def get_changes(cls, document):
+        """
+        Get the descendant ids to add to the change log of a saved document
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document that was saved
+
+        Returns
+        -------
+        dict - the descendant ids archived or restored with the document (or empty)
+        """
+
+        ids = getattr(document, '_subtree', None)
+        document._subtree = None
+        return {cls.FIELD: ids} if ids else {}
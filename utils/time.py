@@ -2,12 +2,15 @@
 __author__ = 'Ron Roth Jr'
 __contact__ = 'u/ensosati'
 
+import re
 import datetime
 import pytz
 from config.setup import Setup
 
 SETUP = Setup()
 TZ = SETUP.timezone
+# Units of the relative times accepted by T.since
+UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
 
 class T(object):
     @staticmethod
@@ -29,4 +32,42 @@ class T(object):
     def tz(d, timezone):
         tz = pytz.timezone(timezone)
         d_str = d.astimezone(tz).strftime('%m/%d %I:%M %p' if 'America' in timezone else '%m/%d %H:%M')
-        return d_str
\ No newline at end of file
+        return d_str
+
+    @staticmethod
+    def since(text, user=None):
+        """
+        Parse the start of a time range entered by a user
+
+        Accepts a relative time (30m, 2h, 1d or 10 minutes) or a time in the user's time
+        zone in the format used for display (07/04 18:30, 18:30 or 6:30 PM).
+
+        Parameters
+        ----------
+        text : str
+            The time entered by the user
+        user : User
+            The user whose time zone is used for absolute times
+
+        Returns
+        -------
+        datetime - the UTC time or None when the text is not a time
+        """
+
+        text = ' '.join(text.split()).strip()
+        relative = re.fullmatch(r'(\d+)\s*([smhd])[a-z]*( ago)?', text.lower())
+        if relative:
+            return T.now() - datetime.timedelta(**{UNITS[relative.group(2)]: int(relative.group(1))})
+        tz = pytz.timezone(user.time_zone if user and user.time_zone else TZ)
+        local = pytz.utc.localize(T.now()).astimezone(tz)
+        for pattern in ['%m/%d %H:%M', '%m/%d %I:%M %p', '%H:%M', '%I:%M %p']:
+            try:
+                parsed = datetime.datetime.strptime(text.upper(), pattern)
+            except ValueError:
+                continue
+            if '%m' in pattern:
+                parsed = parsed.replace(year=local.year)
+            else:
+                parsed = parsed.replace(year=local.year, month=local.month, day=local.day)
+            return tz.localize(parsed).astimezone(pytz.utc).replace(tzinfo=None)
+        return None
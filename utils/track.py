@@ -0,0 +1,213 @@
+# track.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+from config.setup import Setup
+
+SETUP = Setup()
+X = SETUP.x
+O = SETUP.o
+
+class Track(object):
+    """
+    A stress, consequence or counter track stored as its box values and a checked bitmask
+
+    Tracks are stored as {'boxes': ['1', '2'], 'checked': 2}, with bit i of checked set when
+    box i is checked (consequences also keep the aspect of each box in 'aspects'). Counts
+    and the first free box come from bit operations, and the [X] and [   ] marks are only
+    rendered for display. Tracks saved before the bitmask (lists of [value, mark] pairs,
+    and counters with a list of ticks) are read as well, until the track_bitsets migration
+    converts them.
+
+    Usage:
+    ```
+        track = Track.load(character.stress[0])
+        if track.count_free() >= 2:
+            track.check(2)
+        character.stress[0] = track.to_son()
+    ```
+    """
+
+    __slots__ = ('boxes', 'checked', 'aspects')
+
+    def __init__(self, boxes, checked=0, aspects=None):
+        self.boxes = [str(b) for b in boxes]
+        self.checked = checked
+        self.aspects = aspects
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @classmethod
+    def load(cls, son):
+        """
+        Read a stored track in the bitmask or the legacy format
+
+        Parameters
+        ----------
+        son : dict or list
+            The stored track
+
+        Returns
+        -------
+        Track - the track
+        """
+
+        if isinstance(son, Track):
+            return son
+        if isinstance(son, dict):
+            if 'ticks' in son:
+                ticks = son['ticks'] or []
+                return cls(['1'] * len(ticks), sum(1 << i for i in range(0, len(ticks)) if ticks[i] == X))
+            aspects = son.get('aspects', None)
+            return cls(son.get('boxes', None) or [], son.get('checked', 0) or 0, list(aspects) if aspects is not None else None)
+        boxes = list(son) if son else []
+        aspects = [b[2] if len(b) > 2 else '' for b in boxes] if [b for b in boxes if len(b) > 2] else None
+        return cls([b[0] for b in boxes], sum(1 << i for i in range(0, len(boxes)) if boxes[i][1] == X), aspects)
+
+    @classmethod
+    def load_all(cls, sons):
+        """Read a list of stored tracks (an empty list when there are none)"""
+
+        return [cls.load(son) for son in sons] if sons else []
+
+    @staticmethod
+    def is_stored(son):
+        """Whether a stored track is already in the bitmask format"""
+
+        return isinstance(son, dict) and 'checked' in son
+
+    def to_son(self):
+        """
+        Get the track in the stored format
+
+        Returns
+        -------
+        dict - the box values, checked bitmask and (for consequences) aspects
+        """
+
+        son = {'boxes': list(self.boxes), 'checked': self.checked}
+        if self.aspects is not None:
+            son['aspects'] = list(self.aspects)
+        return son
+
+    @classmethod
+    def to_sons(cls, sons):
+        """Convert a list of stored tracks in either format to the bitmask format"""
+
+        return [cls.load(son).to_son() for son in sons] if sons else sons
+
+    def get_full(self):
+        return (1 << len(self.boxes)) - 1
+
+    def is_checked(self, index):
+        return bool(self.checked >> index & 1)
+
+    def count_checked(self):
+        return bin(self.checked & self.get_full()).count('1')
+
+    def count_free(self):
+        return len(self.boxes) - self.count_checked()
+
+    def first_free(self):
+        """Get the index of the first unchecked box (or None when every box is checked)"""
+
+        free = ~self.checked & self.get_full()
+        return (free & -free).bit_length() - 1 if free else None
+
+    def last_checked(self):
+        """Get the index of the last checked box (or None when no box is checked)"""
+
+        checked = self.checked & self.get_full()
+        return checked.bit_length() - 1 if checked else None
+
+    def get_free_shifts(self):
+        """Get the shifts the unchecked boxes can absorb (each box absorbs its value)"""
+
+        return sum([int(self.boxes[i]) if self.boxes[i].isdigit() else 1 for i in range(0, len(self.boxes)) if not self.is_checked(i)])
+
+    def check(self, count=None):
+        """
+        Check boxes from the first unchecked box
+
+        Parameters
+        ----------
+        count : int
+            The number of boxes to check (or None for every box)
+
+        Returns
+        -------
+        int - the number of boxes checked
+        """
+
+        checked = 0
+        while (count is None or checked < count) and self.first_free() is not None:
+            self.checked |= 1 << self.first_free()
+            checked += 1
+        return checked
+
+    def clear(self, count=None):
+        """
+        Clear checked boxes from the last checked box
+
+        Parameters
+        ----------
+        count : int
+            The number of boxes to clear (or None for every box)
+
+        Returns
+        -------
+        int - the number of boxes cleared
+        """
+
+        cleared = 0
+        while (count is None or cleared < count) and self.last_checked() is not None:
+            self.checked &= ~(1 << self.last_checked())
+            cleared += 1
+        return cleared
+
+    def set_box(self, index, value, checked=False, aspect=None):
+        """
+        Set the value, check and aspect of one box (appending it after the last box)
+
+        Parameters
+        ----------
+        index : int
+            The index of the box
+        value : str
+            The box value (the shifts it absorbs)
+        checked : bool
+            Whether the box is checked
+        aspect : str
+            The consequence aspect of the box (or None when the track has no aspects)
+        """
+
+        if index >= len(self.boxes):
+            index = len(self.boxes)
+            self.boxes.append(str(value))
+            if self.aspects is not None:
+                self.aspects.append('')
+        self.boxes[index] = str(value)
+        self.checked = self.checked | 1 << index if checked else self.checked & ~(1 << index)
+        if aspect is not None or self.aspects is not None:
+            self.aspects = self.aspects if self.aspects is not None else [''] * len(self.boxes)
+            self.aspects[index] = aspect if aspect else ''
+
+    def select(self, indexes):
+        """Get a track with only the given boxes, in order"""
+
+        indexes = list(indexes)
+        checked = sum(1 << n for n in range(0, len(indexes)) if self.is_checked(indexes[n]))
+        aspects = [self.aspects[i] for i in indexes] if self.aspects is not None else None
+        return Track([self.boxes[i] for i in indexes], checked, aspects)
+
+    def get_aspect(self, index):
+        return self.aspects[index] if self.aspects and index < len(self.aspects) else ''
+
+    def get_mark(self, index):
+        return X if self.is_checked(index) else O
+
+    def get_marks(self):
+        """Get the display mark of each box"""
+
+        return [self.get_mark(i) for i in range(0, len(self.boxes))]
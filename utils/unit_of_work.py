@@ -0,0 +1,343 @@
+# unit_of_work.py
+__author__ = 'Ron Roth Jr'
+__contact__ = 'u/ensosati'
+
+import logging
+import functools
+import threading
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+class UnitOfWork(object):
+    """
+    Request-scoped identity map and dirty document tracker
+
+    A unit is started for each command handled by the bot. While it is active, every
+    get_by_id and find lookup on the models returns the same document instance for the
+    same id, so each document is fetched from Mongo at most once per command. Documents
+    saved through UnitOfWork.save are written once when the outermost unit exits.
+
+    Usage:
+    ```
+        uow = UnitOfWork.begin()
+        with uow:
+            user = User().find(name, guild)
+            user.module = 'Character'
+            UnitOfWork.save(user)
+    ```
+    """
+
+    local = threading.local()
+
+    def __init__(self, name=''):
+        """
+        Constructor for the UnitOfWork class
+
+        Parameters
+        ----------
+        name : str
+            The name used when reporting the unit (usually the command)
+        """
+
+        self.name = name
+        self.depth = 0
+        self.documents = {}
+        self.found = {}
+        self.dirty = {}
+        self.loads = 0
+        self.hits = 0
+        self.flushed = 0
+        self.round_trips = 0
+
+    @classmethod
+    def begin(cls, name=''):
+        """
+        Start a new unit of work for the current thread
+
+        Any unit left on the thread by a request that never finished is discarded.
+
+        Parameters
+        ----------
+        name : str
+            The name used when reporting the unit (usually the command)
+
+        Returns
+        -------
+        UnitOfWork - the active unit for the thread
+        """
+
+        cls.local.current = cls(name)
+        return cls.local.current
+
+    @classmethod
+    def current(cls):
+        """Get the active unit of work for the current thread or None"""
+
+        return getattr(cls.local, 'current', None)
+
+    def __enter__(self):
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                self.flush()
+            finally:
+                if UnitOfWork.current() is self:
+                    UnitOfWork.local.current = None
+                self.report()
+        return False
+
+    @staticmethod
+    def get_key(cls, id):
+        return (cls.__name__, str(id))
+
+    @classmethod
+    def load(cls, model, id, loader, cache=None):
+        """
+        Get a document by id from the identity map, loading it on the first request
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class being loaded
+        id : str
+            The ObjectId string value of the document
+        loader : function
+            Callable that fetches the document from Mongo
+        cache : DocumentCache, optional
+            The process-wide cache to read through before calling the loader
+
+        Returns
+        -------
+        mongoengine.Document - the canonical instance for the id (or None)
+        """
+
+        if cache and id:
+            loader = functools.partial(cache.load, model, id, loader)
+        uow = cls.current()
+        if uow is None or not id:
+            return loader()
+        key = cls.get_key(model, id)
+        if key in uow.documents:
+            uow.hits += 1
+            return uow.documents[key]
+        uow.loads += 1
+        return uow.attach(loader())
+
+    @classmethod
+    def get_loaded(cls, model, id):
+        """
+        Get a document already in the identity map without loading it
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class of the document
+        id : str
+            The ObjectId string value of the document
+
+        Returns
+        -------
+        mongoengine.Document - the canonical instance for the id (or None when it is not loaded)
+        """
+
+        uow = cls.current()
+        if uow is None or not id:
+            return None
+        return uow.documents.get(cls.get_key(model, id), None)
+
+    @classmethod
+    def find(cls, model, params, finder):
+        """
+        Get a document by exact lookup params from the identity map, loading it on the first request
+
+        Only documents that were found are remembered so a later create is never hidden.
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class being loaded
+        params : tuple
+            The exact lookup values (for example name and guild)
+        finder : function
+            Callable that fetches the document from Mongo
+
+        Returns
+        -------
+        mongoengine.Document - the canonical instance for the lookup (or None)
+        """
+
+        uow = cls.current()
+        if uow is None:
+            return finder()
+        key = (model.__name__,) + tuple(str(p) for p in params)
+        if key in uow.found:
+            uow.hits += 1
+            return uow.found[key]
+        uow.loads += 1
+        document = uow.attach(finder())
+        if document:
+            uow.found[key] = document
+        return document
+
+    @classmethod
+    def merge(cls, document):
+        """
+        Swap a document loaded by a query for the instance already in the identity map
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document returned by a query
+
+        Returns
+        -------
+        mongoengine.Document - the canonical instance for the document's id
+        """
+
+        uow = cls.current()
+        if uow is None:
+            return document
+        uow.loads += 1
+        return uow.attach(document)
+
+    def attach(self, document):
+        if document is None or document.pk is None:
+            return document
+        key = self.get_key(type(document), document.pk)
+        if key not in self.documents:
+            self.documents[key] = document
+        return self.documents[key]
+
+    @classmethod
+    def save(cls, document):
+        """
+        Save a document at the end of the unit of work (or immediately without one)
+
+        New documents are always saved immediately so they receive an id.
+
+        Parameters
+        ----------
+        document : mongoengine.Document
+            The document to save
+        """
+
+        uow = cls.current()
+        if uow is None or document.pk is None:
+            document.save()
+            return
+        key = cls.get_key(type(document), document.pk)
+        uow.documents[key] = document
+        uow.dirty[key] = document
+
+    @classmethod
+    def saved(cls, sender, document, **kwargs):
+        """
+        post_save handler keeping the identity map pointed at the latest saved instance
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class that was saved
+        document : mongoengine.Document
+            The document that was saved
+        """
+
+        uow = cls.current()
+        if uow is None or document.pk is None:
+            return
+        key = cls.get_key(type(document), document.pk)
+        if key in uow.documents and uow.documents[key] is not document:
+            uow.documents[key] = document
+            uow.found = {k: v for k, v in uow.found.items() if v.pk != document.pk}
+
+    @classmethod
+    def deleted(cls, sender, document, **kwargs):
+        """
+        post_delete handler removing a document from the identity map
+
+        Parameters
+        ----------
+        sender : mongoengine.Document
+            The Document class that was deleted
+        document : mongoengine.Document
+            The document that was deleted
+        """
+
+        uow = cls.current()
+        if uow is None or document.pk is None:
+            return
+        key = cls.get_key(type(document), document.pk)
+        uow.documents.pop(key, None)
+        uow.dirty.pop(key, None)
+        uow.found = {k: v for k, v in uow.found.items() if v.pk != document.pk}
+
+    @classmethod
+    def evict(cls, model, ids):
+        """
+        Remove documents changed by a bulk update from the identity map
+
+        Parameters
+        ----------
+        model : mongoengine.Document
+            The Document class that was updated
+        ids : list(str)
+            The ObjectId string values of the updated documents
+        """
+
+        uow = cls.current()
+        if uow is None:
+            return
+        ids = set(str(id) for id in ids)
+        for id in ids:
+            key = cls.get_key(model, id)
+            uow.documents.pop(key, None)
+            uow.dirty.pop(key, None)
+        uow.found = {k: v for k, v in uow.found.items() if type(v) is not model or str(v.pk) not in ids}
+
+    def flush(self):
+        """Write each dirty document once"""
+
+        dirty = list(self.dirty.values())
+        self.dirty = {}
+        for document in dirty:
+            if document._get_changed_fields():
+                document.save()
+                self.flushed += 1
+
+    def get_string(self):
+        """Get the number of loads, identity map hits, flushed saves and Mongo round trips"""
+
+        return f'{self.name}: {self.round_trips} round trips, {self.loads} loads, {self.hits} identity map hits, {self.flushed} flushed'
+
+    def report(self):
+        """Log the unit of work counters for the command"""
+
+        logger.info(self.get_string())
+
+
+class RoundTripListener(monitoring.CommandListener):
+    """
+    Count the Mongo commands issued while a unit of work is active
+
+    Command events are published on the thread issuing the command, so each one is
+    added to that thread's unit of work.
+    """
+
+    def started(self, event):
+        uow = UnitOfWork.current()
+        if uow:
+            uow.round_trips += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Listeners must be registered before the first MongoClient is created
+monitoring.register(RoundTripListener())